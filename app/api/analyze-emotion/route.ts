@@ -1,20 +1,60 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { createClient } from '@/lib/supabase/server';
 import { cookies } from 'next/headers';
-import { exec } from 'child_process';
-import { promisify } from 'util';
-import * as fs from 'fs/promises';
-import * as path from 'path';
+import {
+  EmotionQueueFullError,
+  ackEmotionJob,
+  cancelEmotionJob,
+  enqueueEmotionJob,
+  finishEmotionStream,
+  getEmotionJob,
+} from '@/lib/emotionInference';
 
-const execAsync = promisify(exec);
+// 推論ワーカーがダウンロードに使う署名付きURLの有効期限（秒）
+const SIGNED_URL_EXPIRES_SEC = 600;
+// この時間を過ぎても終わらないジョブは推論サーバーが取り消す（ブラウザが問い合わせをやめる時間と同じ）
+const JOB_TIMEOUT_MS = 5 * 60 * 1000;
 
+async function saveEmotionResult(recordingId: string, userId: string, emotionResult: any) {
+  // Save to emotion_analysis_results table
+  const { saveEmotionAnalysis } = await import('@/lib/db/emotionAnalysis');
+  const { updateDailySummaryEmotions } = await import('@/lib/db/dailySummary');
+
+  const saveResult = await saveEmotionAnalysis(
+    recordingId,
+    userId,
+    emotionResult.segments,
+    emotionResult.summary
+  );
+
+  if (!saveResult.success) {
+    console.error('Failed to save emotion analysis to DB:', saveResult.error);
+    // 保存失敗してもフロントエンドには結果を返す
+  } else {
+    console.log('Emotion analysis saved to DB:', saveResult.id);
+
+    // daily_summariesの感情データを更新
+    const date = new Date().toISOString().split('T')[0];
+    await updateDailySummaryEmotions(userId, date);
+  }
+  return saveResult.success;
+}
+
+/**
+ * 感情分析の依頼
+ *
+ * 録音中にストリーミング分析していれば残りの窓だけを推論してすぐ返す（200）。
+ * それ以外は推論サーバーのジョブキューに投入して 202 { jobId } を返すので、
+ * GET /api/analyze-emotion?jobId=xxx で結果を問い合わせる。キューが満杯なら 503。
+ * 結果が要らなくなったら DELETE /api/analyze-emotion?jobId=xxx で取り消す。
+ */
 export async function POST(request: NextRequest) {
   console.log('=== Emotion Analysis API Called ===');
-  
+
   try {
     const cookieStore = cookies();
     const supabase = createClient(cookieStore);
-    
+
     // 認証確認
     const { data: { user }, error: authError } = await supabase.auth.getUser();
     if (authError || !user) {
@@ -22,153 +62,146 @@ export async function POST(request: NextRequest) {
       return NextResponse.json({ error: 'Unauthorized' }, { status: 401 });
     }
 
-    const { recordingId, filePath } = await request.json();
-    console.log('Processing:', { recordingId, filePath });
-    
-    // Supabaseから音声ファイルをダウンロード（サーバーサイドで実行）
-    const { data, error: downloadError } = await supabase.storage
+    const { recordingId, filePath, streamSessionId } = await request.json();
+    console.log('Processing:', { recordingId, filePath, streamSessionId });
+
+    // 録音中にストリーミング分析していれば、残りの窓だけを推論して確定させる
+    if (streamSessionId) {
+      try {
+        // ブラウザが離れたら推論サーバー側の処理もやめさせる
+        const emotionResult = await finishEmotionStream(streamSessionId, user.id, request.signal);
+        console.log('Emotion result:', emotionResult);
+        const savedToDb = await saveEmotionResult(recordingId, user.id, emotionResult);
+        return NextResponse.json({ success: true, emotion: emotionResult, savedToDb });
+      } catch (error) {
+        if (request.signal.aborted) {
+          return NextResponse.json({ error: 'Client closed request' }, { status: 499 });
+        }
+        console.error('Stream finish failed, falling back to full analysis:', error);
+      }
+    }
+
+    // 推論ワーカーが Supabase から直接ダウンロードできるよう署名付きURLを渡す
+    const { data, error: signError } = await supabase.storage
       .from('voice-recordings')
-      .download(filePath);
-    
-    if (downloadError) {
-      console.error('Download error:', downloadError);
-      throw new Error(`Failed to download audio file: ${downloadError.message}`);
+      .createSignedUrl(filePath, SIGNED_URL_EXPIRES_SEC);
+    if (signError || !data) {
+      console.error('Signed URL error:', signError);
+      throw new Error(`Failed to sign audio file URL: ${signError?.message}`);
     }
-    
-    // Blobをバッファに変換
-    const buffer = Buffer.from(await data.arrayBuffer());
-    
-    // 一時ファイルとして保存
-    const tempDir = '/tmp';
-    const tempWavPath = path.join(tempDir, `audio_${recordingId}.wav`);
-    
-    // WAVファイルを書き込み（既にWAV形式なので変換不要）
-    await fs.writeFile(tempWavPath, buffer);
-    console.log(`Saved WAV file: ${tempWavPath} (${buffer.length} bytes)`);
-    
-    // Python感情分析実行
+
     try {
-      // Pythonスクリプトを一時ファイルに書き込む
-      const scriptPath = path.join(tempDir, `emotion_analysis_${recordingId}.py`);
-      const pythonScript = `
-import sys
-sys.path.append('/Users/komodatomo/Desktop/onsei-laboratory/vad_deeplearning')
-import librosa
-import soundfile as sf
-from inference import inference_core
-import json
-import os
-
-# 入力ファイルパス
-temp_wav = '${tempWavPath}'
-
-try:
-    # WAVファイルは既に正しい形式なので、そのまま使用
-    print(f"Using WAV file: {temp_wav}")
-    
-    # 感情分析実行
-    print("Running emotion analysis...")
-    result = inference_core(temp_wav)
-    
-    if result:
-        print(json.dumps(result))
-    else:
-        print(json.dumps({"error": "Analysis failed"}))
-except Exception as e:
-    import traceback
-    print(json.dumps({"error": str(e), "traceback": traceback.format_exc()}))
-finally:
-    # 一時ファイル削除
-    try:
-        if os.path.exists(temp_wav):
-            os.remove(temp_wav)
-    except:
-        pass
-`;
-      
-      await fs.writeFile(scriptPath, pythonScript);
-      
-      console.log('Executing Python script...');
-      const { stdout, stderr } = await execAsync(
-        `cd /Users/komodatomo/Desktop/onsei-laboratory/vad_deeplearning && python3 ${scriptPath}`,
-        {
-          env: {
-            ...process.env,
-            PYTHONIOENCODING: 'utf-8',
-          }
-        }
+      const job = await enqueueEmotionJob({
+        owner: user.id,
+        url: data.signedUrl,
+        recordingId,
+        file: filePath,
+        timeoutMs: JOB_TIMEOUT_MS,
+      });
+      console.log('Emotion job queued:', job.job_id, 'position:', job.position);
+      return NextResponse.json(
+        { jobId: job.job_id, status: job.status, position: job.position },
+        { status: 202 }
       );
-      
-      if (stderr) {
-        console.error('Python stderr:', stderr);
-      }
-      
-      console.log('Python stdout:', stdout);
-      
-      // 出力から警告を除外してJSONをパース
-      const lines = stdout.split('\n');
-      const jsonLine = lines.find(line => line.startsWith('{'));
-      
-      if (!jsonLine) {
-        throw new Error('No JSON output from Python script');
+    } catch (error) {
+      if (error instanceof EmotionQueueFullError) {
+        return NextResponse.json(
+          { error: 'Emotion analysis is busy, please retry later' },
+          { status: 503, headers: { 'Retry-After': String(error.retryAfterSec) } }
+        );
       }
-      
-      const emotionResult = JSON.parse(jsonLine);
-      console.log('Emotion result:', emotionResult);
+      throw error;
+    }
 
-      // エラーチェック
-      if (emotionResult.error) {
-        throw new Error(`Emotion analysis error: ${emotionResult.error}`);
-      }
+  } catch (error) {
+    console.error('Emotion analysis error:', error);
+    return NextResponse.json(
+      { error: error instanceof Error ? error.message : 'Analysis failed' },
+      { status: 500 }
+    );
+  }
+}
 
-      // Save to emotion_analysis_results table
-      const { saveEmotionAnalysis } = await import('@/lib/db/emotionAnalysis');
-      const { updateDailySummaryEmotions } = await import('@/lib/db/dailySummary');
+/**
+ * ジョブの結果の問い合わせ（GET /api/analyze-emotion?jobId=xxx）
+ *
+ * 待ち・処理中なら 202 { status, position }、終わっていれば POST の同期応答と同じ形を返す。
+ * 結果の保存は最初に ack できたリクエストだけが行う。
+ */
+export async function GET(request: NextRequest) {
+  try {
+    const cookieStore = cookies();
+    const supabase = createClient(cookieStore);
 
-      const saveResult = await saveEmotionAnalysis(
-        recordingId,
-        user.id,
-        emotionResult.segments,
-        emotionResult.summary
-      );
+    const { data: { user }, error: authError } = await supabase.auth.getUser();
+    if (authError || !user) {
+      return NextResponse.json({ error: 'Unauthorized' }, { status: 401 });
+    }
 
-      if (!saveResult.success) {
-        console.error('Failed to save emotion analysis to DB:', saveResult.error);
-        // 保存失敗してもフロントエンドには結果を返す
-      } else {
-        console.log('Emotion analysis saved to DB:', saveResult.id);
+    const jobId = request.nextUrl.searchParams.get('jobId');
+    if (!jobId) {
+      return NextResponse.json({ error: 'Missing jobId' }, { status: 400 });
+    }
 
-        // daily_summariesの感情データを更新
-        const date = new Date().toISOString().split('T')[0];
-        await updateDailySummaryEmotions(user.id, date);
-      }
+    const job = await getEmotionJob(jobId, user.id);
+    if (job.status === 'queued' || job.status === 'running') {
+      return NextResponse.json({ status: job.status, position: job.position }, { status: 202 });
+    }
+    if (job.status === 'failed') {
+      console.error('Emotion job failed:', job.error);
+      return NextResponse.json({ error: job.error || 'Analysis failed' }, { status: 500 });
+    }
+    if (job.status === 'cancelled') {
+      return NextResponse.json({ error: `Analysis ${job.error || 'cancelled'}` }, { status: 410 });
+    }
 
-      // クリーンアップ
-      await Promise.all([
-        fs.unlink(scriptPath).catch(() => {}),
-        fs.unlink(tempWavPath).catch(() => {})
-      ]);
+    // 推論サーバーが --timing 付きで動いていれば、ワーカーでのダウンロードを含む段階ごとの内訳が付く
+    if (job.result?.timing) {
+      console.log('Emotion timing:', job.result.timing);
+    }
 
-      return NextResponse.json({
-        success: true,
-        emotion: emotionResult,
-        savedToDb: saveResult.success
-      });
-      
-    } catch (error) {
-      console.error('Python execution error:', error);
-      // クリーンアップ
-      await Promise.all([
-        fs.unlink(tempWavPath).catch(() => {})
-      ]);
-      throw error;
+    let savedToDb: boolean | null = null;
+    if (job.status === 'done' && job.recording_id && await ackEmotionJob(jobId, user.id)) {
+      savedToDb = await saveEmotionResult(job.recording_id, user.id, job.result);
     }
-    
+    return NextResponse.json({ success: true, emotion: job.result, savedToDb });
   } catch (error) {
-    console.error('Emotion analysis error:', error);
+    console.error('Emotion job lookup error:', error);
     return NextResponse.json(
-      { error: error instanceof Error ? error.message : 'Analysis failed' },
+      { error: error instanceof Error ? error.message : 'Lookup failed' },
+      { status: 500 }
+    );
+  }
+}
+
+/**
+ * ジョブの取り消し（DELETE /api/analyze-emotion?jobId=xxx）
+ *
+ * 画面を離れたなどで結果が要らなくなったとき、推論サーバーのワーカーを空けるために呼ぶ。
+ */
+export async function DELETE(request: NextRequest) {
+  try {
+    const cookieStore = cookies();
+    const supabase = createClient(cookieStore);
+
+    const { data: { user }, error: authError } = await supabase.auth.getUser();
+    if (authError || !user) {
+      return NextResponse.json({ error: 'Unauthorized' }, { status: 401 });
+    }
+
+    const jobId = request.nextUrl.searchParams.get('jobId');
+    if (!jobId) {
+      return NextResponse.json({ error: 'Missing jobId' }, { status: 400 });
+    }
+
+    // 他人のジョブは推論サーバーが投入者を確認して断る
+    const cancelled = await cancelEmotionJob(jobId, user.id);
+    return NextResponse.json({ cancelled });
+  } catch (error) {
+    console.error('Emotion job cancel error:', error);
+    return NextResponse.json(
+      { error: error instanceof Error ? error.message : 'Cancel failed' },
       { status: 500 }
     );
   }
-}
\ No newline at end of file
+}
@@ -0,0 +1,41 @@
+import { NextRequest, NextResponse } from 'next/server';
+import { createClient } from '@/lib/supabase/server';
+import { cookies } from 'next/headers';
+import { pushEmotionStream, startEmotionStream } from '@/lib/emotionInference';
+
+/**
+ * 録音中のストリーミング感情分析
+ *
+ * POST /api/analyze-emotion/stream                 → セッション開始 { sessionId }
+ * POST /api/analyze-emotion/stream?sessionId=xxx   → 本文の録音チャンクを追加 { segments, duration }
+ *
+ * 録音停止後は /api/analyze-emotion に streamSessionId を渡すと、残りの窓だけを推論して保存する。
+ */
+export async function POST(request: NextRequest) {
+  try {
+    const cookieStore = cookies();
+    const supabase = createClient(cookieStore);
+
+    const { data: { user }, error: authError } = await supabase.auth.getUser();
+    if (authError || !user) {
+      return NextResponse.json({ error: 'Unauthorized' }, { status: 401 });
+    }
+
+    const sessionId = request.nextUrl.searchParams.get('sessionId');
+    if (!sessionId) {
+      const sampleRate = Number(request.nextUrl.searchParams.get('sampleRate')) || undefined;
+      const newSessionId = await startEmotionStream({ owner: user.id, sampleRate });
+      return NextResponse.json({ sessionId: newSessionId });
+    }
+
+    const chunk = await request.arrayBuffer();
+    const result = await pushEmotionStream(sessionId, user.id, chunk);
+    return NextResponse.json(result);
+  } catch (error) {
+    console.error('Emotion stream error:', error);
+    return NextResponse.json(
+      { error: error instanceof Error ? error.message : 'Stream failed' },
+      { status: 500 }
+    );
+  }
+}
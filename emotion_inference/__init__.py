@@ -0,0 +1,7 @@
+"""常駐型の感情推論サービス
+
+vad_deeplearning の CustomWav2Vec2Model を一度だけロードして保持し、
+Next.js の /api/analyze-emotion から呼び出せるようにする。
+
+    python3 -m emotion_inference.server
+"""
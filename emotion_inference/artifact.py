@@ -0,0 +1,79 @@
+"""オフラインで高速に起動するためのモデル成果物
+
+config・特徴量抽出の設定・重み（safetensors）を1つのディレクトリにまとめる。
+ロード時は Hugging Face Hub を見に行かず、ランダム初期化もせずに
+meta デバイス上で組み立てたモデルへメモリマップした重みをそのまま割り当てる。
+
+    python3 -m emotion_inference.artifact            # model_20241026_HCUDB/ を作る
+    python3 -m emotion_inference.artifact --output /srv/emotion-model
+"""
+import argparse
+import time
+from pathlib import Path
+
+import torch
+from safetensors.torch import load_file, save_file
+from transformers import Wav2Vec2Config, Wav2Vec2FeatureExtractor
+
+from .config import ARTIFACT_DIR, BASE_MODEL, MODEL_PATH
+
+WEIGHTS_NAME = "model.safetensors"
+
+
+def has_artifact(artifact_dir=ARTIFACT_DIR) -> bool:
+    return bool(artifact_dir) and (Path(artifact_dir) / WEIGHTS_NAME).exists()
+
+
+def convert(model_path=MODEL_PATH, output_dir=ARTIFACT_DIR) -> Path:
+    """Hub の config・前処理設定・AVDヘッドと .pkl の重みを1ディレクトリに書き出す（初回のみ）"""
+    from .heads import save_avd_head
+    from .model import checkpoint_id
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    Wav2Vec2Config.from_pretrained(BASE_MODEL).save_pretrained(output_dir)
+    Wav2Vec2FeatureExtractor.from_pretrained(BASE_MODEL).save_pretrained(output_dir)
+    save_avd_head(output_dir)
+
+    state_dict = torch.load(model_path, map_location=torch.device("cpu"))
+    save_file({k: v.contiguous() for k, v in state_dict.items()},
+              str(output_dir / WEIGHTS_NAME),
+              metadata={"source": checkpoint_id(model_path)})
+    return output_dir
+
+
+def load_artifact(artifact_dir=ARTIFACT_DIR):
+    """成果物ディレクトリからモデルと特徴量抽出器を組み立てる（ネットワーク不要）"""
+    from .model import _import_model_class
+
+    artifact_dir = Path(artifact_dir)
+    CustomWav2Vec2Model = _import_model_class()
+    config = Wav2Vec2Config.from_json_file(str(artifact_dir / "config.json"))
+    processor = Wav2Vec2FeatureExtractor.from_pretrained(str(artifact_dir),
+                                                         local_files_only=True)
+
+    # 重みを確保せずに構造だけ作り、メモリマップした重みを割り当てる
+    with torch.device("meta"):
+        model = CustomWav2Vec2Model(config)
+    model.load_state_dict(load_file(str(artifact_dir / WEIGHTS_NAME)), assign=True)
+    model.eval()
+    return model, processor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="オフライン起動用のモデル成果物を作る")
+    parser.add_argument("--model-path", default=str(MODEL_PATH))
+    parser.add_argument("--output", default=str(ARTIFACT_DIR))
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    output_dir = convert(args.model_path, args.output)
+    print(f"変換しました: {output_dir} ({time.perf_counter() - started:.1f}s)")
+
+    started = time.perf_counter()
+    load_artifact(output_dir)
+    print(f"成果物からのロード: {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
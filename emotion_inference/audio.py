@@ -0,0 +1,200 @@
+"""WAVの読み込み（librosa.load を使わない高速パス）
+
+WAVヘッダーを自前で解析し、PCM部分をメモリマップしたまま float32 に変換する。
+float32・モノラル・16kHz ならコピーなしのビューをそのまま返し、
+サンプリングレートが違う場合だけポリフェーズでリサンプリングする。
+WAV以外（WebMなど）は librosa.load にフォールバックする。
+"""
+import io
+import struct
+from math import gcd
+from typing import Callable, NamedTuple
+
+import numpy as np
+
+from .config import SAMPLING_RATE
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class WavFormatError(ValueError):
+    pass
+
+
+class WavInfo(NamedTuple):
+    format_tag: int
+    channels: int
+    sample_rate: int
+    bits_per_sample: int
+    data_offset: int
+    data_size: int
+
+
+def parse_wav_header(buf) -> WavInfo:
+    """RIFF/WAVE のチャンクをたどって fmt と data の位置を返す"""
+    if len(buf) < 12 or bytes(buf[0:4]) != b"RIFF" or bytes(buf[8:12]) != b"WAVE":
+        raise WavFormatError("Not a RIFF/WAVE file")
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(buf):
+        chunk_id = bytes(buf[pos:pos + 4])
+        chunk_size = struct.unpack("<I", bytes(buf[pos + 4:pos + 8]))[0]
+        body = pos + 8
+        if chunk_id == b"fmt ":
+            if body + 16 > len(buf):
+                raise WavFormatError("Truncated fmt chunk")
+            format_tag, channels, sample_rate = struct.unpack("<HHI", bytes(buf[body:body + 8]))
+            bits_per_sample = struct.unpack("<H", bytes(buf[body + 14:body + 16]))[0]
+            if format_tag == WAVE_FORMAT_EXTENSIBLE:
+                if body + 26 > len(buf):
+                    raise WavFormatError("Truncated fmt chunk")
+                # SubFormat GUID の先頭2バイトが実際のフォーマット
+                format_tag = struct.unpack("<H", bytes(buf[body + 24:body + 26]))[0]
+            fmt = (format_tag, channels, sample_rate, bits_per_sample)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise WavFormatError("data chunk before fmt chunk")
+            # ストリーミングで書かれたWAVはサイズが0や0xFFFFFFFFのことがある
+            available = len(buf) - body
+            if chunk_size == 0 or chunk_size > available:
+                chunk_size = available
+            return WavInfo(*fmt, data_offset=body, data_size=chunk_size)
+        pos = body + chunk_size + (chunk_size & 1)
+    raise WavFormatError("No data chunk")
+
+
+def _sample_dtype(info: WavInfo) -> np.dtype:
+    if info.format_tag == WAVE_FORMAT_PCM and info.bits_per_sample in (8, 16, 32):
+        return np.dtype({8: "u1", 16: "<i2", 32: "<i4"}[info.bits_per_sample])
+    if info.format_tag == WAVE_FORMAT_IEEE_FLOAT and info.bits_per_sample == 32:
+        return np.dtype("<f4")
+    raise WavFormatError(
+        f"Unsupported WAV format: tag={info.format_tag}, bits={info.bits_per_sample}"
+    )
+
+
+def pcm_to_float32(buf, info: WavInfo) -> np.ndarray:
+    """PCM部分をモノラル float32 にする（float32モノラルならコピーしない）"""
+    dtype = _sample_dtype(info)
+    frame_bytes = dtype.itemsize * info.channels
+    n_frames = info.data_size // frame_bytes
+    data = np.frombuffer(buf, dtype=dtype, count=n_frames * info.channels,
+                         offset=info.data_offset)
+
+    if dtype.kind == "f":
+        samples = data
+    elif dtype.kind == "u":
+        samples = np.subtract(data, 128, dtype=np.float32)
+        samples *= np.float32(1 / 128)
+    else:
+        scale = np.float32(1 / 2 ** (info.bits_per_sample - 1))
+        samples = np.multiply(data, scale, dtype=np.float32)
+
+    if info.channels > 1:
+        samples = samples.reshape(n_frames, info.channels).mean(axis=1, dtype=np.float32)
+    return samples
+
+
+def resample(audio: np.ndarray, orig_sr: int, target_sr: int = SAMPLING_RATE) -> np.ndarray:
+    """ポリフェーズフィルタでリサンプリング（44.1kHz → 16kHz なら 160/441）"""
+    if orig_sr == target_sr:
+        return audio
+    from scipy.signal import resample_poly
+
+    g = gcd(orig_sr, target_sr)
+    return resample_poly(audio, target_sr // g, orig_sr // g).astype(np.float32, copy=False)
+
+
+# 区間だけをリサンプリングするとき、両端でフィルタが届く範囲より多めに読む入力サンプル数
+RESAMPLE_MARGIN = 256
+
+
+def resampled_length(n_samples: int, orig_sr: int, target_sr: int = SAMPLING_RATE) -> int:
+    """全体を resample したときの長さ"""
+    g = gcd(orig_sr, target_sr)
+    up, down = target_sr // g, orig_sr // g
+    return -(-n_samples * up // down)
+
+
+def resample_range(read: Callable[[int, int], np.ndarray], n_samples: int, orig_sr: int,
+                   start: int, end: int, target_sr: int = SAMPLING_RATE) -> np.ndarray:
+    """全体を resample した結果の [start, end) だけを、必要な入力だけ読んで計算する
+
+    read(a, b) は入力の [a, b) を返す関数。入力の読み始めを down の倍数にそろえると
+    出力のサンプル位置が整数で対応し、両端に余白を付ければ全体を変換した値と一致する。
+    """
+    if orig_sr == target_sr:
+        return read(start, end)
+    from scipy.signal import resample_poly
+
+    g = gcd(orig_sr, target_sr)
+    up, down = target_sr // g, orig_sr // g
+    in_start = max(start * down // up - RESAMPLE_MARGIN, 0) // down * down
+    in_end = min(-(-end * down // up) + RESAMPLE_MARGIN, n_samples)
+    resampled = resample_poly(read(in_start, in_end), up, down)
+    out_offset = in_start // down * up
+    return resampled[start - out_offset:end - out_offset].astype(np.float32, copy=False)
+
+
+def decode_wav(buf, sr: int = SAMPLING_RATE) -> np.ndarray:
+    """WAVのバイト列（bytes / memmap）をモノラル float32・sr Hz にする"""
+    info = parse_wav_header(buf)
+    return resample(pcm_to_float32(buf, info), info.sample_rate, sr)
+
+
+def load_audio(path: str, sr: int = SAMPLING_RATE) -> np.ndarray:
+    """WAVはメモリマップで読み、それ以外は librosa.load にフォールバックする"""
+    try:
+        buf = np.memmap(path, dtype=np.uint8, mode="r")
+        return decode_wav(buf, sr)
+    except (WavFormatError, ValueError):
+        import librosa
+
+        audio, _ = librosa.load(path, sr=sr)
+        return audio
+
+
+def decode_audio_bytes(data: bytes, sr: int = SAMPLING_RATE) -> np.ndarray:
+    """メモリ上の音声バイト列をデコードする（一時ファイルを書かない）"""
+    try:
+        return decode_wav(np.frombuffer(data, dtype=np.uint8), sr)
+    except (WavFormatError, ValueError):
+        import librosa
+
+        audio, _ = librosa.load(io.BytesIO(data), sr=sr)
+        return audio
+
+
+class WavFileReader:
+    """WAVファイルから必要な区間だけを読む（長い録音を全部メモリに載せないため）
+
+    メモリマップは触ったページが常駐メモリに残るので、区間ごとに read する。
+    """
+
+    def __init__(self, path: str, sr: int = SAMPLING_RATE):
+        self.path = path
+        self.sr = sr
+        header = np.memmap(path, dtype=np.uint8, mode="r")
+        try:
+            self.info = parse_wav_header(header)
+        finally:
+            del header
+        self._dtype = _sample_dtype(self.info)
+        self._frame_bytes = self._dtype.itemsize * self.info.channels
+        self.n_input = self.info.data_size // self._frame_bytes
+        # sr Hz に直したときの長さ
+        self.n_samples = resampled_length(self.n_input, self.info.sample_rate, sr)
+
+    def _read_input(self, start: int, end: int) -> np.ndarray:
+        with open(self.path, "rb") as f:
+            f.seek(self.info.data_offset + start * self._frame_bytes)
+            data = f.read((end - start) * self._frame_bytes)
+        info = self.info._replace(data_offset=0, data_size=len(data))
+        return pcm_to_float32(np.frombuffer(data, dtype=np.uint8), info)
+
+    def read(self, start: int, end: int) -> np.ndarray:
+        """sr Hz での [start, end) を返す"""
+        return resample_range(self._read_input, self.n_input, self.info.sample_rate,
+                              start, min(end, self.n_samples), self.sr)
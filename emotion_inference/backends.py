@@ -0,0 +1,111 @@
+"""推論バックエンド（eager PyTorch / TorchScript / ONNX Runtime）
+
+どのバックエンドも NumPy の input_values・attention_mask を受け取り、
+生の出力 [B, len(output_names)] を NumPy で返す。
+"""
+from typing import Optional
+
+import numpy as np
+import torch
+
+from .config import EMOTIONS
+from .heads import MultiHeadModel
+from .model import forward_batch, pool_hidden
+
+
+class TorchBackend:
+    """eager PyTorch。MultiHeadModel を渡すと全ヘッドの出力を連結して返す"""
+    name = "torch"
+
+    def __init__(self, model, device: str = "cpu"):
+        self.model = model
+        self.device = device
+        if isinstance(model, MultiHeadModel):
+            self.output_names = model.output_names
+        else:
+            self.output_names = EMOTIONS
+
+    def __call__(self, input_values: np.ndarray,
+                 attention_mask: Optional[np.ndarray] = None) -> np.ndarray:
+        input_values = torch.from_numpy(input_values).to(self.device)
+        if attention_mask is not None:
+            attention_mask = torch.from_numpy(attention_mask).to(self.device)
+        with torch.inference_mode():
+            if isinstance(self.model, MultiHeadModel):
+                output = self.model(input_values, attention_mask)
+            else:
+                output = forward_batch(self.model, input_values, attention_mask)
+        return output.to("cpu").numpy()
+
+    def embed(self, input_values: np.ndarray,
+              attention_mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """fc層に入る直前のプーリング済み埋め込み [B, hidden_size]"""
+        model = self.model.model if isinstance(self.model, MultiHeadModel) else self.model
+        input_values = torch.from_numpy(input_values).to(self.device)
+        if attention_mask is not None:
+            attention_mask = torch.from_numpy(attention_mask).to(self.device)
+        with torch.inference_mode():
+            pooled = pool_hidden(model, input_values, attention_mask)
+        return pooled.to("cpu").numpy()
+
+    def hidden(self, input_values: np.ndarray) -> np.ndarray:
+        """プーリング前の隠れ状態 [B, フレーム数, hidden_size]（長い音声を区切って処理する用）"""
+        model = self.model.model if isinstance(self.model, MultiHeadModel) else self.model
+        with torch.inference_mode():
+            hidden = model.wav2vec2(torch.from_numpy(input_values).to(self.device))[0]
+        return hidden.to("cpu").numpy()
+
+    def heads(self, pooled: np.ndarray) -> np.ndarray:
+        """プーリング済み埋め込みから __call__ と同じ列の出力を計算する"""
+        pooled = torch.from_numpy(pooled).to(self.device)
+        with torch.inference_mode():
+            if isinstance(self.model, MultiHeadModel):
+                output = self.model.heads(pooled)
+            else:
+                output = self.model.fc(pooled)
+        return output.to("cpu").numpy()
+
+
+class TorchScriptBackend:
+    """export.py で trace したモデルを読む（マスクは常に渡す）"""
+    name = "torchscript"
+    output_names = EMOTIONS
+
+    def __init__(self, path, device: str = "cpu"):
+        self.module = torch.jit.load(str(path), map_location=device)
+        self.module.eval()
+        self.device = device
+
+    def __call__(self, input_values: np.ndarray,
+                 attention_mask: Optional[np.ndarray] = None) -> np.ndarray:
+        if attention_mask is None:
+            attention_mask = np.ones(input_values.shape, dtype=np.int64)
+        with torch.inference_mode():
+            output = self.module(torch.from_numpy(input_values).to(self.device),
+                                 torch.from_numpy(attention_mask).to(self.device))
+        return output.to("cpu").numpy()
+
+
+class OnnxBackend:
+    """export.py で書き出した ONNX グラフを ONNX Runtime（CPU）で実行する"""
+    name = "onnx"
+    output_names = EMOTIONS
+
+    def __init__(self, path, num_threads: int = 0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(str(path), options,
+                                            providers=["CPUExecutionProvider"])
+
+    def __call__(self, input_values: np.ndarray,
+                 attention_mask: Optional[np.ndarray] = None) -> np.ndarray:
+        if attention_mask is None:
+            attention_mask = np.ones(input_values.shape, dtype=np.int64)
+        (output,) = self.session.run(None, {
+            "input_values": input_values.astype(np.float32, copy=False),
+            "attention_mask": attention_mask.astype(np.int64, copy=False),
+        })
+        return output
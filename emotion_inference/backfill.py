@@ -0,0 +1,401 @@
+"""録音アーカイブ全体の再分析（チェックポイントや補正を変えたとき用）
+
+analyze_sad_bias.py のように inference_core を1ファイルずつ回す代わりに、
+デコードはプロセスプールで並列に行い、複数ファイルの窓をまとめてバッチ推論する。
+結果は1ファイル1行のJSONLに追記していくので、中断しても同じコマンドで続きから再開できる。
+
+    python3 -m emotion_inference.backfill recordings/ --output backfill.jsonl
+    python3 -m emotion_inference.backfill recordings/ --output backfill.jsonl --parquet backfill.parquet
+    python3 -m emotion_inference.backfill recordings/ --output backfill.jsonl --ipc 127.0.0.1:8766
+
+--ipc を付けるとモデルを読み込まず、常駐サーバーに priority="backfill" で依頼する。
+ユーザーの分析と同じワーカーを使っても、サーバーのスケジューラー（scheduler.py）が
+interactive のバッチを先に流すので、ユーザー側の待ち時間は伸びない。
+
+recordings/ は voice-recordings バケットのローカルコピー（{user_id}/{timestamp}_{turn}.wav）。
+各行の file_path は voice_recordings.file_path と同じなので、recording_id はそれで引ける。
+
+ローカルにコピーせず、バケットのURLを root にして直接読むこともできる（対象は --files-from で渡す）。
+ダウンロードは storage.py の接続プールで次の --prefetch 件を並行して進めておくので、
+推論している間に次のファイルが揃い、ダウンロード待ちで止まらない。
+
+    python3 -m emotion_inference.backfill "$EMOTION_STORAGE_URL" --files-from paths.txt --output backfill.jsonl
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from .audio import decode_audio_bytes, load_audio
+from .calibration import load_profile
+from .config import (
+    AVD_KEYS, BACKEND, CORRECTION_PROFILE, EMOTIONS, QUANTIZE, STORAGE_PREFETCH, YOUDEN_CORRECTION,
+)
+from .embeddings import EmbeddingStore, segment_key
+from .storage import StorageClient, default_client, object_url
+
+AUDIO_EXTENSIONS = (".wav", ".webm")
+# 1回のバッチ推論に入れる窓の数の目安（ファイルをまたいでまとめる）
+BATCH_WINDOWS = 16
+
+
+def decode_pool(workers: int) -> ProcessPoolExecutor:
+    """デコード用のプロセスプール
+
+    spawn で起動するので、ワーカーは numpy/scipy だけを読み込み torch の重みやスレッドを持たない。
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def is_remote(root: str) -> bool:
+    """root がバケットのURL（ローカルのディレクトリではない）か"""
+    return str(root).startswith(("http://", "https://"))
+
+
+def find_recordings(root, extensions: Sequence[str] = AUDIO_EXTENSIONS) -> List[str]:
+    """root 以下の音声ファイルを root からの相対パス（ストレージのパス）で返す"""
+    root = Path(root)
+    return sorted(
+        path.relative_to(root).as_posix()
+        for path in root.rglob("*")
+        if path.is_file() and path.suffix.lower() in extensions
+    )
+
+
+def load_done(output) -> Set[str]:
+    """出力済みのJSONLから処理が終わったファイルを集める（エラーの行は再試行する）"""
+    done: Set[str] = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                # 書き込み途中で止まった最後の行
+                continue
+            if "error" not in row:
+                done.add(row["file_path"])
+    return done
+
+
+def _decode(root: str, file_path: str) -> Tuple[str, Optional[np.ndarray], Optional[str]]:
+    """ワーカープロセスで音声を読む（例外は文字列にして返す）"""
+    try:
+        return file_path, load_audio(os.path.join(root, file_path)), None
+    except Exception as e:
+        return file_path, None, f"{type(e).__name__}: {e}"
+
+
+def _decode_bytes(file_path: str, data: bytes) -> Tuple[str, Optional[np.ndarray], Optional[str]]:
+    """ダウンロードした音声をワーカープロセスでデコードする"""
+    try:
+        return file_path, decode_audio_bytes(data), None
+    except Exception as e:
+        return file_path, None, f"{type(e).__name__}: {e}"
+
+
+def _submit_decodes(pool: ProcessPoolExecutor, root: str, files: Sequence[str],
+                    storage: Optional[StorageClient], download_ahead: int) -> Iterator[Future]:
+    """files のデコードを順に投入する。root がURLなら download_ahead 件先までダウンロードしておく"""
+    if not is_remote(root):
+        for file_path in files:
+            yield pool.submit(_decode, root, file_path)
+        return
+    storage = storage or default_client()
+    urls = (object_url(file_path, root) for file_path in files)
+    for file_path, (_, data, error) in zip(files, storage.prefetch(urls, ahead=download_ahead)):
+        if error is not None:
+            future = Future()
+            future.set_result((file_path, None, error))
+            yield future
+        else:
+            yield pool.submit(_decode_bytes, file_path, data)
+
+
+def decode_all(pool: ProcessPoolExecutor, root: str, files: Sequence[str], prefetch: int,
+               storage: Optional[StorageClient] = None, download_ahead: int = STORAGE_PREFETCH,
+               ) -> Iterator[Tuple[str, Optional[np.ndarray], Optional[str]]]:
+    """先読みを prefetch 件までに抑えつつ、デコード結果を files の順に返す"""
+    pending = deque()
+    for future in _submit_decodes(pool, root, files, storage, download_ahead):
+        pending.append(future)
+        if len(pending) >= prefetch:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def to_row(file_path: str, result: Dict[str, Any], model_id: str) -> Dict[str, Any]:
+    """emotion_analysis_results に一括投入できる形の1行にする"""
+    summary = result["summary"]
+    segments = [
+        {key: seg[key] for key in ("segment_id", "start", "end", "duration", *AVD_KEYS, "emotion")}
+        for seg in result["segments"]
+    ]
+    return dict(
+        file_path=file_path,
+        user_id=file_path.split("/", 1)[0] if "/" in file_path else None,
+        segments=segments,
+        total_segments=summary["total_segments"],
+        **{f"avg_{key}": summary[f"avg_{key}"] for key in AVD_KEYS},
+        dominant_emotion=summary["dominant_emotion"],
+        **{emo: result[emo] for emo in EMOTIONS},
+        emo=result["emo"],
+        model_id=model_id,
+    )
+
+
+def _write_error(out, file_path: str, error: str) -> None:
+    out.write(json.dumps(dict(file_path=file_path, error=error), ensure_ascii=False) + "\n")
+
+
+def backfill(engine, root: str, files: Sequence[str], output: str, workers: int,
+             mode: str = "vad", trim: bool = False, batch_windows: int = BATCH_WINDOWS,
+             pool: Optional[ProcessPoolExecutor] = None, storage: Optional[StorageClient] = None,
+             download_ahead: int = STORAGE_PREFETCH,
+             embedding_store: Optional[EmbeddingStore] = None) -> Dict[str, int]:
+    """files を分析して output に追記する。処理件数を返す
+
+    root がバケットのURLなら storage（省略時は共有クライアント）でダウンロードしながら処理する。
+    embedding_store を渡すと、同じ順伝播で窓ごとの埋め込みも保存する（キーは segment_key）。
+    """
+    from .segments import build_result, window_clips
+
+    counts = dict(done=0, errors=0)
+    # (file_path, windows, clips) をバッチ推論まで溜める
+    pending: List[Tuple[str, list, list]] = []
+
+    def infer(items):
+        clips = [clip for _, _, file_clips in items for clip in file_clips]
+        if embedding_store is None:
+            raws = engine.infer_batch(clips)
+        else:
+            raws, pooled = engine.infer_embed_batch(clips)
+            embedding_store.save([segment_key(file_path, i + 1)
+                                  for file_path, _, file_clips in items
+                                  for i in range(len(file_clips))], pooled)
+        rows, offset = [], 0
+        for file_path, windows, file_clips in items:
+            result = build_result(engine, windows, raws[offset:offset + len(file_clips)])
+            offset += len(file_clips)
+            rows.append(to_row(file_path, result, engine.model_id))
+        return rows
+
+    def flush(out):
+        try:
+            rows = infer(pending)
+        except Exception:
+            # バッチのどれかで失敗したら1ファイルずつやり直し、失敗したものだけエラーの行にする
+            rows = []
+            for item in pending:
+                try:
+                    rows += infer([item])
+                except Exception as e:
+                    _write_error(out, item[0], f"{type(e).__name__}: {e}")
+                    counts["errors"] += 1
+        for row in rows:
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            counts["done"] += 1
+        out.flush()
+        pending.clear()
+
+    own_pool = pool is None
+    pool = pool or decode_pool(workers)
+    started = time.perf_counter()
+    try:
+        with open(output, "a", encoding="utf-8") as out:
+            n_windows = 0
+            for file_path, audio, error in decode_all(pool, root, files, workers * 4,
+                                                      storage, download_ahead):
+                if error is None:
+                    try:
+                        windows, clips, _ = window_clips(audio, mode, trim=trim)
+                    except ValueError as e:
+                        error = str(e)
+                if error is not None:
+                    _write_error(out, file_path, error)
+                    counts["errors"] += 1
+                    continue
+                pending.append((file_path, windows, clips))
+                n_windows += len(clips)
+                if n_windows >= batch_windows:
+                    flush(out)
+                    n_windows = 0
+                    total = counts["done"] + counts["errors"]
+                    elapsed = time.perf_counter() - started
+                    print(f"  {total}/{len(files)} ({total / elapsed:.2f} files/sec)")
+            if pending:
+                flush(out)
+    finally:
+        if own_pool:
+            pool.shutdown()
+    return counts
+
+
+def backfill_remote(client, root: str, files: Sequence[str], output: str, workers: int,
+                    mode: str = "vad", trim: bool = False, max_in_flight: int = BATCH_WINDOWS,
+                    pool: Optional[ProcessPoolExecutor] = None,
+                    storage: Optional[StorageClient] = None,
+                    download_ahead: int = STORAGE_PREFETCH) -> Dict[str, int]:
+    """backfill と同じだが、推論は ipc.IpcClient の先のサーバーに backfill の優先度で依頼する
+
+    依頼中のファイルは max_in_flight 件まで（サーバーのキューを backfill で埋めないように）。
+    """
+    model_id = client.health().get("model_id", "")
+    counts = dict(done=0, errors=0)
+    in_flight = deque()
+
+    def finish(out):
+        file_path, future = in_flight.popleft()
+        try:
+            result = future.result()
+        except Exception as e:
+            _write_error(out, file_path, f"{type(e).__name__}: {e}")
+            counts["errors"] += 1
+        else:
+            out.write(json.dumps(to_row(file_path, result, model_id), ensure_ascii=False) + "\n")
+            counts["done"] += 1
+        out.flush()
+
+    own_pool = pool is None
+    pool = pool or decode_pool(workers)
+    try:
+        with open(output, "a", encoding="utf-8") as out:
+            for file_path, audio, error in decode_all(pool, root, files, workers * 4,
+                                                      storage, download_ahead):
+                if error is not None:
+                    _write_error(out, file_path, error)
+                    counts["errors"] += 1
+                    continue
+                in_flight.append((file_path, client.submit_analyze(
+                    pcm=audio, file=file_path, windows=mode, trim=trim, priority="backfill",
+                )))
+                if len(in_flight) >= max_in_flight:
+                    finish(out)
+            while in_flight:
+                finish(out)
+    finally:
+        if own_pool:
+            pool.shutdown()
+    return counts
+
+
+def write_parquet(jsonl_path: str, parquet_path: str) -> int:
+    """JSONLをParquetに変換する（同じファイルは最後の行を使い、エラーの行は除く）"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet output requires pyarrow (pip install pyarrow)")
+
+    rows: Dict[str, Dict[str, Any]] = {}
+    with open(jsonl_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "error" not in row:
+                rows[row["file_path"]] = row
+    pq.write_table(pa.Table.from_pylist(list(rows.values())), parquet_path)
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="録音アーカイブ全体の再分析")
+    parser.add_argument("root", help="voice-recordings バケットのローカルコピーか、バケットのURL")
+    parser.add_argument("--files-from", default=None,
+                        help="対象の file_path を1行1件で書いたファイル（root がURLのときは必須）")
+    parser.add_argument("--prefetch", type=int, default=STORAGE_PREFETCH,
+                        help="root がURLのとき、並行して先にダウンロードしておくファイル数")
+    parser.add_argument("--output", required=True, help="結果のJSONL（追記・再開用）")
+    parser.add_argument("--parquet", default=None, help="最後にParquetにも書き出す")
+    parser.add_argument("--windows", choices=["vad", "fixed"], default="vad")
+    parser.add_argument("--trim", action="store_true", help="窓の中の無音を削ってから推論する")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 4),
+                        help="デコード用のプロセス数")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="推論のスレッド数（省略時は残りのコア数）")
+    parser.add_argument("--batch-windows", type=int, default=BATCH_WINDOWS)
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--backend", choices=["torch", "onnx", "torchscript"], default=BACKEND)
+    parser.add_argument("--quantize", action="store_true", default=QUANTIZE)
+    parser.add_argument("--correction", action="store_true", help="Youden Index補正を有効にする")
+    parser.add_argument("--correction-profile", default=CORRECTION_PROFILE)
+    parser.add_argument("--embeddings", default=None, metavar="DIR",
+                        help="窓ごとの埋め込みも保存する（embeddings.py rescore 用、--ipc とは併用不可）")
+    parser.add_argument("--ipc", default=None, metavar="HOST:PORT",
+                        help="モデルを読み込まず、常駐サーバーに backfill の優先度で依頼する")
+    args = parser.parse_args()
+    if args.embeddings and args.ipc:
+        parser.error("--embeddings cannot be used with --ipc")
+
+    if args.files_from:
+        with open(args.files_from, encoding="utf-8") as f:
+            files = [line.strip() for line in f if line.strip()]
+    elif is_remote(args.root):
+        parser.error("--files-from is required when root is a URL")
+    else:
+        files = find_recordings(args.root)
+    done = load_done(args.output)
+    todo = [f for f in files if f not in done]
+    print(f"{len(files)} 件中 {len(done)} 件は処理済み、残り {len(todo)} 件")
+
+    if todo and args.ipc:
+        from .ipc import IpcClient
+
+        host, _, port = args.ipc.rpartition(":")
+        started = time.perf_counter()
+        with IpcClient(host, int(port)) as client, decode_pool(args.workers) as pool:
+            counts = backfill_remote(client, args.root, todo, args.output, args.workers,
+                                     mode=args.windows, trim=args.trim,
+                                     max_in_flight=args.batch_windows, pool=pool,
+                                     download_ahead=args.prefetch)
+    elif todo:
+        import torch
+
+        from .engine import EmotionEngine
+
+        threads = args.threads or max(1, (os.cpu_count() or 1) - args.workers)
+        torch.set_num_threads(threads)
+
+        correction = YOUDEN_CORRECTION if args.correction else None
+        if args.correction_profile:
+            correction = load_profile(args.correction_profile)
+        engine = EmotionEngine.load(device=args.device, quantize=args.quantize,
+                                    backend=args.backend, correction=correction)
+        print(f"デコード {args.workers} プロセス / 推論 {threads} スレッド")
+
+        started = time.perf_counter()
+        with decode_pool(args.workers) as pool:
+            counts = backfill(engine, args.root, todo, args.output, args.workers,
+                              mode=args.windows, trim=args.trim,
+                              batch_windows=args.batch_windows, pool=pool,
+                              download_ahead=args.prefetch,
+                              embedding_store=EmbeddingStore(args.embeddings)
+                              if args.embeddings else None)
+        if args.embeddings:
+            n = EmbeddingStore(args.embeddings).compact()
+            print(f"埋め込み {n} 件を {args.embeddings} に保存")
+    if todo:
+        elapsed = time.perf_counter() - started
+        print(f"完了: {counts['done']} 件（エラー {counts['errors']} 件）を {elapsed:.1f}s で処理 "
+              f"({(counts['done'] + counts['errors']) / elapsed:.2f} files/sec)")
+        if is_remote(args.root):
+            print(f"ダウンロード: {default_client().stats()}")
+
+    if args.parquet:
+        n = write_parquet(args.output, args.parquet)
+        print(f"{n} 件を {args.parquet} に書き出し")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""マイクロバッチ・スケジューラー
+
+同時に届いたクリップを数ミリ秒だけ待って集め、1回のバッチ推論で処理し、
+各リクエストの Future に ang/hap/sad の行を返す。
+submit に timing.Timings を渡すと、待ち時間（queue）とバッチの preprocess / forward を記録する。
+priority で優先度クラス（scheduler.py）を指定すると、interactive が backfill より先にバッチになる。
+"""
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, NamedTuple
+
+import numpy as np
+
+from .config import MAX_BATCH_SIZE, MAX_WAIT_MS
+from .engine import EmotionEngine
+from .scheduler import DEFAULT_PRIORITY, BatchScheduler, check_priority
+from .timing import NULL_TIMINGS, Timings
+
+
+class _Pending(NamedTuple):
+    audio: np.ndarray
+    future: Future
+    timings: Timings
+    submitted: float
+
+
+class MicroBatcher:
+    """max_batch_size 件たまるか max_wait_ms 経過したらまとめて推論する"""
+
+    def __init__(self, engine: EmotionEngine, max_batch_size: int = MAX_BATCH_SIZE,
+                 max_wait_ms: float = MAX_WAIT_MS, caps=None, metrics=None):
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.scheduler = BatchScheduler(max_batch_size, self.max_wait, caps=caps, metrics=metrics)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, audio: np.ndarray, timings=NULL_TIMINGS,
+               priority: str = DEFAULT_PRIORITY) -> Future:
+        """推論を予約し、生の出力 [ang, hap, sad] を返す Future を得る"""
+        if self._closed.is_set():
+            raise RuntimeError("MicroBatcher is closed")
+        priority = check_priority(priority)
+        future: Future = Future()
+        self.scheduler.put(_Pending(audio, future, timings, time.perf_counter()), priority)
+        return future
+
+    def infer_batch(self, clips: List[np.ndarray], timings=NULL_TIMINGS,
+                    priority: str = DEFAULT_PRIORITY) -> np.ndarray:
+        futures = [self.submit(clip, timings, priority) for clip in clips]
+        return np.stack([future.result() for future in futures])
+
+    def close(self) -> None:
+        self._closed.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not (self._closed.is_set() and not len(self.scheduler)):
+            taken = self.scheduler.next_batch()
+            if taken is None:
+                continue
+            priority, batch = taken
+            try:
+                self._run_batch([p for p in batch if p.future.set_running_or_notify_cancel()])
+            finally:
+                self.scheduler.done(priority, len(batch))
+
+    def _run_batch(self, batch: List[_Pending]) -> None:
+        if not batch:
+            return
+        started = time.perf_counter()
+        # 計測するリクエストがあるときだけバッチ分を計測し、各リクエストに1回ずつ足す
+        # （同じリクエストの複数の窓が同じバッチに入ることがある）
+        timed = {}
+        for p in batch:
+            if p.timings.enabled and id(p.timings) not in timed:
+                timed[id(p.timings)] = p.timings
+                p.timings.add("queue", started - p.submitted)
+        batch_timings = Timings() if timed else NULL_TIMINGS
+        try:
+            rows = self.engine.infer_batch([p.audio for p in batch], batch_timings)
+        except Exception as e:
+            for p in batch:
+                p.future.set_exception(e)
+            return
+        for timings in timed.values():
+            timings.merge(batch_timings)
+        for p, row in zip(batch, rows):
+            p.future.set_result(row)
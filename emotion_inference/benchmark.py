@@ -0,0 +1,292 @@
+"""推論のベンチマーク（クリップ長 × バッチサイズ × スレッド数 × バックエンド）
+
+デコード → プロセッサー → モデルの順伝播 → judge までの実際の経路を通して、
+p50/p95 レイテンシ・スループット・ピークRSS を JSON に書き出す。
+音声は create_test_audio.py と同じく合成するが、シード固定なので毎回同じになる。
+
+    python3 -m emotion_inference.benchmark --tiny --output bench.json
+    python3 -m emotion_inference.benchmark --backends torch onnx --threads 1 4 --baseline bench.json
+
+--tiny はランダム初期化の小さなモデルを使うので、非公開のチェックポイントがない CI でも動く。
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+import wave
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .config import SAMPLING_RATE
+from .timing import current_rss
+
+DURATIONS = (1.0, 10.0, 60.0, 600.0)
+BATCH_SIZES = (1, 4, 8)
+BACKENDS = ("torch",)
+# ブラウザの録音と同じ形式でエンコードし、デコード（リサンプル込み）も計測に含める
+RECORDING_SR = 44100
+# 1バッチの音声の合計がこれを超える組み合わせは飛ばす（10分 × 8 などでメモリが足りなくなる）
+MAX_BATCH_AUDIO_SEC = 600.0
+# ベースラインよりこの割合以上遅ければ劣化とみなす
+REGRESSION_TOLERANCE = 0.10
+
+
+def synthetic_audio(duration: float, seed: int = 0, sr: int = SAMPLING_RATE) -> np.ndarray:
+    """声に近い合成音声（基本周波数が揺れる倍音 + 音節ごとの振幅変化 + ノイズ）"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * sr)) / sr
+    f0 = 150 + 30 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t) ** 2
+    audio = 0.1 * voiced * envelope + rng.normal(0, 0.005, len(t))
+    return audio.astype(np.float32)
+
+
+def encode_wav(audio: np.ndarray, sr: int = SAMPLING_RATE) -> bytes:
+    """16bit モノラルの WAV バイト列にする"""
+    pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sr)
+        w.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+class RssSampler:
+    """with ブロックの間、別スレッドで RSS を定期的に読んでピークを記録する"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.start = self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self) -> "RssSampler":
+        self.start = self.peak = current_rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def tiny_model(seed: int = 0):
+    """CustomWav2Vec2Model と同じ構成（wav2vec2 → 平均 → fc）の小さなランダム初期化モデル"""
+    import torch
+    from torch import nn
+    from transformers import Wav2Vec2Config, Wav2Vec2FeatureExtractor, Wav2Vec2Model
+
+    class TinyEmotionModel(nn.Module):
+        def __init__(self, config):
+            super().__init__()
+            self.config = config
+            self.wav2vec2 = Wav2Vec2Model(config)
+            self.fc = nn.Linear(config.hidden_size, 3)
+
+    torch.manual_seed(seed)
+    config = Wav2Vec2Config(
+        hidden_size=64, num_hidden_layers=2, num_attention_heads=4, intermediate_size=128,
+        conv_dim=(32,) * 7, feat_extract_norm="layer", do_stable_layer_norm=True,
+        num_conv_pos_embeddings=16, num_conv_pos_embedding_groups=4,
+    )
+    processor = Wav2Vec2FeatureExtractor(
+        feature_size=1, sampling_rate=SAMPLING_RATE, padding_value=0.0,
+        do_normalize=True, return_attention_mask=True,
+    )
+    return TinyEmotionModel(config).eval(), processor
+
+
+def make_engine(backend: str, threads: int, tiny: bool, workdir: str):
+    """バックエンドとスレッド数を指定してエンジンを作る"""
+    import torch
+
+    from .backends import OnnxBackend, TorchScriptBackend
+    from .config import ONNX_MODEL_PATH, TORCHSCRIPT_MODEL_PATH
+    from .engine import EmotionEngine
+    from .export import export_onnx, export_torchscript
+    from .model import load_model, load_processor
+    from .quantize import quantize_model
+
+    torch.set_num_threads(threads)
+    if not tiny:
+        if backend == "onnx":
+            return EmotionEngine(None, load_processor(), device="cpu",
+                                 backend=OnnxBackend(ONNX_MODEL_PATH, threads))
+        if backend == "torchscript":
+            return EmotionEngine(None, load_processor(), device="cpu",
+                                 backend=TorchScriptBackend(TORCHSCRIPT_MODEL_PATH))
+        if backend not in ("torch", "int8"):
+            raise ValueError(f"Unknown backend: {backend}")
+        model, processor = load_model(device="cpu", quantize=backend == "int8")
+        return EmotionEngine(model, processor, device="cpu")
+
+    model, processor = tiny_model()
+    if backend == "onnx":
+        path = os.path.join(workdir, "tiny.onnx")
+        if not os.path.exists(path):
+            export_onnx(model, path)
+        return EmotionEngine(None, processor, device="cpu", backend=OnnxBackend(path, threads))
+    if backend == "torchscript":
+        path = os.path.join(workdir, "tiny.ts.pt")
+        if not os.path.exists(path):
+            export_torchscript(model, path)
+        return EmotionEngine(None, processor, device="cpu", backend=TorchScriptBackend(path))
+    if backend == "int8":
+        quantize_model(model)
+    elif backend != "torch":
+        raise ValueError(f"Unknown backend: {backend}")
+    return EmotionEngine(model, processor, device="cpu")
+
+
+def run_case(engine, duration: float, batch_size: int, repeat: int, warmup: int = 1,
+             seed: int = 0) -> Dict[str, Any]:
+    """同じバッチを warmup + repeat 回流し、1バッチあたりのレイテンシを集計する"""
+    from .audio import decode_audio_bytes
+    from .scoring import judge_batch
+
+    # バッチ内のクリップはシードをずらして別の音声にする
+    batch = [encode_wav(synthetic_audio(duration, seed + i, RECORDING_SR), RECORDING_SR)
+             for i in range(batch_size)]
+
+    def once():
+        clips = [decode_audio_bytes(data) for data in batch]
+        raws = engine.infer_batch(clips)
+        return judge_batch(raws[:, :3])
+
+    for _ in range(warmup):
+        once()
+    latencies = []
+    with RssSampler() as rss:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            once()
+            latencies.append(time.perf_counter() - started)
+    latencies = np.array(latencies)
+    mean = float(latencies.mean())
+    return dict(
+        p50_ms=float(np.percentile(latencies, 50) * 1000),
+        p95_ms=float(np.percentile(latencies, 95) * 1000),
+        mean_ms=mean * 1000,
+        clips_per_sec=batch_size / mean,
+        # 1秒の処理で何秒分の音声を分析できるか
+        audio_sec_per_sec=batch_size * duration / mean,
+        peak_rss_mb=rss.peak / 2 ** 20,
+        rss_delta_mb=(rss.peak - rss.start) / 2 ** 20,
+    )
+
+
+def case_key(result: Dict[str, Any]) -> tuple:
+    return result["backend"], result["duration"], result["batch_size"], result["threads"]
+
+
+def compare(results: Sequence[Dict[str, Any]], baseline: Sequence[Dict[str, Any]],
+            tolerance: float = REGRESSION_TOLERANCE) -> List[Dict[str, Any]]:
+    """ベースラインと同じ組み合わせの p50 を比べ、結果に ratio / regression を付ける"""
+    base = {case_key(b): b for b in baseline if "p50_ms" in b}
+    regressions = []
+    for result in results:
+        old = base.get(case_key(result))
+        if old is None or "p50_ms" not in result:
+            continue
+        result["baseline_p50_ms"] = old["p50_ms"]
+        result["ratio"] = result["p50_ms"] / old["p50_ms"]
+        result["regression"] = result["ratio"] > 1 + tolerance
+        if result["regression"]:
+            regressions.append(result)
+    return regressions
+
+
+def run(backends: Sequence[str], durations: Sequence[float], batch_sizes: Sequence[int],
+        threads: Sequence[int], tiny: bool, repeat: int,
+        max_batch_audio_sec: float = MAX_BATCH_AUDIO_SEC) -> List[Dict[str, Any]]:
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for backend in backends:
+            for n_threads in threads:
+                engine = make_engine(backend, n_threads, tiny, workdir)
+                for duration in durations:
+                    for batch_size in batch_sizes:
+                        case = dict(backend=backend, duration=duration,
+                                    batch_size=batch_size, threads=n_threads)
+                        if duration * batch_size > max_batch_audio_sec:
+                            results.append(dict(case, skipped="batch audio too long"))
+                            continue
+                        case.update(run_case(engine, duration, batch_size, repeat))
+                        results.append(case)
+                        print(f"  {backend:11s} {n_threads:2d}スレッド {duration:6.0f}秒 × {batch_size}: "
+                              f"p50 {case['p50_ms']:9.1f}ms  p95 {case['p95_ms']:9.1f}ms  "
+                              f"{case['audio_sec_per_sec']:8.1f}倍速  RSS {case['peak_rss_mb']:.0f}MB")
+    return results
+
+
+def environment(tiny: bool) -> Dict[str, Any]:
+    import torch
+
+    return dict(
+        model="tiny" if tiny else "checkpoint",
+        python=platform.python_version(),
+        torch=torch.__version__,
+        platform=platform.platform(),
+        cpu_count=os.cpu_count(),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推論のベンチマーク")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS),
+                        choices=["torch", "int8", "onnx", "torchscript"])
+    parser.add_argument("--durations", nargs="+", type=float, default=list(DURATIONS))
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=list(BATCH_SIZES))
+    parser.add_argument("--threads", nargs="+", type=int, default=[os.cpu_count() or 1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-batch-audio-sec", type=float, default=MAX_BATCH_AUDIO_SEC)
+    parser.add_argument("--tiny", action="store_true",
+                        help="ランダム初期化の小さなモデルを使う（チェックポイント不要）")
+    parser.add_argument("--output", default=None, help="結果のJSON")
+    parser.add_argument("--baseline", default=None, help="比較する過去の結果のJSON")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="ベースラインより遅い組み合わせがあれば終了コード1にする")
+    args = parser.parse_args()
+
+    results = run(args.backends, args.durations, args.batch_sizes, args.threads,
+                  args.tiny, args.repeat, args.max_batch_audio_sec)
+    report = dict(environment=environment(args.tiny), results=results)
+
+    regressions: List[Dict[str, Any]] = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        print(f"\nベースラインとの比較（{len(regressions)} 件が {args.tolerance:.0%} 以上遅い）")
+        for r in results:
+            if "ratio" in r:
+                mark = "❌" if r["regression"] else "✅"
+                print(f"  {mark} {r['backend']:11s} {r['threads']:2d}スレッド {r['duration']:6.0f}秒 "
+                      f"× {r['batch_size']}: {r['ratio']:.2f}倍")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n書き出しました: {args.output}")
+    if args.fail_on_regression and regressions:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""推論結果のキャッシュ（メモリ上のLRU + 任意でディスク）
+
+trigger.dev のリトライ（maxAttempts: 3）や再送で同じWAVが何度も分析されるため、
+デコード後のPCM・チェックポイント・分析オプションのハッシュをキーに結果を再利用する。
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from .config import CACHE_DIR, CACHE_SIZE
+
+
+def cache_key(audio: np.ndarray, model_id: str, options: Dict[str, Any]) -> str:
+    """PCM・モデル・オプション（補正値・窓・無音除去など）から決まるキー"""
+    h = hashlib.sha256()
+    h.update(model_id.encode("utf-8"))
+    h.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+    h.update(np.ascontiguousarray(audio, dtype=np.float32).tobytes())
+    return h.hexdigest()
+
+
+class ResultCache:
+    """スレッドセーフなLRUキャッシュ。disk_dir を指定するとディスクにも保存する"""
+
+    def __init__(self, max_entries: int = CACHE_SIZE, disk_dir: Optional[str] = CACHE_DIR):
+        self.max_entries = max_entries
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(self._entries[key])
+        if self.disk_dir:
+            try:
+                result = json.loads(self._disk_path(key).read_text())
+            except (OSError, ValueError):
+                result = None
+            if result is not None:
+                self._remember(key, result)
+                with self._lock:
+                    self.disk_hits += 1
+                return dict(result)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        self._remember(key, result)
+        if self.disk_dir:
+            path = self._disk_path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # 書きかけのファイルを読まないよう一時ファイルから置き換える
+            fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(result, f)
+            os.replace(tmp, path)
+
+    def _remember(self, key: str, result: Dict[str, Any]) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = dict(result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return dict(
+                entries=len(self._entries),
+                hits=self.hits,
+                disk_hits=self.disk_hits,
+                misses=self.misses,
+                hit_rate=(self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            )
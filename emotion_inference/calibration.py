@@ -0,0 +1,117 @@
+"""Youden Index 補正値のキャリブレーション
+
+ラベル付きの生の出力 ang/hap/sad から、クラスごとに one-vs-rest の ROC を
+ベクトル演算で求め、Youden の J（TPR - FPR）が最大になる閾値を補正値とする。
+結果はバージョン付きの補正プロファイル（JSON）として保存し、サーバーが読み込む。
+
+    python3 -m emotion_inference.calibration labelled.csv --output-dir calibration/
+
+入力は ang,hap,sad,label 列の CSV か、scores [N, 3] と labels [N] を持つ npz。
+"""
+import argparse
+import json
+import re
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import EMOTIONS, YOUDEN_CORRECTION
+
+PROFILE_PATTERN = re.compile(r"correction_v(\d+)\.json$")
+
+
+def youden_thresholds(scores: np.ndarray, positives: np.ndarray) -> Tuple[float, float]:
+    """1クラス分の (閾値, J) を返す。scores >= 閾値 を陽性と判定したときの J が最大"""
+    order = np.argsort(-scores, kind="stable")
+    sorted_scores = scores[order]
+    sorted_pos = positives[order]
+    tp = np.cumsum(sorted_pos)
+    fp = np.cumsum(~sorted_pos)
+    n_pos, n_neg = tp[-1], fp[-1]
+    if n_pos == 0 or n_neg == 0:
+        raise ValueError("Both positive and negative samples are required")
+    # 同じスコアが続く場合はその最後の位置だけを閾値の候補にする
+    last_of_run = np.append(sorted_scores[1:] != sorted_scores[:-1], True)
+    j = np.where(last_of_run, tp / n_pos - fp / n_neg, -np.inf)
+    best = int(np.argmax(j))
+    return float(sorted_scores[best]), float(j[best])
+
+
+def calibrate(scores: np.ndarray, labels: Sequence[str]) -> Dict[str, Any]:
+    """[N, 3] の生の出力とラベルから各クラスの補正値と J を求める"""
+    scores = np.asarray(scores, dtype=np.float64)
+    labels = np.asarray(labels)
+    offsets, youden_j = {}, {}
+    for i, emo in enumerate(EMOTIONS):
+        offsets[emo], youden_j[emo] = youden_thresholds(scores[:, i], labels == emo)
+    return dict(offsets=offsets, youden_j=youden_j, n_samples=int(len(labels)))
+
+
+def _profile_version(path: Path) -> int:
+    match = PROFILE_PATTERN.search(path.name)
+    return int(match.group(1)) if match else -1
+
+
+def save_profile(result: Dict[str, Any], output_dir, cohort: Optional[str] = None) -> Path:
+    """次のバージョン番号で correction_vN.json を書き出す"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    version = max((_profile_version(p) for p in output_dir.glob("correction_v*.json")),
+                  default=0) + 1
+    profile = dict(
+        version=version,
+        created_at=datetime.now(timezone.utc).isoformat(),
+        cohort=cohort,
+        **result,
+    )
+    path = output_dir / f"correction_v{version}.json"
+    path.write_text(json.dumps(profile, ensure_ascii=False, indent=2))
+    return path
+
+
+def load_profile(path) -> Dict[str, float]:
+    """補正プロファイルの offsets を読む。ディレクトリなら最新バージョンを使う"""
+    path = Path(path)
+    if path.is_dir():
+        profiles = sorted(path.glob("correction_v*.json"), key=_profile_version)
+        if not profiles:
+            raise FileNotFoundError(f"No correction profile in {path}")
+        path = profiles[-1]
+    offsets = json.loads(path.read_text())["offsets"]
+    return {emo: float(offsets[emo]) for emo in EMOTIONS}
+
+
+def load_labelled(path) -> Tuple[np.ndarray, np.ndarray]:
+    path = Path(path)
+    if path.suffix == ".npz":
+        data = np.load(path, allow_pickle=False)
+        return data["scores"], data["labels"].astype(str)
+    data = np.genfromtxt(path, delimiter=",", names=True, dtype=None, encoding="utf-8")
+    scores = np.column_stack([data[emo].astype(np.float64) for emo in EMOTIONS])
+    return scores, data["label"].astype(str)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Youden Index 補正値を求める")
+    parser.add_argument("input", help="ang,hap,sad,label の CSV または npz")
+    parser.add_argument("--output-dir", default="calibration")
+    parser.add_argument("--cohort", default=None, help="プロファイルに記録するコホート名")
+    args = parser.parse_args()
+
+    scores, labels = load_labelled(args.input)
+    started = time.perf_counter()
+    result = calibrate(scores, labels)
+    elapsed = time.perf_counter() - started
+
+    print(f"{result['n_samples']} 件を {elapsed * 1000:.1f}ms でキャリブレーション")
+    for emo in EMOTIONS:
+        print(f"  {emo}: 補正値 {result['offsets'][emo]:.8f} "
+              f"(J={result['youden_j'][emo]:.4f}, 現行 {YOUDEN_CORRECTION[emo]:.8f})")
+    print(f"保存しました: {save_profile(result, args.output_dir, args.cohort)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""リクエストの取り消しと期限（デッドライン）
+
+ブラウザが離れたり呼び出し側がタイムアウトしたりした後も推論を最後まで続けると、
+結果は捨てられるのにワーカーが埋まる。各リクエストに CancelToken を持たせ、
+段階の切れ目（デコード後、窓を作った後、塊ごと）と推論結果の待ちで確認する。
+まだバッチに入っていない窓は Future を取り消して推論させない（実行中のバッチは止めない）。
+
+    token = CancelToken(timeout=5.0, probe=lambda: client_gone())
+    token.check()                      # 取り消し・期限切れなら Cancelled
+    rows = wait_results(futures, token, clips)
+
+取り消しの理由は "cancelled"（呼び出し側が取り消した）、"disconnected"（接続が切れた）、
+"deadline"（期限切れ）。推論せずに済んだ音声の秒数を reclaimed_sec に足していく。
+確認しないときは NULL_TOKEN を渡す。
+"""
+import threading
+import time
+from concurrent.futures import Future, wait
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+from .config import CANCEL_POLL_MS, SAMPLING_RATE
+
+REASONS = ("cancelled", "disconnected", "deadline")
+
+
+class Cancelled(Exception):
+    """リクエストが取り消された（reason は REASONS のどれか）"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Request {reason}" if reason != "deadline" else "Deadline exceeded")
+        self.reason = reason
+
+
+class CancelToken:
+    """timeout 秒後に期限切れになる。probe() が True を返したら接続が切れたとみなす"""
+
+    enabled = True
+
+    def __init__(self, timeout: Optional[float] = None,
+                 probe: Optional[Callable[[], bool]] = None):
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self.probe = probe
+        self.reclaimed_sec = 0.0
+        self._reason: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        with self._lock:
+            if self._reason is None:
+                self._reason = reason
+
+    @property
+    def reason(self) -> Optional[str]:
+        """取り消されていれば理由、そうでなければ None"""
+        if self._reason is None:
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                self.cancel("deadline")
+            elif self.probe is not None and self.probe():
+                self.cancel("disconnected")
+        return self._reason
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    def reclaim(self, n_samples: int) -> None:
+        """推論せずに済んだ音声（16kHz のサンプル数）を記録する"""
+        with self._lock:
+            self.reclaimed_sec += n_samples / SAMPLING_RATE
+
+    def check(self, pending_samples: int = 0) -> None:
+        """取り消されていれば、この先で推論するはずだった pending_samples を記録して Cancelled"""
+        reason = self.reason
+        if reason is not None:
+            self.reclaim(pending_samples)
+            raise Cancelled(reason)
+
+
+class _NullToken:
+    enabled = False
+    deadline = None
+    reason = None
+    reclaimed_sec = 0.0
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        pass
+
+    def remaining(self) -> Optional[float]:
+        return None
+
+    def reclaim(self, n_samples: int) -> None:
+        pass
+
+    def check(self, pending_samples: int = 0) -> None:
+        pass
+
+
+NULL_TOKEN = _NullToken()
+
+
+def wait_results(futures: Sequence[Future], token=NULL_TOKEN,
+                 clips: Optional[Sequence[np.ndarray]] = None) -> List[np.ndarray]:
+    """すべての Future の結果を待つ。途中で取り消されたら、まだ始まっていないものを取り消す"""
+    if not token.enabled:
+        return [future.result() for future in futures]
+    while True:
+        _, not_done = wait(futures, timeout=CANCEL_POLL_MS / 1000)
+        if not not_done:
+            return [future.result() for future in futures]
+        if token.reason is not None:
+            for i, future in enumerate(futures):
+                if future.cancel() and clips is not None:
+                    token.reclaim(len(clips[i]))
+            token.check()
+
+
+def request_token(request, probe: Optional[Callable[[], bool]] = None) -> CancelToken:
+    """request["timeout_ms"]（受け付けてからの期限、ミリ秒）があればそれを期限にする"""
+    timeout_ms = request.get("timeout_ms")
+    return CancelToken(float(timeout_ms) / 1000 if timeout_ms else None, probe)
@@ -0,0 +1,196 @@
+"""長い録音をメモリ上限の範囲で区切って分析する
+
+inference_core は音声全体を1本の系列として wav2vec2 に通すので、20分の日記では
+畳み込みの出力と数万フレーム同士の注意の重みでメモリが跳ね上がる。ここでは音声を
+前後に文脈の付いた塊に区切って順に通し、塊の中央（担当区間）のフレームだけを残す。
+
+モデルの出力は「全フレームの隠れ状態の平均 → fc」なので、担当区間ごとのフレームの和と
+フレーム数を足し合わせれば、音声全体の平均プーリングをそのまま計算できる。
+各担当区間の出力は区間（segments）として返し、全体の値は全フレームの平均から出す
+（fc は線形なので、区間の出力をフレーム数で重み付け平均したものと一致する）。
+
+音声の正規化（平均0・分散1）も、塊ごとではなく音声全体の統計で行う。
+WAVファイルを渡せば区間ごとに読み込むので、音声全体もメモリに載せない。
+
+    result = analyze_chunked(engine, WavFileReader("diary.wav"), file="diary.wav")
+"""
+import argparse
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .audio import WavFileReader
+from .cancel import NULL_TOKEN
+from .collate import SAMPLES_PER_FRAME, activation_bytes
+from .config import CHUNK_OVERLAP_SEC, MEMORY_BUDGET_MB, SAMPLING_RATE
+from .engine import EmotionEngine
+from .segments import build_segment, summarize
+from .timing import NULL_TIMINGS
+
+# 塊の長さの範囲（秒）。予算が大きくても長すぎる塊は作らない
+MIN_CHUNK_SEC = 8
+MAX_CHUNK_SEC = 60
+# Wav2Vec2FeatureExtractor.zero_mean_unit_var_norm と同じ
+NORM_EPS = 1e-7
+
+
+class ArraySource:
+    """メモリ上の音声を WavFileReader と同じ形で読む"""
+
+    def __init__(self, audio: np.ndarray):
+        self.audio = audio
+        self.n_samples = len(audio)
+
+    def read(self, start: int, end: int) -> np.ndarray:
+        return self.audio[start:end]
+
+
+Source = Union[ArraySource, WavFileReader]
+
+
+def chunk_samples(config, budget_mb: float = MEMORY_BUDGET_MB) -> int:
+    """活性が budget_mb に収まる塊の長さ（サンプル数、1秒単位で切り下げ）"""
+    budget = budget_mb * 1024 * 1024
+    sec = MAX_CHUNK_SEC
+    while sec > MIN_CHUNK_SEC and activation_bytes(config, sec * SAMPLING_RATE) > budget:
+        sec -= 1
+    return sec * SAMPLING_RATE
+
+
+def plan_chunks(n_samples: int, chunk: int, context: int) -> List[Tuple[int, int, int, int]]:
+    """(読む開始, 読む終了, 担当開始, 担当終了) のリスト
+
+    担当区間は重ならずに音声全体を覆い、読む範囲は前後に context サンプルずつ広げる。
+    """
+    owned = max(chunk - 2 * context, SAMPLES_PER_FRAME)
+    plan = []
+    for start in range(0, n_samples, owned):
+        end = min(start + owned, n_samples)
+        # 末尾の短い余りは1つ前の担当区間に含める
+        if plan and end - start < owned // 2:
+            read_start, _, owned_start, _ = plan.pop()
+            start = owned_start
+        else:
+            read_start = max(start - context, 0)
+        plan.append((read_start, min(end + context, n_samples), start, end))
+        if end == n_samples:
+            break
+    return plan
+
+
+def _stats(source: Source, block: int) -> Tuple[float, float]:
+    """音声全体の平均と標準偏差（塊ごとに読んで集計する）"""
+    total = total_sq = 0.0
+    for start in range(0, source.n_samples, block):
+        x = source.read(start, start + block).astype(np.float64)
+        total += x.sum()
+        total_sq += np.square(x).sum()
+    mean = total / source.n_samples
+    var = max(total_sq / source.n_samples - mean ** 2, 0.0)
+    return mean, float(np.sqrt(var + NORM_EPS))
+
+
+def frame_sum(engine: EmotionEngine, x: np.ndarray, owned_start: int,
+              owned_end: Optional[int]) -> Tuple[np.ndarray, int]:
+    """正規化済みの塊 x [L] の隠れ状態のうち、担当区間（塊の先頭からのサンプル位置、
+    owned_end が None なら最後まで）に当たるフレームの和とフレーム数"""
+    hidden = engine.hidden(x[None])
+    # フレーム i はおよそ入力の i * 320 サンプル目から始まる
+    lo = round(owned_start / SAMPLES_PER_FRAME)
+    hi = len(hidden) if owned_end is None else round(owned_end / SAMPLES_PER_FRAME)
+    owned = hidden[lo:min(hi, len(hidden))]
+    return owned.sum(axis=0, dtype=np.float64), len(owned)
+
+
+# 塊ごとの推論で torch を使う処理（WorkerPool.call でワーカーに実行させる名前）
+OPS: Dict[str, Callable[..., Any]] = {
+    "frame_sum": frame_sum,
+    "heads": lambda engine, pooled: engine.heads(pooled),
+}
+
+
+def analyze_chunked(engine: EmotionEngine, source: Union[Source, np.ndarray],
+                    file: Optional[str] = None, budget_mb: float = MEMORY_BUDGET_MB,
+                    overlap_sec: float = CHUNK_OVERLAP_SEC, timings=NULL_TIMINGS,
+                    token=NULL_TOKEN, call: Optional[Callable[..., Any]] = None) -> Dict[str, Any]:
+    """塊ごとに推論し、analyze_segments と同じ segments / summary 形式で返す
+
+    全体の ang/hap/sad/emo は全フレームの平均プーリングから計算する（塊が1つなら
+    engine.analyze と同じ値）。torch バックエンドのみ。
+    token（cancel.CancelToken）が取り消されたら、次の塊に進まず Cancelled を送出する。
+    call(name, *args) を渡すと OPS の処理をそれで実行する（サーバーの WorkerPool では
+    ワーカーに渡し、親プロセスでは torch を動かさない）。省略時はこのプロセスの engine で実行する。
+    """
+    if isinstance(source, np.ndarray):
+        source = ArraySource(source)
+    if source.n_samples == 0:
+        raise ValueError("Audio is empty")
+    if engine.config is None:
+        raise ValueError(f"{engine.backend.name} backend does not support chunked inference")
+
+    chunk = chunk_samples(engine.config, budget_mb)
+    context = int(overlap_sec * SAMPLING_RATE) // 2
+    plan = plan_chunks(source.n_samples, chunk, context)
+    normalize = getattr(getattr(engine.processor, "feature_extractor", engine.processor),
+                        "do_normalize", True)
+    with timings.stage("stats"):
+        mean, std = _stats(source, chunk) if normalize else (0.0, 1.0)
+
+    run = call or (lambda name, *args: OPS[name](engine, *args))
+    sums, counts = [], []
+    for read_start, read_end, start, end in plan:
+        token.check(source.n_samples - start)
+        with timings.stage("preprocess"):
+            x = ((source.read(read_start, read_end) - mean) / std).astype(np.float32)
+        with timings.stage("forward"):
+            owned_sum, n_frames = run("frame_sum", x, start - read_start,
+                                      None if end == source.n_samples else end - read_start)
+        sums.append(owned_sum)
+        counts.append(n_frames)
+        del x
+
+    with timings.stage("score"):
+        sums, counts = np.stack(sums), np.array(counts, dtype=np.float64)
+        pooled = np.concatenate([sums / np.maximum(counts, 1)[:, None],
+                                 sums.sum(axis=0, keepdims=True) / counts.sum()])
+        raws = run("heads", pooled.astype(np.float32))
+        store = getattr(engine, "embedding_store", None)
+        if store is not None and file:
+            store.save([file], pooled[-1:])
+        segments = [build_segment(engine, i + 1, start, end, raw)
+                    for i, ((_, _, start, end), raw) in enumerate(zip(plan, raws[:-1]))]
+        result = summarize(segments, file)
+        # 全体の値は区間の秒数ではなくフレーム数で平均した埋め込みから出す
+        result.update({k: v for k, v in engine.score(raws[-1]).items() if k != "file"})
+    result["chunks"] = dict(count=len(plan), chunk_sec=chunk / SAMPLING_RATE,
+                            overlap_sec=2 * context / SAMPLING_RATE)
+    return result
+
+
+def needs_chunking(engine: EmotionEngine, n_samples: int,
+                   budget_mb: Optional[float] = None) -> bool:
+    """1本の系列として通すと活性が予算を超える長さか"""
+    budget_mb = engine.memory_budget_mb if budget_mb is None else budget_mb
+    if not budget_mb or engine.config is None or not hasattr(engine.backend, "hidden"):
+        return False
+    return activation_bytes(engine.config, n_samples) > budget_mb * 1024 * 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="長い録音をメモリ上限の範囲で区切って分析する")
+    parser.add_argument("audio", help="WAVファイル")
+    parser.add_argument("--budget-mb", type=float, default=MEMORY_BUDGET_MB)
+    parser.add_argument("--overlap-sec", type=float, default=CHUNK_OVERLAP_SEC)
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--quantize", action="store_true")
+    args = parser.parse_args()
+
+    engine = EmotionEngine.load(device=args.device, quantize=args.quantize)
+    result = analyze_chunked(engine, WavFileReader(args.audio), file=args.audio,
+                             budget_mb=args.budget_mb, overlap_sec=args.overlap_sec)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
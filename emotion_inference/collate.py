@@ -0,0 +1,78 @@
+"""長さでバケット分けしてパディングを最小化するコレーター
+
+2秒〜数分のクリップを最長クリップに合わせてパディングすると、畳み込み特徴抽出と
+Transformer の計算の大半がパディングに費やされる。長さの近いクリップ同士で
+バッチを組み、attention_mask を付けて返す。
+"""
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from .config import SAMPLING_RATE
+
+# wav2vec2 の畳み込み特徴抽出は 320 サンプル（20ms）で1フレーム
+SAMPLES_PER_FRAME = 320
+
+# バケット内の最長/最短の比がこれを超えたら新しいバケットにする
+MAX_PADDING_RATIO = 1.25
+
+
+def bucket_by_length(lengths: Sequence[int], max_padding_ratio: float = MAX_PADDING_RATIO,
+                     max_bucket_size: int = 0) -> List[List[int]]:
+    """長さ順に並べ、パディング比が上限を超えない範囲でインデックスをまとめる"""
+    order = np.argsort(np.asarray(lengths), kind="stable")
+    buckets: List[List[int]] = []
+    for i in order:
+        i = int(i)
+        if buckets:
+            bucket = buckets[-1]
+            shortest = max(lengths[bucket[0]], 1)
+            full = max_bucket_size and len(bucket) >= max_bucket_size
+            if not full and lengths[i] / shortest <= max_padding_ratio:
+                bucket.append(i)
+                continue
+        buckets.append([i])
+    return buckets
+
+
+def activation_bytes(config, n_samples: int, batch_size: int = 1) -> int:
+    """長さ n_samples のクリップを batch_size 本まとめて順伝播したときの活性のピーク（概算・float32）
+
+    畳み込み1層目の出力（正規化と活性化で3本ほど同時に残る）と、Transformer 1層分
+    （注意の重み2本 + 中間層）は同時には載らないので大きい方で見積もる。
+    """
+    frames = n_samples // SAMPLES_PER_FRAME
+    conv = 3 * config.conv_dim[0] * (n_samples // config.conv_stride[0])
+    transformer = (2 * config.num_attention_heads * frames ** 2
+                   + frames * (config.intermediate_size + 6 * config.hidden_size))
+    return 4 * batch_size * max(conv, transformer)
+
+
+def max_batch_for_budget(config, n_samples: int, budget_mb: float) -> int:
+    """活性が budget_mb に収まる最大のバッチサイズ（予算0なら0 = 上限なし、最低でも1）"""
+    if not budget_mb or config is None:
+        return 0
+    return max(1, int(budget_mb * 1024 * 1024 // activation_bytes(config, max(n_samples, 1))))
+
+
+def collate(processor, clips: Sequence[np.ndarray], return_tensors: str = "np"):
+    """プロセッサーで正規化・パディングし、attention_mask 付きの配列を返す"""
+    return processor(list(clips), sampling_rate=SAMPLING_RATE, return_tensors=return_tensors,
+                     padding=True, return_attention_mask=True)
+
+
+def padding_waste(lengths: Sequence[int], buckets: List[List[int]]) -> Dict[str, float]:
+    """パディングに費やされる計算の割合（畳み込みはフレーム数、注意機構はその2乗で概算）"""
+    real_frames = padded_frames = real_attn = padded_attn = 0.0
+    for bucket in buckets:
+        longest = max(lengths[i] for i in bucket) // SAMPLES_PER_FRAME
+        for i in bucket:
+            frames = lengths[i] // SAMPLES_PER_FRAME
+            real_frames += frames
+            padded_frames += longest
+            real_attn += frames ** 2
+            padded_attn += longest ** 2
+    return dict(
+        conv_waste=1 - real_frames / padded_frames if padded_frames else 0.0,
+        attention_waste=1 - real_attn / padded_attn if padded_attn else 0.0,
+    )
@@ -0,0 +1,118 @@
+"""感情推論サービスの設定値（環境変数で上書き可能）"""
+import os
+from pathlib import Path
+
+# vad_deeplearning（models.py / inference.py がある場所）
+VAD_DEEPLEARNING_DIR = Path(os.environ.get(
+    "VAD_DEEPLEARNING_DIR",
+    "/Users/komodatomo/Desktop/onsei-laboratory/vad_deeplearning",
+))
+
+BASE_MODEL = "audeering/wav2vec2-large-robust-12-ft-emotion-msp-dim"
+MODEL_PATH = Path(os.environ.get(
+    "EMOTION_MODEL_PATH",
+    str(VAD_DEEPLEARNING_DIR / "model" / "model_20241026_HCUDB.pkl"),
+))
+
+# artifact.py で作るオフライン起動用の成果物（あればこちらを優先してロードする）
+ARTIFACT_DIR = Path(os.environ.get("EMOTION_ARTIFACT_DIR", str(MODEL_PATH.with_suffix(""))))
+
+SAMPLING_RATE = 16000
+
+# fc層の出力順
+EMOTIONS = ("ang", "hap", "sad")
+# emotion_analysis_results に保存する次元
+AVD_KEYS = ("arousal", "valence", "dominance")
+
+# Youden Index補正値（inference.py では現在コメントアウトされている）
+YOUDEN_CORRECTION = {"ang": 0.25940862, "hap": 0.58535635, "sad": 0.20732406}
+# calibration.py で作った補正プロファイル（ファイルか、最新版を使うディレクトリ）
+CORRECTION_PROFILE = os.environ.get("EMOTION_CORRECTION_PROFILE") or None
+
+SERVER_HOST = os.environ.get("EMOTION_SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.environ.get("EMOTION_SERVER_PORT", "8765"))
+# バイナリ IPC（ipc.py）の待ち受けポート（0で無効）と同時に処理するリクエスト数、フレームの上限
+IPC_PORT = int(os.environ.get("EMOTION_IPC_PORT", "8766"))
+IPC_MAX_CONCURRENT = int(os.environ.get("EMOTION_IPC_MAX_CONCURRENT", "16"))
+IPC_MAX_FRAME_MB = float(os.environ.get("EMOTION_IPC_MAX_FRAME_MB", "256"))
+
+# マイクロバッチ（同時に届いたリクエストをまとめて推論する）
+MAX_BATCH_SIZE = int(os.environ.get("EMOTION_MAX_BATCH_SIZE", "8"))
+MAX_WAIT_MS = float(os.environ.get("EMOTION_MAX_WAIT_MS", "10"))
+
+# 優先度クラス（scheduler.py）ごとに同時に推論中にできるクリップ数（"クラス=件数" のカンマ区切り、0で無制限）と、
+# 下位のクラスがこの秒数以上待たされたら上位より先に1バッチ流す
+PRIORITY_CAPS = os.environ.get("EMOTION_PRIORITY_CAPS", "backfill=8")
+STARVATION_SEC = float(os.environ.get("EMOTION_STARVATION_SEC", "10"))
+
+# 取り消し・期限切れ（cancel.py）を推論結果の待ちの間に確認する間隔（ミリ秒）
+CANCEL_POLL_MS = float(os.environ.get("EMOTION_CANCEL_POLL_MS", "50"))
+
+# 推論ワーカープロセス数（0なら1プロセスのマイクロバッチ）とワーカーごとのスレッド数（0でコア数÷ワーカー数）
+WORKERS = int(os.environ.get("EMOTION_WORKERS", "0"))
+THREADS_PER_WORKER = int(os.environ.get("EMOTION_THREADS_PER_WORKER", "0"))
+
+# 1回の順伝播の活性に使ってよいメモリ（MB、0で無制限）。これを超える長さの音声は
+# chunked.py で区切って処理し、窓ごとの推論もバッチサイズを抑える
+MEMORY_BUDGET_MB = float(os.environ.get("EMOTION_MEMORY_BUDGET_MB", "1024"))
+# 区切った塊の前後に付ける文脈（秒、両側の合計）。重なった部分のフレームは捨てる
+CHUNK_OVERLAP_SEC = float(os.environ.get("EMOTION_CHUNK_OVERLAP_SEC", "4"))
+
+# ストリーミング分析（streaming.py）のセッションをこの秒数やり取りがなければ破棄する
+STREAM_TTL_SEC = float(os.environ.get("EMOTION_STREAM_TTL_SEC", "300"))
+
+# 非同期の分析ジョブ（jobs.py）。キューの上限を超えた投入は断る
+JOBS_DB = Path(os.environ.get(
+    "EMOTION_JOBS_DB", str(Path.home() / ".cache" / "emotion_inference" / "jobs.sqlite3"),
+))
+JOB_MAX_DEPTH = int(os.environ.get("EMOTION_JOB_MAX_DEPTH", "64"))
+# 満杯で断るときに Retry-After で返す秒数
+JOB_RETRY_AFTER_SEC = int(os.environ.get("EMOTION_JOB_RETRY_AFTER_SEC", "5"))
+# ワーカーがこの秒数応答しなければ別のワーカーが引き継ぐ
+JOB_LEASE_SEC = float(os.environ.get("EMOTION_JOB_LEASE_SEC", "60"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("EMOTION_JOB_MAX_ATTEMPTS", "3"))
+# サーバー内でジョブを処理するスレッド数（0ならジョブは別プロセスの jobs.py worker が処理する）
+JOB_WORKERS = int(os.environ.get("EMOTION_JOB_WORKERS", "2"))
+# 終わったジョブを残しておく秒数
+JOB_RETENTION_SEC = float(os.environ.get("EMOTION_JOB_RETENTION_SEC", "86400"))
+
+# ストレージ（storage.py）。EMOTION_STORAGE_URL（例: https://<project>.supabase.co/storage/v1/object/voice-recordings）
+# 宛てのリクエストにだけ EMOTION_STORAGE_KEY（service role key）を付ける。署名付きURLには付けない
+STORAGE_URL = os.environ.get("EMOTION_STORAGE_URL") or None
+STORAGE_KEY = os.environ.get("EMOTION_STORAGE_KEY") or None
+# ホストごとに使い回す接続数と、先読みするファイル数
+STORAGE_POOL_SIZE = int(os.environ.get("EMOTION_STORAGE_POOL_SIZE", "8"))
+STORAGE_PREFETCH = int(os.environ.get("EMOTION_STORAGE_PREFETCH", "8"))
+# 失敗したときの再試行回数と、最初の待ち時間（秒、再試行ごとに倍にする）
+STORAGE_RETRIES = int(os.environ.get("EMOTION_STORAGE_RETRIES", "3"))
+STORAGE_BACKOFF_SEC = float(os.environ.get("EMOTION_STORAGE_BACKOFF_SEC", "0.5"))
+STORAGE_TIMEOUT_SEC = float(os.environ.get("EMOTION_STORAGE_TIMEOUT_SEC", "60"))
+
+# 推論結果キャッシュ（件数0で無効、ディレクトリ指定でディスクにも保存）
+CACHE_SIZE = int(os.environ.get("EMOTION_CACHE_SIZE", "256"))
+CACHE_DIR = os.environ.get("EMOTION_CACHE_DIR") or None
+
+# 動的int8量子化（CPU専用）。量子化済みの重みがあればそちらを読む
+QUANTIZE = os.environ.get("EMOTION_QUANTIZE", "").lower() in ("1", "true")
+QUANTIZED_MODEL_PATH = Path(os.environ.get(
+    "EMOTION_QUANTIZED_MODEL_PATH",
+    str(MODEL_PATH.with_suffix(".int8.pt")),
+))
+
+# 推論バックエンド（torch / onnx / torchscript）と書き出し先
+BACKEND = os.environ.get("EMOTION_BACKEND", "torch")
+ONNX_MODEL_PATH = Path(os.environ.get(
+    "EMOTION_ONNX_MODEL_PATH", str(MODEL_PATH.with_suffix(".onnx")),
+))
+TORCHSCRIPT_MODEL_PATH = Path(os.environ.get(
+    "EMOTION_TORCHSCRIPT_MODEL_PATH", str(MODEL_PATH.with_suffix(".ts.pt")),
+))
+
+# ベースモデルのAVD回帰ヘッドを同じ順伝播で一緒に出力する（heads.py）。
+# audeering のAVDは 0〜1 程度の値で、画面側の閾値（4.0前後）とは尺度が違うので既定では無効
+AVD_HEAD = os.environ.get("EMOTION_AVD_HEAD", "").lower() in ("1", "true")
+
+# 処理段階ごとの計測（timing.py）。有効なら結果に timing を付け、/metrics で集計を返す
+TIMING = os.environ.get("EMOTION_TIMING", "").lower() in ("1", "true")
+# 指定すると集計を定期的にJSONファイルにも書き出す
+METRICS_FILE = os.environ.get("EMOTION_METRICS_FILE") or None
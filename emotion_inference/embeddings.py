@@ -0,0 +1,204 @@
+"""プーリング済み埋め込みの保存と、出力層だけの再スコアリング
+
+補正値や判定ルール、fc 層を試すたびに wav2vec2 を回し直さなくて済むよう、
+fc 層に入る直前の 1024 次元の埋め込みを録音ごとに保存しておき、
+ヘッドの重み・補正・judge を行列積1回で全件に適用する。
+
+    python3 -m emotion_inference.embeddings build /tmp/audio_*.wav --store embeddings/
+    python3 -m emotion_inference.embeddings rescore --store embeddings/ --correction
+
+推論のついでに保存することもできる（EmotionEngine(embedding_store=...)、
+backfill.py の --embeddings）。追記した断片は compact か rescore の前にまとめる。
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import ARTIFACT_DIR, MODEL_PATH, YOUDEN_CORRECTION
+from .scoring import LABELS, apply_correction, judge_batch
+
+EMBEDDINGS_NAME = "embeddings.npy"
+KEYS_NAME = "keys.json"
+# 追記した分を置くディレクトリ（1回の save が1つの断片になる）
+SHARDS_DIR = "shards"
+
+
+def segment_key(file: str, segment_id: int) -> str:
+    """窓ごとの埋め込みのキー（segment_id は結果の segments と同じ1始まり）"""
+    return f"{file}#{segment_id}"
+
+
+def _atomic_save(path: Path, embeddings: np.ndarray) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, embeddings)
+    os.replace(tmp, path)
+
+
+def _atomic_write_text(path: Path, text: str) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+class EmbeddingStore:
+    """録音キーと埋め込み [N, hidden_size] をディレクトリに保存する（npy はメモリマップで読む）
+
+    save は既存の内容を読み直さず、shards/ に断片（.npy とキーの .json）を1つ足すだけにする。
+    .npy を置いてから .json を置くので、途中で落ちても .json のない断片は読まれない。
+    compact で断片を1つの embeddings.npy にまとめる（同じキーは後から保存した方を残す）。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._seq = 0
+
+    def _parts(self) -> List[Tuple[Path, Path]]:
+        """(npy, キーの json) を古い順に"""
+        parts = []
+        if (self.path / KEYS_NAME).exists():
+            parts.append((self.path / EMBEDDINGS_NAME, self.path / KEYS_NAME))
+        shards = self.path / SHARDS_DIR
+        if shards.is_dir():
+            parts += [(keys.with_suffix(".npy"), keys) for keys in sorted(shards.glob("*.json"))]
+        return parts
+
+    def exists(self) -> bool:
+        return bool(self._parts())
+
+    def load(self, mmap: bool = True) -> Tuple[List[str], np.ndarray]:
+        """断片が1つだけ（compact 済み）ならメモリマップで読む"""
+        parts = self._parts()
+        if not parts:
+            raise FileNotFoundError(f"No embeddings in {self.path}")
+        if len(parts) == 1:
+            npy, keys = parts[0]
+            return json.loads(keys.read_text()), np.load(npy, mmap_mode="r" if mmap else None)
+        rows: Dict[str, Tuple[int, int]] = {}
+        arrays = []
+        for n, (npy, keys) in enumerate(parts):
+            arrays.append(np.load(npy, mmap_mode="r"))
+            for i, key in enumerate(json.loads(keys.read_text())):
+                rows.pop(key, None)
+                rows[key] = (n, i)
+        embeddings = np.empty((len(rows), arrays[0].shape[1]), dtype=arrays[0].dtype)
+        for j, (n, i) in enumerate(rows.values()):
+            embeddings[j] = arrays[n][i]
+        return list(rows), embeddings
+
+    def save(self, keys: Sequence[str], embeddings: np.ndarray,
+             dtype=np.float16) -> None:
+        """断片として追記する（同じキーは読むときに後の方で上書きされる）"""
+        if len(keys) == 0:
+            return
+        embeddings = np.asarray(embeddings, dtype=dtype)
+        shards = self.path / SHARDS_DIR
+        shards.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._seq += 1
+            # 名前順 = 保存した順（別プロセスが同じディレクトリに書いても衝突しない）
+            name = f"{time.time_ns():020d}-{os.getpid()}-{self._seq:06d}"
+        _atomic_save(shards / f"{name}.npy", embeddings)
+        _atomic_write_text(shards / f"{name}.json", json.dumps(list(keys), ensure_ascii=False))
+
+    def compact(self) -> int:
+        """断片を embeddings.npy にまとめる。まとめた件数を返す
+
+        まとめた結果を新しい断片として書いてから古いものを消すので、途中で落ちても内容は失われない。
+        """
+        with self._lock:
+            parts = self._parts()
+            if len(parts) <= 1:
+                return len(self.load(mmap=True)[0]) if parts else 0
+            keys, embeddings = self.load(mmap=False)
+            merged = f"{time.time_ns():020d}-{os.getpid()}-compact"
+            shards = self.path / SHARDS_DIR
+            _atomic_save(shards / f"{merged}.npy", embeddings)
+            _atomic_write_text(shards / f"{merged}.json", json.dumps(keys, ensure_ascii=False))
+            for npy, key_file in parts:
+                key_file.unlink()
+                npy.unlink(missing_ok=True)
+            _atomic_save(self.path / EMBEDDINGS_NAME, embeddings)
+            _atomic_write_text(self.path / KEYS_NAME, json.dumps(keys, ensure_ascii=False))
+            (shards / f"{merged}.json").unlink()
+            (shards / f"{merged}.npy").unlink()
+            return len(keys)
+
+
+def load_head_weights(model_path=MODEL_PATH,
+                      artifact_dir=ARTIFACT_DIR) -> Tuple[np.ndarray, np.ndarray]:
+    """fc 層の重み [3, hidden_size] とバイアス [3] を読む（成果物があればそちらから）"""
+    from .artifact import WEIGHTS_NAME, has_artifact
+
+    if has_artifact(artifact_dir):
+        from safetensors.numpy import load_file
+
+        state_dict = load_file(str(Path(artifact_dir) / WEIGHTS_NAME))
+        return state_dict["fc.weight"], state_dict["fc.bias"]
+
+    import torch
+
+    state_dict = torch.load(model_path, map_location=torch.device("cpu"))
+    return state_dict["fc.weight"].numpy(), state_dict["fc.bias"].numpy()
+
+
+def rescore(embeddings: np.ndarray, weight: np.ndarray, bias: np.ndarray,
+            correction: Optional[Dict[str, float]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """埋め込み全件にヘッド・補正・judge を適用し、(scores [N, 3], 判定 [N]) を返す"""
+    scores = np.asarray(embeddings, dtype=np.float32) @ weight.T.astype(np.float32) + bias
+    scores = apply_correction(scores, correction)
+    return scores, judge_batch(scores)
+
+
+def build(files: Sequence[str], store: EmbeddingStore, batch_size: int = 8,
+          engine=None) -> None:
+    """音声ファイルの埋め込みを計算して保存し、最後に1つのファイルにまとめる"""
+    if engine is None:
+        from .engine import EmotionEngine
+
+        engine = EmotionEngine.load()
+    for i in range(0, len(files), batch_size):
+        batch = files[i:i + batch_size]
+        store.save(batch, engine.embed_batch([engine.load_audio(f) for f in batch]))
+        print(f"  {min(i + batch_size, len(files))}/{len(files)}")
+    store.compact()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="埋め込みの保存と再スコアリング")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_parser = sub.add_parser("build", help="音声ファイルの埋め込みを保存する")
+    build_parser.add_argument("files", nargs="+")
+    build_parser.add_argument("--store", required=True)
+    rescore_parser = sub.add_parser("rescore", help="保存した埋め込みを再スコアリングする")
+    rescore_parser.add_argument("--store", required=True)
+    rescore_parser.add_argument("--correction", action="store_true",
+                                help="Youden Index補正を適用する")
+    args = parser.parse_args()
+
+    store = EmbeddingStore(args.store)
+    if args.command == "build":
+        build(args.files, store)
+        return
+
+    store.compact()
+    keys, embeddings = store.load()
+    weight, bias = load_head_weights()
+    started = time.perf_counter()
+    _, labels = rescore(embeddings, weight, bias,
+                        YOUDEN_CORRECTION if args.correction else None)
+    elapsed = time.perf_counter() - started
+    print(f"{len(keys)} 件を {elapsed * 1000:.1f}ms で再スコアリング")
+    for label in LABELS:
+        print(f"  {label}: {np.count_nonzero(labels == label)}")
+
+
+if __name__ == "__main__":
+    main()
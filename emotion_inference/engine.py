@@ -0,0 +1,207 @@
+"""inference_core 相当の推論処理（モデルは常駐させたまま使い回す）"""
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .audio import decode_audio_bytes, load_audio
+from .backends import OnnxBackend, TorchBackend, TorchScriptBackend
+from .cancel import NULL_TOKEN
+from .collate import bucket_by_length, collate, max_batch_for_budget
+from .config import (
+    AVD_HEAD, AVD_KEYS, BACKEND, EMOTIONS, MEMORY_BUDGET_MB, ONNX_MODEL_PATH, SAMPLING_RATE,
+    TORCHSCRIPT_MODEL_PATH,
+)
+from .heads import MultiHeadModel, load_avd_head
+from .model import checkpoint_id, default_device, load_model, load_processor
+from .scoring import judge
+from .timing import NULL_TIMINGS
+from .vad import trim_silence
+
+
+class EmotionEngine:
+    """ロード済みのモデル（またはバックエンド）とプロセッサーを保持して推論する"""
+
+    def __init__(self, model, processor, device: Optional[str] = None,
+                 correction: Optional[Dict[str, float]] = None, model_id: str = "",
+                 backend=None, memory_budget_mb: float = MEMORY_BUDGET_MB,
+                 embedding_store=None):
+        self.model = model
+        self.processor = processor
+        self.device = device or default_device()
+        self.backend = backend or TorchBackend(model, self.device)
+        # 生の出力の列名（先頭は常に ang/hap/sad、AVDヘッドがあれば続く）
+        self.output_names = tuple(self.backend.output_names)
+        # None なら補正なし（現在の inference.py と同じ）
+        self.correction = correction
+        # キャッシュキーに使うチェックポイントの識別子
+        self.model_id = model_id
+        # 1回の順伝播の活性の上限（MB、0で無制限）。長いクリップはバッチを小さくする
+        self.memory_budget_mb = memory_budget_mb
+        # embeddings.EmbeddingStore を渡すと、analyze した録音の埋め込みを file をキーに保存する
+        self.embedding_store = embedding_store
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, device: Optional[str] = None, quantize: bool = False,
+             backend: str = BACKEND, avd_head: bool = AVD_HEAD,
+             **kwargs) -> "EmotionEngine":
+        """backend="onnx" / "torchscript" なら export.py で書き出したグラフを使う
+
+        avd_head=True（torch のみ）ならベースモデルのAVDヘッドも同じ順伝播で出力する。
+        """
+        if backend == "onnx":
+            return cls(None, load_processor(), device="cpu",
+                       model_id=checkpoint_id(ONNX_MODEL_PATH) + ":onnx",
+                       backend=OnnxBackend(ONNX_MODEL_PATH), **kwargs)
+        if backend == "torchscript":
+            device = device or default_device()
+            return cls(None, load_processor(), device=device,
+                       model_id=checkpoint_id(TORCHSCRIPT_MODEL_PATH) + ":torchscript",
+                       backend=TorchScriptBackend(TORCHSCRIPT_MODEL_PATH, device), **kwargs)
+        if backend != "torch":
+            raise ValueError(f"Unknown backend: {backend}")
+
+        device = device or ("cpu" if quantize else default_device())
+        model, processor = load_model(device=device, quantize=quantize)
+        model_id = checkpoint_id() + (":int8" if quantize else "")
+        head = load_avd_head(model.config.hidden_size) if avd_head else None
+        if head is not None:
+            model_id += ":avd"
+            backend = TorchBackend(MultiHeadModel(model, head.to(device)), device)
+            return cls(model, processor, device=device, model_id=model_id,
+                       backend=backend, **kwargs)
+        return cls(model, processor, device=device, model_id=model_id, **kwargs)
+
+    @property
+    def config(self):
+        """wav2vec2 の設定（グラフを書き出したバックエンドでは None）"""
+        return getattr(self.model, "config", None)
+
+    def _buckets(self, lengths: List[int]) -> List[List[int]]:
+        limit = max_batch_for_budget(self.config, max(lengths, default=0), self.memory_budget_mb)
+        return bucket_by_length(lengths, max_bucket_size=limit)
+
+    def _forward(self, clips: List[np.ndarray], timings=NULL_TIMINGS) -> np.ndarray:
+        with timings.stage("preprocess"):
+            inputs = collate(self.processor, clips)
+        attention_mask = inputs["attention_mask"] if len(clips) > 1 else None
+        with self._lock, timings.stage("forward"):
+            return self.backend(inputs["input_values"], attention_mask)
+
+    def embed_batch(self, clips: List[np.ndarray], timings=NULL_TIMINGS) -> np.ndarray:
+        """プーリング済み埋め込み [B, hidden_size] を返す（torch バックエンドのみ）"""
+        if not hasattr(self.backend, "embed"):
+            raise ValueError(f"{self.backend.name} backend does not support embeddings")
+        lengths = [len(clip) for clip in clips]
+        pooled = None
+        for bucket in self._buckets(lengths):
+            with timings.stage("preprocess"):
+                inputs = collate(self.processor, [clips[i] for i in bucket])
+            attention_mask = inputs["attention_mask"] if len(bucket) > 1 else None
+            with self._lock, timings.stage("forward"):
+                rows = self.backend.embed(inputs["input_values"], attention_mask)
+            if pooled is None:
+                pooled = np.empty((len(clips), rows.shape[1]), dtype=np.float32)
+            pooled[bucket] = rows
+        return pooled
+
+    def hidden(self, input_values: np.ndarray) -> np.ndarray:
+        """正規化済みの input_values [1, L] の隠れ状態 [フレーム数, hidden_size]（torch のみ）"""
+        if not hasattr(self.backend, "hidden"):
+            raise ValueError(f"{self.backend.name} backend does not support chunked inference")
+        with self._lock:
+            return self.backend.hidden(input_values)[0]
+
+    def heads(self, pooled: np.ndarray) -> np.ndarray:
+        """プーリング済み埋め込み [B, hidden_size] から生の出力 [B, len(output_names)] を返す"""
+        if not hasattr(self.backend, "heads"):
+            raise ValueError(f"{self.backend.name} backend does not support chunked inference")
+        with self._lock:
+            return self.backend.heads(pooled)
+
+    def infer_batch(self, clips: List[np.ndarray], timings=NULL_TIMINGS) -> np.ndarray:
+        """長さの近いクリップごとにバケット推論し、入力順の生の出力 [B, 3] を返す
+
+        1バケットの活性が memory_budget_mb を超えないようバッチサイズを抑える。
+        timings（timing.Timings）を渡すと preprocess / forward の段階を記録する。
+        """
+        lengths = [len(clip) for clip in clips]
+        rows = np.empty((len(clips), len(self.output_names)), dtype=np.float32)
+        for bucket in self._buckets(lengths):
+            rows[bucket] = self._forward([clips[i] for i in bucket], timings)
+        return rows
+
+    def infer_embed_batch(self, clips: List[np.ndarray],
+                          timings=NULL_TIMINGS) -> Tuple[np.ndarray, np.ndarray]:
+        """infer_batch と同じ生の出力と、その埋め込みを1回の順伝播で返す（torch のみ）"""
+        pooled = self.embed_batch(clips, timings)
+        return self.heads(pooled), pooled
+
+    def infer(self, audio: np.ndarray, timings=NULL_TIMINGS) -> np.ndarray:
+        """1クリップ分の生の出力 [ang, hap, sad] を返す"""
+        return self.infer_batch([audio], timings)[0]
+
+    def avd(self, raw: np.ndarray) -> Dict[str, float]:
+        """AVDヘッドの出力。ヘッドがなければ fc 層の3出力で代用する
+
+        fc層の3出力は本来AVDの並び（analyze_model_file.py 参照）なので、
+        保存先のスキーマを埋めるためにそのまま arousal/valence/dominance に載せる。
+        """
+        if "arousal" in self.output_names:
+            return {key: float(raw[self.output_names.index(key)]) for key in AVD_KEYS}
+        return {key: float(raw[i]) for i, key in enumerate(AVD_KEYS)}
+
+    def score(self, raw: np.ndarray, file: Optional[str] = None) -> Dict[str, Any]:
+        """生の出力に補正と判定をかけて inference_core と同じ形式にする"""
+        values = {emo: float(raw[i]) for i, emo in enumerate(EMOTIONS)}
+        if self.correction:
+            values = {emo: v - self.correction[emo] for emo, v in values.items()}
+        emo = judge(values["ang"], values["sad"], values["hap"])
+        result = dict(file=file, **values, emo=emo)
+        if "arousal" in self.output_names:
+            result.update(self.avd(raw))
+        return result
+
+    def analyze(self, audio: np.ndarray, file: Optional[str] = None,
+                trim: bool = False, timings=NULL_TIMINGS, token=NULL_TOKEN) -> Dict[str, Any]:
+        """inference_core 相当。trim=True なら無音を削ってから推論する
+
+        1本の系列として通すと memory_budget_mb を超える長さなら、chunked.py で区切って
+        推論する（その場合は区間ごとの結果も segments に付き、塊ごとに token を確認する）。
+        """
+        from .chunked import analyze_chunked, needs_chunking
+
+        trimmed_sec = 0.0
+        if trim:
+            with timings.stage("trim"):
+                audio, trimmed_sec = trim_silence(audio)
+        if needs_chunking(self, len(audio)):
+            result = analyze_chunked(self, audio, file=file, budget_mb=self.memory_budget_mb,
+                                     timings=timings, token=token)
+        elif self.embedding_store is not None and file:
+            raws, pooled = self.infer_embed_batch([audio], timings)
+            self.embedding_store.save([file], pooled)
+            raw = raws[0]
+            with timings.stage("score"):
+                result = self.score(raw, file=file)
+        else:
+            raw = self.infer(audio, timings)
+            with timings.stage("score"):
+                result = self.score(raw, file=file)
+        if trim:
+            result["trimmed_sec"] = trimmed_sec
+        return result
+
+    def load_audio(self, fname: str) -> np.ndarray:
+        return load_audio(fname, sr=SAMPLING_RATE)
+
+    def decode_audio(self, data: bytes) -> np.ndarray:
+        return decode_audio_bytes(data, sr=SAMPLING_RATE)
+
+    def analyze_bytes(self, data: bytes, file: Optional[str] = None,
+                      trim: bool = False) -> Dict[str, Any]:
+        return self.analyze(self.decode_audio(data), file=file, trim=trim)
+
+    def analyze_file(self, fname: str, trim: bool = False) -> Dict[str, Any]:
+        return self.analyze(self.load_audio(fname), file=fname, trim=trim)
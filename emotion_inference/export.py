@@ -0,0 +1,77 @@
+"""CustomWav2Vec2Model を ONNX / TorchScript に書き出す
+
+バッチサイズ・系列長とも可変で書き出し、backends.py から読み込んで使う。
+
+    python3 -m emotion_inference.export --format onnx
+    python3 -m emotion_inference.export --format torchscript --output model.ts.pt
+"""
+import argparse
+import time
+
+import torch
+from torch import nn
+
+from .config import ONNX_MODEL_PATH, SAMPLING_RATE, TORCHSCRIPT_MODEL_PATH
+from .model import forward_batch, load_model
+
+
+class _BatchForward(nn.Module):
+    """forward_batch を (input_values, attention_mask) の2入力のグラフにする"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_values, attention_mask):
+        return forward_batch(self.model, input_values, attention_mask)
+
+
+def _example_inputs():
+    # 長さの違う2クリップ分（マスクの分岐をグラフに含めるため）
+    input_values = torch.randn(2, 2 * SAMPLING_RATE)
+    attention_mask = torch.ones(2, 2 * SAMPLING_RATE, dtype=torch.long)
+    attention_mask[1, SAMPLING_RATE:] = 0
+    return input_values, attention_mask
+
+
+def export_onnx(model, path=ONNX_MODEL_PATH, opset: int = 17) -> None:
+    wrapper = _BatchForward(model.to("cpu").eval())
+    torch.onnx.export(
+        wrapper, _example_inputs(), str(path),
+        input_names=["input_values", "attention_mask"],
+        output_names=["logits"],
+        dynamic_axes={
+            "input_values": {0: "batch", 1: "samples"},
+            "attention_mask": {0: "batch", 1: "samples"},
+            "logits": {0: "batch"},
+        },
+        opset_version=opset,
+    )
+
+
+def export_torchscript(model, path=TORCHSCRIPT_MODEL_PATH) -> None:
+    wrapper = _BatchForward(model.to("cpu").eval())
+    with torch.inference_mode():
+        traced = torch.jit.trace(wrapper, _example_inputs(), check_trace=False)
+    traced.save(str(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="感情モデルを ONNX / TorchScript に書き出す")
+    parser.add_argument("--format", choices=["onnx", "torchscript"], default="onnx")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    model, _ = load_model(device="cpu")
+    started = time.perf_counter()
+    if args.format == "onnx":
+        output = args.output or ONNX_MODEL_PATH
+        export_onnx(model, output)
+    else:
+        output = args.output or TORCHSCRIPT_MODEL_PATH
+        export_torchscript(model, output)
+    print(f"書き出しました: {output} ({time.perf_counter() - started:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
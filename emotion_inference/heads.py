@@ -0,0 +1,89 @@
+"""バックボーン1回で複数のヘッドを出力するモデル
+
+HCUDB で学習した fc 層（ang/hap/sad）と、ベースモデル audeering の
+回帰ヘッド（arousal/dominance/valence）を、同じプーリング結果に適用する。
+wav2vec2-large の順伝播を2回回さずに両方のスコアが得られる。
+"""
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+
+import torch
+from safetensors.torch import load_file, save_file
+from torch import nn
+
+from .config import ARTIFACT_DIR, BASE_MODEL, EMOTIONS
+from .model import pool_hidden
+
+AVD_HEAD_NAME = "avd_head.safetensors"
+# audeering/wav2vec2-large-robust-12-ft-emotion-msp-dim の出力順
+AUDEERING_AVD_ORDER = ("arousal", "dominance", "valence")
+
+
+class RegressionHead(nn.Module):
+    """audeering の EmotionModel と同じ回帰ヘッド（dense → tanh → out_proj）"""
+
+    def __init__(self, hidden_size: int, num_labels: int = 3):
+        super().__init__()
+        self.dense = nn.Linear(hidden_size, hidden_size)
+        self.out_proj = nn.Linear(hidden_size, num_labels)
+
+    def forward(self, pooled):
+        return self.out_proj(torch.tanh(self.dense(pooled)))
+
+
+def _download_avd_state_dict() -> Dict[str, torch.Tensor]:
+    """Hub のベースモデルから classifier.* の重みだけを取り出す"""
+    from huggingface_hub import hf_hub_download
+
+    try:
+        state_dict = load_file(hf_hub_download(BASE_MODEL, "model.safetensors"))
+    except Exception:
+        state_dict = torch.load(hf_hub_download(BASE_MODEL, "pytorch_model.bin"),
+                                map_location=torch.device("cpu"))
+    prefix = "classifier."
+    return {k[len(prefix):]: v for k, v in state_dict.items() if k.startswith(prefix)}
+
+
+def save_avd_head(output_dir=ARTIFACT_DIR) -> None:
+    """オフラインで使えるよう回帰ヘッドの重みを成果物ディレクトリに保存する"""
+    save_file({k: v.contiguous() for k, v in _download_avd_state_dict().items()},
+              str(Path(output_dir) / AVD_HEAD_NAME))
+
+
+def load_avd_head(hidden_size: int, artifact_dir=ARTIFACT_DIR) -> Optional[RegressionHead]:
+    """成果物か Hub から回帰ヘッドをロードする（どちらも無理なら None）"""
+    path = Path(artifact_dir) / AVD_HEAD_NAME if artifact_dir else None
+    try:
+        if path and path.exists():
+            state_dict = load_file(str(path))
+        else:
+            state_dict = _download_avd_state_dict()
+    except Exception as e:
+        print(f"AVDヘッドをロードできませんでした: {e}")
+        return None
+    head = RegressionHead(hidden_size)
+    head.load_state_dict(state_dict)
+    return head.eval()
+
+
+class MultiHeadModel(nn.Module):
+    """バックボーンとプーリングを共有し、各ヘッドの出力を列方向に連結して返す
+
+    出力の列は output_names の順（先頭は常に ang/hap/sad）。
+    """
+
+    def __init__(self, model, avd_head: Optional[RegressionHead] = None):
+        super().__init__()
+        self.model = model
+        self.avd_head = avd_head
+        self.output_names: Sequence[str] = EMOTIONS + (AUDEERING_AVD_ORDER if avd_head else ())
+
+    def forward(self, input_values, attention_mask=None):
+        return self.heads(pool_hidden(self.model, input_values, attention_mask))
+
+    def heads(self, pooled):
+        """プーリング済みの埋め込みに各ヘッドを適用する"""
+        outputs = [self.model.fc(pooled)]
+        if self.avd_head is not None:
+            outputs.append(self.avd_head(pooled))
+        return torch.cat(outputs, dim=-1)
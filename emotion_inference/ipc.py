@@ -0,0 +1,406 @@
+"""推論サービスのバイナリ IPC プロトコル（TCP、1接続で複数リクエストを多重化）
+
+標準出力から "{" で始まる行を探す方式では、警告や進捗の出力と結果が混ざり、
+NumPy の float は json.dumps できない。ここでは長さ付きのフレームで
+ヘッダー（JSON）と配列（リトルエンディアンの生バイト列）を分けて送る。
+
+フレーム:
+    magic "EM" | version u8 | header_len u32 | blobs_len u32   （ビッグエンディアン、11バイト）
+    header: UTF-8 JSON {"id": 1, "type": "analyze", ..., "blobs": [{"name", "dtype", "shape"}]}
+    blobs:  header["blobs"] の順に連結したバイト列（dtype は bytes / float32 / int32）
+
+クライアント → サーバー:
+    analyze  windows / trim / file / path / priority / timeout_ms。音声は blob "audio"
+             （WAVなどのファイルのバイト列）か "pcm"（16kHz float32）
+    cancel   target（取り消す analyze の id）。返事はなく、取り消された analyze が error で返る
+    health
+サーバー → クライアント（id はリクエストと同じ。届いた順ではなく終わった順に返る）:
+    result   result（segments 以外の値）、segments は列ごとの blob "segments/<key>"、
+             文字列の列は segment_labels に入れる
+    health
+    error    error（メッセージ）と code（bad_request / unknown_type / unsupported_version / internal /
+             cancelled / deadline_exceeded）
+
+接続が切れたら、その接続の処理中の analyze はすべて取り消す（cancel.py）。
+
+アプリ（app/api/analyze-emotion）は /jobs と /stream（HTTP、server.py）を使うので、
+この IPC を使うのは Python の IpcClient（backfill --ipc、test_app_integration.py）だけ。
+
+    python3 -m emotion_inference.server --ipc-port 8766
+    client = IpcClient("127.0.0.1", 8766)
+    result = client.analyze(audio=open("diary.wav", "rb").read(), windows="vad")
+"""
+import itertools
+import json
+import socket
+import socketserver
+import struct
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from .cancel import Cancelled, request_token
+from .config import IPC_MAX_CONCURRENT, IPC_MAX_FRAME_MB
+from .scheduler import PRIORITIES
+from .timing import NULL_TIMINGS, Timings
+
+PROTOCOL_VERSION = 1
+MAGIC = b"EM"
+PREFIX = struct.Struct(">2sBII")
+MAX_FRAME_BYTES = int(IPC_MAX_FRAME_MB * 1024 * 1024)
+
+DTYPES = {"float32": np.dtype("<f4"), "int32": np.dtype("<i4")}
+
+
+class ProtocolError(Exception):
+    """フレームが壊れている（以降の読み取り位置が分からないので接続を閉じる）"""
+
+
+class IpcError(Exception):
+    """サーバーが error を返した"""
+
+    def __init__(self, message: str, code: str = "internal"):
+        super().__init__(message)
+        self.code = code
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def encode_frame(header: Dict[str, Any], blobs: Optional[Dict[str, Any]] = None,
+                 version: int = PROTOCOL_VERSION) -> bytes:
+    """header と blob（bytes か NumPy 配列）を1フレームにする"""
+    specs, parts = [], []
+    for name, blob in (blobs or {}).items():
+        if isinstance(blob, (bytes, bytearray, memoryview)):
+            specs.append(dict(name=name, dtype="bytes", shape=[len(blob)]))
+            parts.append(bytes(blob))
+            continue
+        dtype = "int32" if np.issubdtype(blob.dtype, np.integer) else "float32"
+        array = np.ascontiguousarray(blob, dtype=DTYPES[dtype])
+        specs.append(dict(name=name, dtype=dtype, shape=list(array.shape)))
+        parts.append(array.tobytes())
+    body = json.dumps(dict(header, blobs=specs), default=_json_default,
+                      ensure_ascii=False).encode("utf-8")
+    blob_bytes = b"".join(parts)
+    return PREFIX.pack(MAGIC, version, len(body), len(blob_bytes)) + body + blob_bytes
+
+
+def _read_exact(stream, n: int) -> bytes:
+    data = stream.read(n)
+    if len(data) != n:
+        raise ProtocolError("Connection closed in the middle of a frame")
+    return data
+
+
+def read_frame(stream) -> Optional[Tuple[int, Dict[str, Any], Dict[str, Any]]]:
+    """(version, header, blobs) を返す。フレームの境界で接続が閉じたら None"""
+    prefix = stream.read(PREFIX.size)
+    if not prefix:
+        return None
+    if len(prefix) != PREFIX.size:
+        raise ProtocolError("Truncated frame prefix")
+    magic, version, header_len, blobs_len = PREFIX.unpack(prefix)
+    if magic != MAGIC:
+        raise ProtocolError("Bad magic (not an emotion IPC client?)")
+    if header_len + blobs_len > MAX_FRAME_BYTES:
+        raise ProtocolError(f"Frame too large: {header_len + blobs_len} bytes")
+    try:
+        header = json.loads(_read_exact(stream, header_len))
+    except ValueError as e:
+        raise ProtocolError(f"Invalid header: {e}")
+    if not isinstance(header, dict):
+        raise ProtocolError("Header must be a JSON object")
+    specs = header.pop("blobs", [])
+    if not isinstance(specs, list):
+        raise ProtocolError("Header blobs must be a list")
+    data = memoryview(_read_exact(stream, blobs_len))
+
+    blobs, offset = {}, 0
+    for spec in specs:
+        name, dtype, shape = _check_spec(spec)
+        size = int(np.prod(shape)) * (1 if dtype == "bytes" else DTYPES[dtype].itemsize)
+        if offset + size > blobs_len:
+            raise ProtocolError(f"Blob {name} is larger than the frame")
+        if dtype == "bytes":
+            blobs[name] = bytes(data[offset:offset + size])
+        else:
+            blobs[name] = np.frombuffer(data[offset:offset + size],
+                                        dtype=DTYPES[dtype]).reshape(shape)
+        offset += size
+    if offset != blobs_len:
+        raise ProtocolError("Blob sizes do not match the frame")
+    return version, header, blobs
+
+
+def _check_spec(spec) -> Tuple[str, str, list]:
+    """header["blobs"] の要素を (name, dtype, shape) にする（不正なら ProtocolError）"""
+    if not isinstance(spec, dict):
+        raise ProtocolError("Blob spec must be a JSON object")
+    name, dtype, shape = spec.get("name"), spec.get("dtype"), spec.get("shape")
+    if not isinstance(name, str):
+        raise ProtocolError("Blob spec is missing name")
+    if dtype != "bytes" and dtype not in DTYPES:
+        raise ProtocolError(f"Unknown blob dtype: {dtype}")
+    if (not isinstance(shape, list) or (dtype == "bytes" and len(shape) != 1)
+            or not all(type(n) is int and n >= 0 for n in shape)):
+        raise ProtocolError(f"Invalid shape for blob {name}: {shape}")
+    return name, dtype, shape
+
+
+def encode_result(result: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """分析結果を result フレームの header と blob に分ける（区間の数値は列ごとの配列にする）"""
+    header = dict(result=dict(result), segment_labels={})
+    blobs: Dict[str, np.ndarray] = {}
+    segments = header["result"].pop("segments", None)
+    if segments is None:
+        return header, blobs
+    header["segment_count"] = len(segments)
+    for key in (segments[0] if segments else {}):
+        values = [segment[key] for segment in segments]
+        if all(isinstance(v, (int, np.integer)) for v in values):
+            blobs[f"segments/{key}"] = np.asarray(values, dtype=np.int32)
+        elif all(isinstance(v, (float, int, np.number)) for v in values):
+            blobs[f"segments/{key}"] = np.asarray(values, dtype=np.float32)
+        else:
+            header["segment_labels"][key] = values
+    return header, blobs
+
+
+def decode_result(header: Dict[str, Any], blobs: Dict[str, Any]) -> Dict[str, Any]:
+    """encode_result の逆（区間は dict のリストに戻す）"""
+    result = dict(header["result"])
+    if "segment_count" not in header:
+        return result
+    columns = {name[len("segments/"):]: blob.tolist()
+               for name, blob in blobs.items() if name.startswith("segments/")}
+    columns.update(header.get("segment_labels", {}))
+    result["segments"] = [{key: values[i] for key, values in columns.items()}
+                          for i in range(header["segment_count"])]
+    return result
+
+
+class IpcRequestHandler(socketserver.StreamRequestHandler):
+    """1接続分。フレームを読むたびに処理をスレッドプールに渡し、終わった順に返す"""
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._write_lock = threading.Lock()
+        # 処理中の analyze の id → CancelToken
+        self._tokens = {}
+
+    def _reply(self, header: Dict[str, Any], blobs=None) -> None:
+        frame = encode_frame(header, blobs)
+        with self._write_lock:
+            try:
+                self.wfile.write(frame)
+                self.wfile.flush()
+            except OSError:
+                pass
+
+    def _error(self, request_id, message: str, code: str) -> None:
+        self._reply(dict(id=request_id, type="error", error=message, code=code))
+
+    def handle(self):
+        try:
+            self._read_frames()
+        finally:
+            # 結果を受け取る相手がいなくなったので、処理中のものは途中でやめる
+            for token in list(self._tokens.values()):
+                token.cancel("disconnected")
+
+    def _read_frames(self):
+        while True:
+            try:
+                frame = read_frame(self.rfile)
+            except ProtocolError as e:
+                self._error(None, str(e), "bad_request")
+                return
+            except OSError:
+                return
+            if frame is None:
+                return
+            version, header, blobs = frame
+            if version != PROTOCOL_VERSION:
+                self._error(header.get("id"), f"Unsupported protocol version: {version}",
+                            "unsupported_version")
+                continue
+            if header.get("type") == "cancel":
+                token = self._tokens.get(header.get("target"))
+                if token is not None:
+                    token.cancel()
+                continue
+            token = None
+            if header.get("type") == "analyze":
+                # スレッドプールの空きを待っている間も cancel や切断で取り消せるよう、ここで登録する
+                try:
+                    token = request_token(header)
+                except ValueError as e:
+                    self._error(header.get("id"), f"Invalid timeout_ms: {e}", "bad_request")
+                    continue
+                self._tokens[header.get("id")] = token
+            self.server.executor.submit(self._dispatch, header, blobs, token)
+
+    def _dispatch(self, header: Dict[str, Any], blobs: Dict[str, Any], token=None) -> None:
+        request_id, kind = header.get("id"), header.get("type")
+        emotion_server = self.server.emotion_server
+        try:
+            if kind == "health":
+                engine = emotion_server.engine
+                self._reply(dict(id=request_id, type="health", status="ok",
+                                 device=engine.device, backend=engine.backend.name,
+                                 model_id=engine.model_id))
+            elif kind == "analyze":
+                data = blobs.get("audio")
+                if data is None and "pcm" in blobs:
+                    data = np.asarray(blobs["pcm"], dtype=np.float32)
+                if data is None and not header.get("path"):
+                    self._error(request_id, "Missing path or audio blob", "bad_request")
+                    return
+                if header.get("priority") not in (None, *PRIORITIES):
+                    self._error(request_id, f"Unknown priority class: {header['priority']}",
+                                "bad_request")
+                    return
+                timings = Timings() if emotion_server.timing else NULL_TIMINGS
+                result = emotion_server.analyze_request(header, data, timings, token)
+                fields, result_blobs = encode_result(result)
+                self._reply(dict(fields, id=request_id, type="result"), result_blobs)
+            else:
+                self._error(request_id, f"Unknown request type: {kind}", "unknown_type")
+        except Cancelled as e:
+            self._error(request_id, str(e),
+                        "deadline_exceeded" if e.reason == "deadline" else "cancelled")
+        except Exception as e:
+            traceback.print_exc()
+            self._error(request_id, str(e), "internal")
+        finally:
+            if token is not None:
+                self._tokens.pop(request_id, None)
+
+
+class IpcServer(socketserver.ThreadingTCPServer):
+    """EmotionServer と同じエンジン・マイクロバッチ・キャッシュを使う IPC の入り口"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, emotion_server, max_concurrent: int = IPC_MAX_CONCURRENT):
+        super().__init__(address, IpcRequestHandler)
+        self.emotion_server = emotion_server
+        self.executor = ThreadPoolExecutor(max_concurrent, thread_name_prefix="ipc")
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+
+class IpcClient:
+    """1本の接続で複数のリクエストを同時に送れるクライアント（スレッドセーフ）"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8766, timeout: float = 10.0):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._sock.settimeout(None)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile("rb")
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._read_responses, daemon=True)
+        self._thread.start()
+
+    def _read_responses(self) -> None:
+        error: Exception = ConnectionError("Connection closed")
+        try:
+            while True:
+                frame = read_frame(self._reader)
+                if frame is None:
+                    break
+                _, header, blobs = frame
+                with self._lock:
+                    future = self._pending.pop(header.get("id"), None)
+                if future is None:
+                    continue
+                if header.get("type") == "error":
+                    future.set_exception(IpcError(header.get("error", ""), header.get("code")))
+                else:
+                    future.set_result((header, blobs))
+        except (OSError, ProtocolError) as e:
+            error = e
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(error)
+
+    def request(self, kind: str, fields: Optional[Dict[str, Any]] = None,
+                blobs: Optional[Dict[str, Any]] = None,
+                request_id: Optional[int] = None) -> Future:
+        """(header, blobs) を結果に持つ Future を返す"""
+        request_id = next(self._ids) if request_id is None else request_id
+        future: Future = Future()
+        with self._lock:
+            if not self._thread.is_alive():
+                raise ConnectionError("Connection closed")
+            self._pending[request_id] = future
+            self._sock.sendall(encode_frame(dict(fields or {}, id=request_id, type=kind), blobs))
+        return future
+
+    def cancel(self, request_id: int) -> None:
+        """送った analyze を取り消す（サーバーは次の段階の切れ目で推論をやめる）"""
+        with self._lock:
+            try:
+                self._sock.sendall(encode_frame(dict(type="cancel", target=request_id)))
+            except OSError:
+                pass
+
+    def submit_analyze(self, audio: Optional[bytes] = None, pcm: Optional[np.ndarray] = None,
+                       **options) -> Future:
+        """audio（ファイルのバイト列）か pcm（16kHz float32）か options["path"] を分析する
+
+        返した Future を cancel() すると、サーバー側の推論も取り消す。
+        """
+        blobs = {"audio": audio} if audio is not None else {}
+        if pcm is not None:
+            blobs["pcm"] = np.asarray(pcm, dtype=np.float32)
+        request_id = next(self._ids)
+        future: Future = Future()
+
+        def done(response: Future) -> None:
+            if future.cancelled():
+                return
+            try:
+                future.set_result(decode_result(*response.result()))
+            except Exception as e:
+                future.set_exception(e)
+
+        self.request("analyze", options, blobs, request_id).add_done_callback(done)
+        future.add_done_callback(lambda f: f.cancelled() and self.cancel(request_id))
+        return future
+
+    def analyze(self, audio: Optional[bytes] = None, pcm: Optional[np.ndarray] = None,
+                **options) -> Dict[str, Any]:
+        return self.submit_analyze(audio, pcm, **options).result()
+
+    def health(self) -> Dict[str, Any]:
+        return self.request("health").result()[0]
+
+    def close(self) -> None:
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        self._thread.join()
+
+    def __enter__(self) -> "IpcClient":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
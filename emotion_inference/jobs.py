@@ -0,0 +1,415 @@
+"""SQLite に永続化する非同期の分析ジョブキュー
+
+/api/analyze-emotion がダウンロードと推論の間ずっと HTTP リクエストを保持しないよう、
+ジョブを投入したらすぐ 202 を返し、結果はジョブIDで問い合わせてもらう。
+
+- ワーカーはジョブをリース付きで取り出し、処理中は定期的に延長する。
+  リースが切れたジョブ（ワーカーが落ちた等）は別のワーカーが引き継ぐ。
+- 待ち + 処理中のジョブが上限に達したら QueueFull で投入を断る。
+- 結果を保存した側が ack すると、以降は同じ結果を二重に保存しない。
+- cancel されたジョブや、request["timeout_ms"]（投入からの期限）を過ぎたジョブは推論しない。
+  処理中なら、ワーカーが次の段階の切れ目で止める（cancel.py）。
+
+状態: queued → running → done → acked / failed / cancelled（一時的な失敗は queued に戻して再試行）
+
+    python3 -m emotion_inference.jobs worker --workers 2   # サーバーとは別プロセスで処理する
+    python3 -m emotion_inference.jobs stats
+"""
+import argparse
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+from .cancel import NULL_TOKEN, Cancelled, CancelToken
+from .config import (
+    JOB_LEASE_SEC, JOB_MAX_ATTEMPTS, JOB_MAX_DEPTH, JOB_RETENTION_SEC, JOB_WORKERS, JOBS_DB,
+)
+from .storage import default_client
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    owner TEXT,
+    request TEXT NOT NULL,
+    audio BLOB,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+"""
+ACTIVE = ("queued", "running")
+FINISHED = ("done", "acked", "failed", "cancelled")
+# 処理中のジョブが取り消されていないかワーカーが確認する間隔（秒）
+CANCEL_CHECK_SEC = 1.0
+
+
+class QueueFull(Exception):
+    """待ち + 処理中のジョブが上限に達している"""
+
+
+class Job(NamedTuple):
+    id: str
+    request: Dict[str, Any]
+    audio: Optional[bytes]
+    attempts: int
+    # request["timeout_ms"] から決まる期限（UNIX時刻、なければ None）
+    deadline: Optional[float] = None
+
+
+class JobQueue:
+    """複数のスレッド・プロセスから同じファイルを共有できるジョブキュー"""
+
+    def __init__(self, path=JOBS_DB, max_depth: int = JOB_MAX_DEPTH,
+                 lease_sec: float = JOB_LEASE_SEC, max_attempts: int = JOB_MAX_ATTEMPTS,
+                 retention_sec: float = JOB_RETENTION_SEC):
+        self.path = Path(path)
+        self.max_depth = max_depth
+        self.lease_sec = lease_sec
+        self.max_attempts = max_attempts
+        self.retention_sec = retention_sec
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # トランザクションは BEGIN IMMEDIATE で明示的に張る（他プロセスとの取り合いを避ける）
+        self._db = sqlite3.connect(str(self.path), timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def _transaction(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                value = fn(self._db)
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+            return value
+
+    def enqueue(self, request: Dict[str, Any], audio: Optional[bytes] = None,
+                owner: Optional[str] = None) -> str:
+        """ジョブを追加してIDを返す。いっぱいなら QueueFull"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+
+        def insert(db):
+            db.execute(f"DELETE FROM jobs WHERE status IN {FINISHED} AND updated < ?",
+                       (now - self.retention_sec,))
+            depth = db.execute(f"SELECT COUNT(*) FROM jobs WHERE status IN {ACTIVE}").fetchone()[0]
+            if depth >= self.max_depth:
+                raise QueueFull(f"Job queue is full ({depth} jobs)")
+            db.execute(
+                "INSERT INTO jobs (id, status, owner, request, audio, created, updated)"
+                " VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, owner, json.dumps(request), audio, now, now),
+            )
+
+        self._transaction(insert)
+        return job_id
+
+    def claim(self, worker: str) -> Optional[Job]:
+        """一番古い待ちジョブ（またはリースの切れたジョブ）を取り出す"""
+        now = time.time()
+
+        def take(db):
+            # 何度もリースを切らしたジョブは諦める（処理するとワーカーが落ちる音声など）
+            db.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Lease expired too many times',"
+                " audio = NULL, updated = ? WHERE status = 'running' AND lease_until < ?"
+                " AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            row = db.execute(
+                "SELECT id, request, audio, attempts, created FROM jobs WHERE status = 'queued'"
+                " OR (status = 'running' AND lease_until < ?) ORDER BY rowid LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?,"
+                " attempts = attempts + 1, updated = ? WHERE id = ?",
+                (worker, now + self.lease_sec, now, row["id"]),
+            )
+            request = json.loads(row["request"])
+            timeout_ms = request.get("timeout_ms")
+            deadline = row["created"] + float(timeout_ms) / 1000 if timeout_ms else None
+            return Job(row["id"], request, row["audio"], row["attempts"] + 1, deadline)
+
+        return self._transaction(take)
+
+    def _update(self, sql: str, params) -> bool:
+        with self._lock:
+            return self._db.execute(sql, params).rowcount > 0
+
+    def heartbeat(self, job_id: str, worker: str) -> bool:
+        """リースを延長する（もう自分のジョブでなければ False）"""
+        now = time.time()
+        return self._update(
+            "UPDATE jobs SET lease_until = ?, updated = ? WHERE id = ? AND worker = ?"
+            " AND status = 'running'",
+            (now + self.lease_sec, now, job_id, worker),
+        )
+
+    def complete(self, job_id: str, worker: str, result: Dict[str, Any]) -> bool:
+        return self._update(
+            "UPDATE jobs SET status = 'done', result = ?, audio = NULL, lease_until = NULL,"
+            " updated = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (json.dumps(result), time.time(), job_id, worker),
+        )
+
+    def fail(self, job_id: str, worker: str, error: str, retry: bool = False) -> bool:
+        """retry=True かつ試行回数が残っていれば待ちに戻す"""
+        return self._update(
+            "UPDATE jobs SET status = CASE WHEN ? AND attempts < ? THEN 'queued' ELSE 'failed' END,"
+            " audio = CASE WHEN ? AND attempts < ? THEN audio END,"
+            " error = ?, lease_until = NULL, updated = ?"
+            " WHERE id = ? AND worker = ? AND status = 'running'",
+            (retry, self.max_attempts, retry, self.max_attempts, error, time.time(),
+             job_id, worker),
+        )
+
+    def owns(self, job_id: str, worker: str) -> bool:
+        """まだ worker が処理中のジョブか（取り消されたり引き継がれたりしていないか）"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT 1 FROM jobs WHERE id = ? AND worker = ? AND status = 'running'",
+                (job_id, worker),
+            ).fetchone() is not None
+
+    def cancel(self, job_id: str, reason: str = "cancelled", worker: Optional[str] = None) -> bool:
+        """待ち・処理中のジョブを取り消す（音声も消す）。処理中の結果は complete されても捨てる
+
+        worker を渡すと、そのワーカーが処理中の場合だけ取り消す（引き継がれたジョブは触らない）。
+        """
+        if worker is not None:
+            return self._update(
+                "UPDATE jobs SET status = 'cancelled', error = ?, audio = NULL,"
+                " lease_until = NULL, updated = ? WHERE id = ? AND worker = ?"
+                " AND status = 'running'",
+                (reason, time.time(), job_id, worker),
+            )
+        return self._update(
+            "UPDATE jobs SET status = 'cancelled', error = ?, audio = NULL, lease_until = NULL,"
+            f" updated = ? WHERE id = ? AND status IN {ACTIVE}",
+            (reason, time.time(), job_id),
+        )
+
+    def ack(self, job_id: str) -> bool:
+        """結果を受け取ったことを記録する（最初の1回だけ True）"""
+        return self._update(
+            "UPDATE jobs SET status = 'acked', updated = ? WHERE id = ? AND status = 'done'",
+            (time.time(), job_id),
+        )
+
+    def get(self, job_id: str, owner: Optional[str] = None) -> Dict[str, Any]:
+        """ジョブの状態。なければ KeyError、投入者と違えば PermissionError"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT rowid, id, status, owner, request, result, error, attempts FROM jobs"
+                " WHERE id = ?", (job_id,),
+            ).fetchone()
+            if row is None:
+                raise KeyError(job_id)
+            position = None
+            if row["status"] == "queued":
+                position = self._db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND rowid < ?",
+                    (row["rowid"],),
+                ).fetchone()[0]
+        if row["owner"] is not None and row["owner"] != owner:
+            raise PermissionError("Job belongs to another user")
+        request = json.loads(row["request"])
+        job = dict(job_id=row["id"], status=row["status"], attempts=row["attempts"],
+                   file=request.get("file"), recording_id=request.get("recording_id"))
+        if position is not None:
+            job["position"] = position
+        if row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        if row["status"] in ("failed", "cancelled"):
+            job["error"] = row["error"]
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {status: count for status, count in rows}
+        return dict(counts, depth=sum(counts.get(s, 0) for s in ACTIVE),
+                    max_depth=self.max_depth)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def fetch_audio(url: str, token=NULL_TOKEN) -> bytes:
+    """署名付きURLなどから音声をダウンロードする（storage.py の共有クライアントで接続を使い回す）"""
+    return default_client().get(url, token=token)
+
+
+def job_audio(job: Job, token=NULL_TOKEN) -> Optional[bytes]:
+    """ジョブの音声（本文で受け取った音声か、URLからダウンロードしたもの）。path 指定なら None"""
+    if job.audio is not None:
+        return job.audio
+    if job.request.get("url"):
+        return fetch_audio(job.request["url"], token)
+    return None
+
+
+class JobWorker:
+    """ジョブを取り出して handler(job, token) で処理し続けるスレッド
+
+    handler は結果の dict を返す。ValueError（音声が空など）は再試行しない。
+    token（cancel.CancelToken）はジョブが取り消されるか期限を過ぎると取り消し状態になる。
+    """
+
+    def __init__(self, queue: JobQueue, handler: Callable[[Job, CancelToken], Dict[str, Any]],
+                 name: Optional[str] = None, poll_interval: float = 0.2, metrics=None):
+        self.queue = queue
+        self.handler = handler
+        self.name = name or f"worker-{uuid.uuid4().hex[:8]}"
+        self.poll_interval = poll_interval
+        self.metrics = metrics
+        self._stop = threading.Event()
+        # 処理中の (ジョブID, token)。ハートビートのスレッドが読むので1つの値として入れ替える
+        self._current: Optional[Tuple[str, CancelToken]] = None
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._heartbeat = threading.Thread(target=self._renew, daemon=True)
+
+    def start(self) -> "JobWorker":
+        self._thread.start()
+        self._heartbeat.start()
+        return self
+
+    def _renew(self) -> None:
+        """処理中のジョブのリースを延長し、取り消されていたら token を取り消す"""
+        renewed = time.monotonic()
+        while not self._stop.wait(CANCEL_CHECK_SEC):
+            current = self._current
+            if current is None:
+                continue
+            job_id, token = current
+            try:
+                if not self.queue.owns(job_id, self.name):
+                    token.cancel()
+                elif time.monotonic() - renewed >= self.queue.lease_sec / 3:
+                    self.queue.heartbeat(job_id, self.name)
+                    renewed = time.monotonic()
+            except sqlite3.Error as e:
+                # DB が一時的にロックされていても延長を続ける（スレッドを止めない）
+                print(f"[{self.name}] リースを延長できませんでした: {e}")
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim(self.name)
+            except sqlite3.Error as e:
+                print(f"[{self.name}] ジョブを取り出せませんでした: {e}")
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            timeout = None if job.deadline is None else job.deadline - time.time()
+            if timeout is not None and timeout <= 0:
+                # 待っている間に期限が過ぎた（結果を待っている人はもういない）
+                self._record(self.queue.cancel, job.id, "deadline", worker=self.name)
+                if self.metrics is not None:
+                    self.metrics.observe_cancel("deadline")
+                continue
+            token = CancelToken(timeout)
+            self._current = (job.id, token)
+            try:
+                result = self.handler(job, token)
+            except Cancelled as e:
+                self._record(self.queue.cancel, job.id, e.reason, worker=self.name)
+            except ValueError as e:
+                self._record(self.queue.fail, job.id, self.name, str(e))
+            except Exception as e:
+                print(f"[{self.name}] ジョブ {job.id} が失敗しました（{job.attempts}回目）: {e}")
+                self._record(self.queue.fail, job.id, self.name, str(e), retry=True)
+            else:
+                self._record(self.queue.complete, job.id, self.name, result)
+            finally:
+                self._current = None
+
+    def _record(self, update: Callable[..., Any], job_id: str, *args, **kwargs) -> None:
+        """ジョブの状態を書き込む。DB が一時的にロックされていてもスレッドは止めない
+
+        書き込めなかったジョブはリースが切れた後に取り出し直される。
+        """
+        try:
+            update(job_id, *args, **kwargs)
+        except sqlite3.Error as e:
+            print(f"[{self.name}] ジョブ {job_id} の状態を保存できませんでした: {e}")
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        self._thread.join(timeout)
+        self._heartbeat.join(timeout)
+
+
+def engine_handler(engine) -> Callable[[Job, CancelToken], Dict[str, Any]]:
+    """サーバーを介さずエンジンで直接処理する handler（別プロセスのワーカー用）"""
+    from .segments import analyze_segments
+
+    def handle(job: Job, token: CancelToken) -> Dict[str, Any]:
+        request = job.request
+        data = job_audio(job, token)
+        token.check()
+        audio = engine.decode_audio(data) if data else engine.load_audio(request["path"])
+        token.check(len(audio))
+        file = request.get("path") or request.get("file")
+        if request.get("windows"):
+            return analyze_segments(engine, audio, file=file, mode=request["windows"],
+                                    trim=bool(request.get("trim")), token=token)
+        return engine.analyze(audio, file=file, trim=bool(request.get("trim")), token=token)
+
+    return handle
+
+
+def main():
+    parser = argparse.ArgumentParser(description="非同期の分析ジョブキュー")
+    parser.add_argument("command", choices=["worker", "stats"])
+    parser.add_argument("--db", default=str(JOBS_DB))
+    parser.add_argument("--workers", type=int, default=max(JOB_WORKERS, 1),
+                        help="このプロセスで並行して処理するジョブ数")
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--quantize", action="store_true")
+    args = parser.parse_args()
+
+    queue = JobQueue(args.db)
+    if args.command == "stats":
+        print(json.dumps(queue.stats(), ensure_ascii=False, indent=2))
+        return
+
+    from .engine import EmotionEngine
+
+    print("モデルをロード中...")
+    engine = EmotionEngine.load(device=args.device, quantize=args.quantize)
+    handler = engine_handler(engine)
+    workers = [JobWorker(queue, handler).start() for _ in range(args.workers)]
+    print(f"{len(workers)} ワーカーでジョブを待っています（{args.db}）")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.stop()
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""CustomWav2Vec2Model のロード"""
+import os
+import sys
+from pathlib import Path
+
+import torch
+from transformers import Wav2Vec2FeatureExtractor, Wav2Vec2Processor
+
+from .artifact import WEIGHTS_NAME, has_artifact, load_artifact
+from .config import (
+    ARTIFACT_DIR, BASE_MODEL, MODEL_PATH, QUANTIZED_MODEL_PATH, VAD_DEEPLEARNING_DIR,
+)
+from .quantize import quantize_model
+
+
+def default_device() -> str:
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def _import_model_class():
+    if str(VAD_DEEPLEARNING_DIR) not in sys.path:
+        sys.path.append(str(VAD_DEEPLEARNING_DIR))
+    from models import CustomWav2Vec2Model
+    return CustomWav2Vec2Model
+
+
+def load_processor(artifact_dir=ARTIFACT_DIR):
+    if has_artifact(artifact_dir):
+        return Wav2Vec2FeatureExtractor.from_pretrained(str(artifact_dir), local_files_only=True)
+    return Wav2Vec2Processor.from_pretrained(BASE_MODEL)
+
+
+def load_model(model_path=MODEL_PATH, device=None, quantize=False,
+               quantized_path=QUANTIZED_MODEL_PATH, artifact_dir=ARTIFACT_DIR):
+    """モデルとプロセッサーをロード
+
+    artifact_dir に artifact.py で作った成果物があれば、Hub を見ずにメモリマップで組み立てる。
+    なければ inference.py の load_model と同じ手順（from_pretrained + load_state_dict）。
+    quantize=True ならバックボーンを動的int8量子化する（CPU専用）。
+    成果物がなく quantized_path に量子化済みの重みがあれば fp32 のチェックポイントは読まない。
+    """
+    device = device or default_device()
+    if quantize and device != "cpu":
+        raise ValueError("int8 quantization is only supported on CPU")
+
+    if has_artifact(artifact_dir):
+        model, processor = load_artifact(artifact_dir)
+        if quantize:
+            quantize_model(model)
+        return model.to(device), processor
+
+    CustomWav2Vec2Model = _import_model_class()
+    model = CustomWav2Vec2Model.from_pretrained(BASE_MODEL)
+    if quantize and quantized_path and os.path.exists(quantized_path):
+        quantize_model(model)
+        model.load_state_dict(torch.load(quantized_path, map_location=torch.device("cpu")))
+    else:
+        model.load_state_dict(torch.load(model_path, map_location=torch.device("cpu")))
+        if quantize:
+            quantize_model(model)
+    processor = load_processor(artifact_dir=None)
+
+    model.eval()
+    model.to(device)
+    return model, processor
+
+
+def pool_hidden(model, input_values, attention_mask=None):
+    """wav2vec2 の隠れ状態を、パディングされたフレームを除いて時間方向に平均する
+
+    CustomWav2Vec2Model（audeering の EmotionModel と同じ構成:
+    wav2vec2 → 時間方向の平均 → fc）を前提にしている。
+    """
+    hidden = model.wav2vec2(input_values, attention_mask=attention_mask)[0]
+    if attention_mask is None:
+        return hidden.mean(dim=1)
+    frame_mask = model.wav2vec2._get_feature_vector_attention_mask(
+        hidden.shape[1], attention_mask
+    ).unsqueeze(-1).to(hidden.dtype)
+    return (hidden * frame_mask).sum(dim=1) / frame_mask.sum(dim=1)
+
+
+def forward_batch(model, input_values, attention_mask=None):
+    """パディングを除外して平均プーリングし、fc層で [B, 3] を出力する
+
+    マスクなし・バッチサイズ1なら model(input_values) と一致する。
+    """
+    return model.fc(pool_hidden(model, input_values, attention_mask))
+
+
+def checkpoint_id(model_path=None) -> str:
+    """チェックポイントの識別子（1GB超を毎回ハッシュしないよう名前・サイズ・更新時刻で代用）
+
+    省略時はロードに使われる方（成果物があればその重み、なければ .pkl）。
+    """
+    if model_path is None:
+        model_path = Path(ARTIFACT_DIR) / WEIGHTS_NAME if has_artifact() else MODEL_PATH
+    stat = os.stat(model_path)
+    return f"{os.path.basename(model_path)}:{stat.st_size}:{stat.st_mtime_ns}"
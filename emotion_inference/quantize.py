@@ -0,0 +1,45 @@
+"""CPU向けの動的int8量子化
+
+wav2vec2 バックボーンの Linear 層だけを int8 にする（fc層は fp32 のまま残して
+ang/hap/sad のずれを抑える）。量子化済みの重みを保存しておけば、次回からは
+fp32 のチェックポイントを読まずに済む。
+
+    python3 -m emotion_inference.quantize model/model_20241026_HCUDB.int8.pt
+"""
+import argparse
+import time
+
+import torch
+from torch import nn
+
+from .config import QUANTIZED_MODEL_PATH
+
+
+def quantize_model(model):
+    """バックボーンの Linear 層を動的int8量子化する（CPU専用、モデルを置き換える）"""
+    model.to("cpu")
+    torch.quantization.quantize_dynamic(
+        model.wav2vec2, {nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+    return model
+
+
+def save_quantized(model, path=QUANTIZED_MODEL_PATH) -> None:
+    torch.save(model.state_dict(), path)
+
+
+def main():
+    from .model import load_model
+
+    parser = argparse.ArgumentParser(description="量子化済みの重みを保存する")
+    parser.add_argument("output", nargs="?", default=str(QUANTIZED_MODEL_PATH))
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    model, _ = load_model(device="cpu", quantize=True, quantized_path=None)
+    save_quantized(model, args.output)
+    print(f"保存しました: {args.output} ({time.perf_counter() - started:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
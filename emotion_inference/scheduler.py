@@ -0,0 +1,142 @@
+"""優先度クラス付きのバッチスケジューラー
+
+ユーザーが待っている分析（interactive）とアーカイブの再分析（backfill）が同じ推論ワーカーを
+使うとき、backfill の大量の窓の後ろにユーザーの窓が並ばないようにする。
+
+- バッチはクラスごとに組み、毎回、待っている中で最も優先度の高いクラスから取る
+  （実行中のバッチは止めないので、割り込めるのはバッチの切れ目）。
+  違うクラスを同じバッチに混ぜると、長い backfill のバケットの推論を interactive が待つことになる。
+- クラスごとに同時に推論中にできる件数の上限（caps）を設け、backfill がワーカーを占有しないようにする。
+- 下位のクラスの先頭が starvation_sec 以上待っていれば、上位が待っていても1バッチ分だけ先に流す。
+- 待ち時間をクラスごとに Metrics に記録する（queue_wait_<クラス>）。
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from .config import PRIORITY_CAPS, STARVATION_SEC
+
+# 先にあるほど優先度が高い
+PRIORITIES = ("interactive", "backfill")
+DEFAULT_PRIORITY = "interactive"
+
+
+class _Entry(NamedTuple):
+    item: Any
+    submitted: float
+
+
+def parse_caps(spec: str) -> Dict[str, int]:
+    """"backfill=8,interactive=0" → {"backfill": 8, "interactive": 0}（0は上限なし）"""
+    caps = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, value = part.partition("=")
+        if name not in PRIORITIES:
+            raise ValueError(f"Unknown priority class: {name}")
+        caps[name] = int(value)
+    return caps
+
+
+def check_priority(priority: Optional[str]) -> str:
+    if not priority:
+        return DEFAULT_PRIORITY
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority class: {priority}")
+    return priority
+
+
+class BatchScheduler:
+    """put したものを next_batch でクラスごとのバッチにして取り出す（スレッドセーフ）
+
+    取り出したバッチの推論が終わったら done(priority, n) で上限の枠を返すこと。
+    """
+
+    def __init__(self, max_batch_size: int, max_wait: float,
+                 caps: Optional[Dict[str, int]] = None, starvation_sec: float = STARVATION_SEC,
+                 metrics=None):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.caps = dict(parse_caps(PRIORITY_CAPS) if caps is None else caps)
+        self.starvation_sec = starvation_sec
+        self.metrics = metrics
+        self._queues: Dict[str, Deque[_Entry]] = {p: deque() for p in PRIORITIES}
+        self._in_flight = {p: 0 for p in PRIORITIES}
+        self._cond = threading.Condition()
+
+    def put(self, item: Any, priority: str = DEFAULT_PRIORITY) -> None:
+        with self._cond:
+            self._queues[check_priority(priority)].append(_Entry(item, time.perf_counter()))
+            self._cond.notify_all()
+
+    def _room(self, priority: str) -> int:
+        cap = self.caps.get(priority, 0)
+        room = cap - self._in_flight[priority] if cap else self.max_batch_size
+        return max(0, min(room, self.max_batch_size))
+
+    def _choose(self, now: float) -> Optional[str]:
+        eligible = [p for p in PRIORITIES if self._queues[p] and self._room(p)]
+        if not eligible:
+            return None
+        # 長く待たされている下位のクラスを先に流す（上位が途切れなくても進むように）
+        for priority in eligible[1:]:
+            if now - self._queues[priority][0].submitted >= self.starvation_sec:
+                return priority
+        return eligible[0]
+
+    def next_batch(self, timeout: float = 0.1) -> Optional[Tuple[str, List[Any]]]:
+        """(クラス, 要素のリスト)。timeout 秒待っても取れるものがなければ None
+
+        最初の1件が取れる状態になってから max_wait 秒だけ、同じクラスの後続を待つ。
+        """
+        with self._cond:
+            deadline = time.perf_counter() + timeout
+            fill_deadline = None
+            while True:
+                now = time.perf_counter()
+                priority = self._choose(now)
+                if priority is None:
+                    # 待っている間に別の消費者や drain が先に取り出した。最初から待ち直す
+                    fill_deadline = None
+                    if now >= deadline:
+                        return None
+                    self._cond.wait(deadline - now)
+                    continue
+                if fill_deadline is None:
+                    fill_deadline = now + self.max_wait
+                if len(self._queues[priority]) >= self._room(priority) or now >= fill_deadline:
+                    break
+                self._cond.wait(fill_deadline - now)
+
+            queue = self._queues[priority]
+            entries = [queue.popleft() for _ in range(min(len(queue), self._room(priority)))]
+            self._in_flight[priority] += len(entries)
+        if self.metrics is not None:
+            started = time.perf_counter()
+            for entry in entries:
+                self.metrics.observe_stage(f"queue_wait_{priority}", started - entry.submitted)
+        return priority, [entry.item for entry in entries]
+
+    def done(self, priority: str, n: int) -> None:
+        """推論が終わった（または失敗した）件数分の枠を返す"""
+        with self._cond:
+            self._in_flight[priority] -= n
+            self._cond.notify_all()
+
+    def drain(self) -> List[Any]:
+        """まだ取り出されていない要素をすべて取り除いて返す（終了時用）"""
+        with self._cond:
+            items = [entry.item for q in self._queues.values() for entry in q]
+            for q in self._queues.values():
+                q.clear()
+        return items
+
+    def __len__(self) -> int:
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._cond:
+            return {p: dict(queued=len(self._queues[p]), in_flight=self._in_flight[p],
+                            cap=self.caps.get(p, 0))
+                    for p in PRIORITIES}
@@ -0,0 +1,38 @@
+"""生の出力 ang/hap/sad への補正と判定（NumPyのみ）"""
+from typing import Dict, Optional
+
+import numpy as np
+
+from .config import EMOTIONS
+
+LABELS = np.array(["ang", "hap", "sad", "other"])
+
+
+def judge(ang, sad, hap):
+    """inference.py の judge と同じ判定（同値の場合は other）"""
+    if ang >= sad and not (hap >= ang):
+        return "ang"
+    elif sad >= hap and not (ang >= sad):
+        return "sad"
+    elif hap >= ang and not (sad >= hap):
+        return "hap"
+    return "other"
+
+
+def judge_batch(scores: np.ndarray) -> np.ndarray:
+    """judge を [N, 3]（ang, hap, sad の列）に一括で適用する"""
+    ang, hap, sad = scores[:, 0], scores[:, 1], scores[:, 2]
+    index = np.select(
+        [(ang >= sad) & ~(hap >= ang), (sad >= hap) & ~(ang >= sad), (hap >= ang) & ~(sad >= hap)],
+        [0, 2, 1],
+        default=3,
+    )
+    return LABELS[index]
+
+
+def apply_correction(scores: np.ndarray,
+                     correction: Optional[Dict[str, float]] = None) -> np.ndarray:
+    """Youden Index補正（各列からオフセットを引く）。None なら補正なし"""
+    if not correction:
+        return scores
+    return scores - np.array([correction[emo] for emo in EMOTIONS], dtype=scores.dtype)
@@ -0,0 +1,178 @@
+"""区間ごとの感情分析（lib/db/emotionAnalysis.ts の segments / summary 形式）
+
+音声を固定長またはVADで切り出した窓に分け、窓をまとめて1回のバッチ推論にかける。
+長い1系列を丸ごと入れるより、自己注意の計算量（系列長の2乗）を窓の長さで抑えられる。
+"""
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .cancel import NULL_TOKEN
+from .config import AVD_KEYS, EMOTIONS, MAX_BATCH_SIZE, SAMPLING_RATE
+from .embeddings import segment_key
+from .engine import EmotionEngine
+from .scoring import judge
+from .timing import NULL_TIMINGS
+from .vad import speech_regions, trim_silence
+
+WINDOW_SEC = 5.0
+HOP_SEC = 5.0
+# これより短い末尾の窓は直前の窓に含める
+MIN_WINDOW_SEC = 1.0
+
+
+def fixed_windows(n_samples: int, sr: int = SAMPLING_RATE, window_sec: float = WINDOW_SEC,
+                  hop_sec: float = HOP_SEC,
+                  min_window_sec: float = MIN_WINDOW_SEC) -> List[Tuple[int, int]]:
+    """固定長の窓を (開始サンプル, 終了サンプル) のリストで返す"""
+    window, hop, min_window = int(window_sec * sr), int(hop_sec * sr), int(min_window_sec * sr)
+    if n_samples <= window:
+        return [(0, n_samples)] if n_samples > 0 else []
+    windows = [(s, min(s + window, n_samples)) for s in range(0, n_samples - min_window, hop)]
+    if windows[-1][1] < n_samples:
+        windows[-1] = (windows[-1][0], n_samples)
+    return windows
+
+
+def vad_windows(audio: np.ndarray, sr: int = SAMPLING_RATE,
+                window_sec: float = WINDOW_SEC) -> List[Tuple[int, int]]:
+    """発話区間ごとの窓（長い発話区間は window_sec ごとに分割）"""
+    windows = []
+    for start, end in speech_regions(audio, sr):
+        windows.extend((start + s, start + e)
+                       for s, e in fixed_windows(end - start, sr, window_sec, window_sec))
+    return windows
+
+
+def split_windows(audio: np.ndarray, mode: str = "fixed", sr: int = SAMPLING_RATE,
+                  window_sec: float = WINDOW_SEC, hop_sec: float = HOP_SEC) -> List[Tuple[int, int]]:
+    if mode == "vad":
+        windows = vad_windows(audio, sr, window_sec)
+        # 発話が検出できなければ固定長にフォールバック
+        if windows:
+            return windows
+    elif mode != "fixed":
+        raise ValueError(f"Unknown window mode: {mode}")
+    return fixed_windows(len(audio), sr, window_sec, hop_sec)
+
+
+def summarize(segments: Sequence[Dict[str, Any]], file: Optional[str] = None) -> Dict[str, Any]:
+    """区間の結果を区間長で重み付けして集計し、segments / summary 形式にまとめる"""
+    if not segments:
+        raise ValueError("No segments to summarize")
+    weights = np.array([s["duration"] for s in segments])
+    weights = weights / weights.sum()
+
+    def weighted(key):
+        return float(np.dot(weights, [s[key] for s in segments]))
+
+    averages = {emo: weighted(emo) for emo in EMOTIONS}
+    emotion_share: Dict[str, float] = defaultdict(float)
+    for seg, w in zip(segments, weights):
+        emotion_share[seg["emotion"]] += float(w)
+
+    summary = dict(
+        total_segments=len(segments),
+        **{f"avg_{key}": weighted(key) for key in AVD_KEYS},
+        **{f"avg_{emo}": v for emo, v in averages.items()},
+        dominant_emotion=max(emotion_share, key=emotion_share.get),
+    )
+    # 全体の値は inference_core と同じキーでも返す
+    return dict(
+        file=file,
+        **averages,
+        emo=judge(averages["ang"], averages["sad"], averages["hap"]),
+        segments=list(segments),
+        summary=summary,
+    )
+
+
+def window_clips(audio: np.ndarray, mode: str = "fixed", window_sec: float = WINDOW_SEC,
+                 hop_sec: float = HOP_SEC, trim: bool = False, timings=NULL_TIMINGS,
+                 ) -> Tuple[List[Tuple[int, int]], List[np.ndarray], float]:
+    """窓の位置・推論に渡すクリップ・削った無音の秒数を返す
+
+    trim=True なら各窓の中の無音を削る（区間の時刻は元の音声のまま）。
+    """
+    sr = SAMPLING_RATE
+    with timings.stage("windows"):
+        windows = split_windows(audio, mode, sr, window_sec, hop_sec)
+    if not windows:
+        raise ValueError("Audio is empty")
+    clips = [audio[s:e] for s, e in windows]
+    trimmed_sec = 0.0
+    if trim:
+        with timings.stage("trim"):
+            trimmed = [trim_silence(clip, sr) for clip in clips]
+        clips = [clip for clip, _ in trimmed]
+        trimmed_sec = sum(dropped for _, dropped in trimmed)
+    return windows, clips, trimmed_sec
+
+
+def build_segment(engine: EmotionEngine, segment_id: int, start: int, end: int,
+                  raw: np.ndarray) -> Dict[str, Any]:
+    """1つの窓の生の出力を区間の結果にする（start / end はサンプル位置）"""
+    sr = SAMPLING_RATE
+    scored = engine.score(raw)
+    return dict(
+        segment_id=segment_id,
+        start=start / sr,
+        end=end / sr,
+        duration=(end - start) / sr,
+        **engine.avd(raw),
+        **{emo: scored[emo] for emo in EMOTIONS},
+        emotion=scored["emo"],
+    )
+
+
+def build_result(engine: EmotionEngine, windows: Sequence[Tuple[int, int]], raws: np.ndarray,
+                 file: Optional[str] = None,
+                 trimmed_sec: Optional[float] = None) -> Dict[str, Any]:
+    """窓ごとの生の出力から segments / summary 形式の結果を組み立てる"""
+    segments = [build_segment(engine, i + 1, start, end, raw)
+                for i, ((start, end), raw) in enumerate(zip(windows, raws))]
+    result = summarize(segments, file)
+    if trimmed_sec is not None:
+        result["trimmed_sec"] = trimmed_sec
+    return result
+
+
+def _infer_windows(engine: EmotionEngine, clips: List[np.ndarray], file: Optional[str],
+                   timings=NULL_TIMINGS, token=NULL_TOKEN) -> np.ndarray:
+    """engine で直接推論する（途中で取り消されたら残りの窓は推論しない）"""
+    store = getattr(engine, "embedding_store", None)
+    raws, pooled = [], []
+    for start in range(0, len(clips), MAX_BATCH_SIZE):
+        token.check(sum(len(clip) for clip in clips[start:]))
+        batch = clips[start:start + MAX_BATCH_SIZE]
+        if store is not None and file:
+            rows, embeddings = engine.infer_embed_batch(batch, timings)
+            pooled.append(embeddings)
+        else:
+            rows = engine.infer_batch(batch, timings)
+        raws.append(rows)
+    if pooled:
+        store.save([segment_key(file, i + 1) for i in range(len(clips))], np.concatenate(pooled))
+    return np.concatenate(raws)
+
+
+def analyze_segments(engine: EmotionEngine, audio: np.ndarray, file: Optional[str] = None,
+                     mode: str = "fixed", window_sec: float = WINDOW_SEC,
+                     hop_sec: float = HOP_SEC, trim: bool = False,
+                     infer_batch: Optional[Callable[[List[np.ndarray]], np.ndarray]] = None,
+                     timings=NULL_TIMINGS, token=NULL_TOKEN) -> Dict[str, Any]:
+    """窓をまとめてバッチ推論し、区間ごとの結果と全体の集計を返す
+
+    infer_batch を渡すとそれで推論する（サーバーではマイクロバッチャー経由にする）。
+    渡さない場合は MAX_BATCH_SIZE 窓ずつ推論し、その切れ目で token（cancel.CancelToken）を確認する。
+    engine.embedding_store があれば窓ごとの埋め込みも保存する（infer_batch を渡さない場合）。
+    """
+    windows, clips, trimmed_sec = window_clips(audio, mode, window_sec, hop_sec, trim, timings)
+    token.check(sum(len(clip) for clip in clips))
+    if infer_batch is None:
+        raws = _infer_windows(engine, clips, file, timings, token)
+    else:
+        raws = infer_batch(clips)
+    with timings.stage("score"):
+        return build_result(engine, windows, raws, file, trimmed_sec if trim else None)
@@ -0,0 +1,525 @@
+"""常駐型の感情推論サーバー（localhost HTTP）
+
+モデルは起動時に一度だけロードし、以降のリクエストで使い回す。
+
+    python3 -m emotion_inference.server --port 8765
+
+POST /analyze  {"path": "/tmp/audio_xxx.wav"}  → inference_core と同じ形式のJSON
+               {"path": ..., "windows": "vad"}   → segments / summary 付き（"fixed" も可）
+               {"path": ..., "trim": true}       → 無音を削ってから推論（trimmed_sec を返す）
+               {"path": ..., "priority": "backfill"} → アーカイブの再分析など（既定は interactive、scheduler.py）
+               {"path": ..., "timeout_ms": 30000}    → 期限を過ぎたら推論をやめて 504（cancel.py）
+               クライアントが接続を切った場合も、次の段階の切れ目で推論をやめる
+POST /analyze?windows=vad&trim=1&file=<id>    → 本文に音声バイト列（audio/wav）をそのまま送る
+GET  /health                                   → {"status": "ok"}
+GET  /stats                                    → キャッシュのヒット/ミス数
+GET  /metrics                                  → 段階ごとの処理時間のヒストグラム（Prometheus形式）
+
+録音中のストリーミング分析（streaming.py）:
+POST   /stream?sample_rate=44100&trim=1&owner=<id>  → {"session_id": ...}
+POST   /stream/<session_id>?owner=<id>              → 本文のチャンクを追加し、確定した区間を返す
+POST   /stream/<session_id>/finish?owner=<id>       → 残りを推論して segments / summary を返す
+                                                       （timeout_ms・切断は /analyze と同じく 504 / 499）
+DELETE /stream/<session_id>?owner=<id>              → セッションを破棄する
+
+非同期の分析ジョブ（jobs.py）:
+POST /jobs  {"url": <署名付きURL>, "windows": "vad", "owner": <id>, "recording_id": ...}
+            （本文に音声バイト列を送る場合はクエリ文字列で指定）
+                                        → 202 {"job_id", "status": "queued", "position"}（満杯なら 503）
+GET  /jobs/<job_id>?owner=<id>          → {"status": queued/running/done/acked/failed, "result", ...}
+POST /jobs/<job_id>/ack?owner=<id>      → 結果を保存したことを記録する（最初の1回だけ {"acked": true}）
+POST /jobs/<job_id>/cancel?owner=<id>   → 待ち・処理中のジョブを取り消す（{"cancelled": true/false}）
+
+--ipc-port（既定 8766）では同じ分析をバイナリのフレームで受け付ける（ipc.py）。
+
+--timing を付けると、結果に段階ごとの計測値（timing）が付く。
+EMOTION_MEMORY_BUDGET_MB を超える長さの音声は区切って推論する（chunked.py、結果に chunks が付く）。
+"""
+import argparse
+import json
+import select
+import socket
+import threading
+import time
+import traceback
+from typing import Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from .batching import MicroBatcher
+from .cache import ResultCache, cache_key
+from .calibration import load_profile
+from .cancel import NULL_TOKEN, Cancelled, CancelToken, request_token, wait_results
+from .chunked import analyze_chunked, needs_chunking
+from .config import (
+    AVD_HEAD, BACKEND, CACHE_DIR, CACHE_SIZE, CORRECTION_PROFILE, IPC_PORT, JOB_RETRY_AFTER_SEC,
+    JOB_WORKERS, JOBS_DB, MAX_BATCH_SIZE, MAX_WAIT_MS, METRICS_FILE, PRIORITY_CAPS, QUANTIZE,
+    SERVER_HOST, SERVER_PORT, THREADS_PER_WORKER, TIMING, WORKERS, YOUDEN_CORRECTION,
+)
+from .engine import EmotionEngine
+from .ipc import IpcServer
+from .jobs import Job, JobQueue, JobWorker, QueueFull, job_audio
+from .scheduler import DEFAULT_PRIORITY, check_priority, parse_caps
+from .segments import analyze_segments
+from .streaming import RECORDING_SR, StreamRegistry
+from .timing import NULL_TIMINGS, Metrics, MetricsFileExporter, Timings
+from .vad import trim_silence
+from .workers import WorkerPool
+
+
+class EmotionRequestHandler(BaseHTTPRequestHandler):
+    server_version = "EmotionInference/1.0"
+
+    @property
+    def engine(self) -> EmotionEngine:
+        return self.server.engine
+
+    def _send(self, status: int, body: bytes, content_type: str, headers=None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload, headers=None) -> None:
+        if not self.server.timing:
+            self._send(status, json.dumps(payload).encode("utf-8"), "application/json", headers)
+            return
+        # 書き出しの時間は結果に含められないので集計だけに入れる
+        wall, cpu = time.perf_counter(), time.process_time()
+        body = json.dumps(payload).encode("utf-8")
+        self.server.metrics.observe_stage("serialize", time.perf_counter() - wall,
+                                          time.process_time() - cpu)
+        self._send(status, body, "application/json", headers)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length)
+
+    def _read_request(self):
+        """JSON本文ならそのまま、音声バイト列ならクエリ文字列をオプションにして返す"""
+        url = urlsplit(self.path)
+        body = self._read_body()
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(body or b"{}"), None
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        request = dict(
+            file=query.get("file"),
+            windows=query.get("windows"),
+            trim=query.get("trim", "").lower() in ("1", "true"),
+            priority=query.get("priority"),
+            timeout_ms=query.get("timeout_ms"),
+        )
+        # ジョブの投入者と、結果を保存する録音（/jobs のみ）
+        for key in ("owner", "recording_id"):
+            if key in query:
+                request[key] = query[key]
+        return request, body
+
+    def do_GET(self):
+        if urlsplit(self.path).path.startswith("/jobs/"):
+            self._handle_jobs("GET")
+        elif self.path == "/health":
+            self._send_json(200, {"status": "ok", "device": self.engine.device,
+                                  "backend": self.engine.backend.name})
+        elif self.path == "/stats":
+            stats = {"cache": self.server.cache.stats(), "metrics": self.server.metrics.snapshot(),
+                     "scheduler": self.server.batcher.scheduler.stats()}
+            if self.server.jobs:
+                stats["jobs"] = self.server.jobs.stats()
+            if isinstance(self.server.batcher, WorkerPool):
+                stats["workers"] = self.server.batcher.memory()
+            self._send_json(200, stats)
+        elif self.path == "/metrics":
+            self._send(200, self.server.metrics.prometheus().encode("utf-8"),
+                       "text/plain; version=0.0.4")
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def _handle_stream(self, method: str) -> None:
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        owner = query.get("owner")
+        streams = self.server.streams
+        if parts[0] != "stream":
+            self._send_json(404, {"error": "Not found"})
+            return
+        if len(parts) == 1:
+            session_id = streams.create(
+                sample_rate=int(query.get("sample_rate") or RECORDING_SR),
+                trim=query.get("trim", "").lower() in ("1", "true"),
+                file=query.get("file"),
+                owner=owner,
+            )
+            self._send_json(200, {"session_id": session_id})
+            return
+        if len(parts) > 3 or (len(parts) == 3 and parts[2] != "finish"):
+            self._send_json(404, {"error": "Not found"})
+            return
+        try:
+            session = streams.get(parts[1], owner)
+        except KeyError:
+            self._send_json(404, {"error": "Unknown or expired stream"})
+            return
+        except PermissionError as e:
+            self._send_json(403, {"error": str(e)})
+            return
+        if method == "DELETE":
+            streams.remove(parts[1])
+            self._send_json(200, {"status": "deleted"})
+            return
+
+        body = self._read_body()
+        try:
+            token = request_token(query, probe=self._client_gone)
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        try:
+            with session.lock:
+                if len(parts) == 3:
+                    result = session.finish(body, token)
+                    streams.remove(parts[1])
+                else:
+                    result = {"segments": session.feed(body), "duration": session.duration}
+        except Cancelled as e:
+            self.server.metrics.observe_cancel(e.reason, token.reclaimed_sec)
+            self._send_cancelled(e)
+            return
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": str(e), "traceback": traceback.format_exc()})
+            return
+        self._send_json(200, result)
+
+    def _handle_jobs(self, method: str) -> None:
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        jobs = self.server.jobs
+        if parts[0] != "jobs" or jobs is None:
+            self._send_json(404, {"error": "Not found"})
+            return
+        if len(parts) == 1 and method == "POST":
+            try:
+                request, data = self._read_request()
+            except ValueError as e:
+                self._send_json(400, {"error": f"Invalid JSON: {e}"})
+                return
+            if not (request.get("url") or request.get("path") or data):
+                self._send_json(400, {"error": "Missing url, path or audio body"})
+                return
+            try:
+                check_priority(request.get("priority"))
+                request_token(request)
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            try:
+                job_id = jobs.enqueue(request, audio=data or None, owner=request.get("owner"))
+            except QueueFull as e:
+                self._send_json(503, {"error": str(e)},
+                                headers={"Retry-After": str(JOB_RETRY_AFTER_SEC)})
+                return
+            self._send_json(202, jobs.get(job_id, request.get("owner")))
+            return
+        action = parts[2] if len(parts) == 3 and method == "POST" else None
+        if not (action in ("ack", "cancel") or (len(parts) == 2 and method == "GET")):
+            self._send_json(404, {"error": "Not found"})
+            return
+        try:
+            job = jobs.get(parts[1], query.get("owner"))
+        except KeyError:
+            self._send_json(404, {"error": "Unknown or expired job"})
+            return
+        except PermissionError as e:
+            self._send_json(403, {"error": str(e)})
+            return
+        if action == "ack":
+            self._send_json(200, {"acked": jobs.ack(parts[1])})
+        elif action == "cancel":
+            self._send_json(200, {"cancelled": jobs.cancel(parts[1])})
+        else:
+            self._send_json(200, job)
+
+    def do_DELETE(self):
+        if urlsplit(self.path).path.startswith("/stream/"):
+            self._handle_stream("DELETE")
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if urlsplit(self.path).path.startswith("/stream"):
+            self._handle_stream("POST")
+            return
+        if urlsplit(self.path).path.startswith("/jobs"):
+            self._handle_jobs("POST")
+            return
+        if urlsplit(self.path).path != "/analyze":
+            self._send_json(404, {"error": "Not found"})
+            return
+        timings = Timings() if self.server.timing else NULL_TIMINGS
+        try:
+            with timings.stage("read"):
+                request, data = self._read_request()
+        except ValueError as e:
+            self._send_json(400, {"error": f"Invalid JSON: {e}"})
+            return
+        if not (request.get("path") or data):
+            self._send_json(400, {"error": "Missing path or audio body"})
+            return
+        try:
+            check_priority(request.get("priority"))
+            token = request_token(request, probe=self._client_gone)
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        try:
+            result = self.server.analyze_request(request, data, timings, token)
+        except Cancelled as e:
+            self._send_cancelled(e)
+            return
+        except Exception as e:
+            self._send_json(500, {"error": str(e), "traceback": traceback.format_exc()})
+            return
+        self._send_json(200, result)
+
+    def _send_cancelled(self, e: Cancelled) -> None:
+        # 切断されていれば届かないが、期限切れなら呼び出し側に知らせる
+        status = 504 if e.reason == "deadline" else 499
+        try:
+            self._send_json(status, {"error": str(e), "reason": e.reason})
+        except OSError:
+            pass
+
+    def _client_gone(self) -> bool:
+        """本文を読み終えた後に接続が閉じられたか（読める状態なのに0バイトなら切断）"""
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            return bool(readable) and not self.connection.recv(1, socket.MSG_PEEK)
+        except OSError:
+            return True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class EmotionServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, engine: EmotionEngine, batcher: "MicroBatcher | WorkerPool",
+                 cache: ResultCache, metrics: Metrics = None, timing: bool = False,
+                 jobs: Optional[JobQueue] = None):
+        super().__init__(address, EmotionRequestHandler)
+        self.engine = engine
+        self.batcher = batcher
+        self.cache = cache
+        self.metrics = metrics or Metrics()
+        self.timing = timing
+        self.streams = StreamRegistry(engine, infer_batch=self.infer_batch)
+        self.jobs = jobs
+
+    def analyze_request(self, request, data=None, timings=NULL_TIMINGS, token=NULL_TOKEN):
+        """本文の音声（なければ request["path"]）を読み込んで分析する（HTTP / IPC 共通）
+
+        data は音声ファイルのバイト列か、16kHz の float32 配列。
+        token（cancel.CancelToken）が取り消されたら Cancelled を送出し、件数を metrics に数える。
+        """
+        started = time.perf_counter()
+        file = request.get("path") or request.get("file")
+        try:
+            token.check()
+            with timings.stage("decode"):
+                if isinstance(data, np.ndarray):
+                    audio = data
+                elif data:
+                    audio = self.engine.decode_audio(data)
+                else:
+                    audio = self.engine.load_audio(request["path"])
+            token.check(len(audio))
+            result = self.analyze(audio, file, request, timings, token)
+        except Cancelled as e:
+            self.metrics.observe_cancel(e.reason, token.reclaimed_sec)
+            print(f"cancelled {file} ({e.reason}) after {time.perf_counter() - started:.3f}s, "
+                  f"skipped {token.reclaimed_sec:.1f}s of audio")
+            raise
+        print(f"analyzed {file} in {time.perf_counter() - started:.3f}s")
+        if timings.enabled:
+            result = dict(result, timing=timings.as_dict())
+            self.metrics.observe(timings)
+        return result
+
+    def analyze(self, audio, file, request, timings=NULL_TIMINGS, token=NULL_TOKEN):
+        """リクエストのオプションに応じて分析する（同じ音声・設定ならキャッシュを返す）"""
+        options = dict(
+            windows=request.get("windows"),
+            trim=bool(request.get("trim")),
+            correction=self.engine.correction,
+        )
+        with timings.stage("cache"):
+            key = cache_key(audio, self.engine.model_id, options)
+            cached = self.cache.get(key)
+        if cached is not None:
+            return dict(cached, file=file, cached=True)
+
+        priority = check_priority(request.get("priority"))
+        if options["windows"]:
+            result = analyze_segments(
+                self.engine, audio, file=file, mode=options["windows"], trim=options["trim"],
+                infer_batch=lambda clips: self.infer_batch(clips, timings, priority, token),
+                timings=timings,
+            )
+        else:
+            trimmed_sec = 0.0
+            if options["trim"]:
+                with timings.stage("trim"):
+                    audio, trimmed_sec = trim_silence(audio)
+            token.check(len(audio))
+            if needs_chunking(self.engine, len(audio)):
+                # 長い録音はマイクロバッチに載せず、区切って順に推論する。
+                # WorkerPool では塊ごとの推論もワーカーに渡す（親で torch を動かすと
+                # コアを取り合い、ワーカーを fork し直したときに子が固まることがある）
+                def call(name, *args):
+                    return wait_results([self.batcher.call(name, args, priority)], token)[0]
+
+                result = analyze_chunked(
+                    self.engine, audio, file=file, budget_mb=self.engine.memory_budget_mb,
+                    timings=timings, token=token,
+                    call=call if isinstance(self.batcher, WorkerPool) else None,
+                )
+            else:
+                raw = self.infer_batch([audio], timings, priority, token)[0]
+                with timings.stage("score"):
+                    result = self.engine.score(raw, file=file)
+            if options["trim"]:
+                result["trimmed_sec"] = trimmed_sec
+        self.cache.put(key, result)
+        return result
+
+    def run_job(self, job: Job, token: CancelToken):
+        """ジョブワーカーの handler（HTTP と同じキャッシュ・マイクロバッチ・計測を使う）"""
+        timings = Timings() if self.timing else NULL_TIMINGS
+        with timings.stage("download"):
+            data = job_audio(job, token)
+        return self.analyze_request(job.request, data, timings, token)
+
+    def infer_batch(self, clips, timings=NULL_TIMINGS, priority=DEFAULT_PRIORITY,
+                    token=NULL_TOKEN):
+        """他のリクエストと同じマイクロバッチに相乗りして推論する
+
+        token が取り消されたら、まだバッチに入っていない窓は推論しない。
+        """
+        token.check(sum(len(clip) for clip in clips))
+        futures = [self.batcher.submit(clip, timings, priority) for clip in clips]
+        return wait_results(futures, token, clips)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常駐型の感情推論サーバー")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--ipc-port", type=int, default=IPC_PORT,
+                        help="バイナリ IPC の待ち受けポート（0で無効）")
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--correction", action="store_true",
+                        help="Youden Index補正を有効にする")
+    parser.add_argument("--correction-profile", default=CORRECTION_PROFILE,
+                        help="calibration.py の補正プロファイル（ディレクトリなら最新版）")
+    parser.add_argument("--backend", choices=["torch", "onnx", "torchscript"], default=BACKEND,
+                        help="onnx / torchscript は export.py で書き出したグラフを使う")
+    parser.add_argument("--avd-head", action="store_true", default=AVD_HEAD,
+                        help="ベースモデルのAVDヘッドも同じ順伝播で出力する")
+    parser.add_argument("--quantize", action="store_true", default=QUANTIZE,
+                        help="バックボーンを動的int8量子化する（CPU専用）")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="推論ワーカープロセス数（重みは親でロードして共有する。0で1プロセス）")
+    parser.add_argument("--threads-per-worker", type=int, default=THREADS_PER_WORKER,
+                        help="ワーカーごとの torch スレッド数（0でコア数÷ワーカー数）")
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    parser.add_argument("--priority-caps", default=PRIORITY_CAPS,
+                        help="優先度クラスごとの推論中クリップ数の上限（例: backfill=8、0で無制限）")
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE,
+                        help="メモリに保持する結果の件数（0で無効）")
+    parser.add_argument("--cache-dir", default=CACHE_DIR,
+                        help="指定するとディスクにも結果を保存する")
+    parser.add_argument("--timing", action="store_true", default=TIMING,
+                        help="段階ごとの処理時間・CPU時間・メモリ増減を計測して結果に付ける")
+    parser.add_argument("--jobs-db", default=str(JOBS_DB),
+                        help="非同期ジョブキューの SQLite ファイル（空文字で /jobs を無効）")
+    parser.add_argument("--job-workers", type=int, default=JOB_WORKERS,
+                        help="サーバー内でジョブを処理するスレッド数（0なら jobs.py worker に任せる）")
+    parser.add_argument("--metrics-file", default=METRICS_FILE,
+                        help="指定すると集計を定期的にJSONで書き出す")
+    args = parser.parse_args()
+
+    correction = YOUDEN_CORRECTION if args.correction else None
+    if args.correction_profile:
+        correction = load_profile(args.correction_profile)
+        print(f"補正プロファイル: {correction}")
+
+    print("モデルをロード中...")
+    started, started_cpu = time.perf_counter(), time.process_time()
+    engine = EmotionEngine.load(
+        device=args.device,
+        quantize=args.quantize,
+        backend=args.backend,
+        avd_head=args.avd_head,
+        correction=correction,
+    )
+    print(f"ロード完了 ({time.perf_counter() - started:.1f}s, device={engine.device})")
+    metrics = Metrics()
+    metrics.observe_stage("model_load", time.perf_counter() - started,
+                          time.process_time() - started_cpu)
+
+    caps = parse_caps(args.priority_caps)
+    if args.workers:
+        batcher = WorkerPool(engine, args.workers, threads_per_worker=args.threads_per_worker,
+                             max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+                             caps=caps, metrics=metrics)
+        print(f"ワーカー {batcher.workers} プロセス × {batcher.threads_per_worker} スレッド")
+    else:
+        batcher = MicroBatcher(engine, max_batch_size=args.max_batch_size,
+                               max_wait_ms=args.max_wait_ms, caps=caps, metrics=metrics)
+    # ワーカーを fork した後にスレッドを起動する
+    exporter = MetricsFileExporter(metrics, args.metrics_file) if args.metrics_file else None
+    cache = ResultCache(max_entries=args.cache_size, disk_dir=args.cache_dir)
+    jobs = JobQueue(args.jobs_db) if args.jobs_db else None
+    server = EmotionServer((args.host, args.port), engine, batcher, cache,
+                           metrics=metrics, timing=args.timing, jobs=jobs)
+    job_workers = [JobWorker(jobs, server.run_job, metrics=metrics).start()
+                   for _ in range(args.job_workers if jobs else 0)]
+    print(f"Listening on http://{args.host}:{args.port}")
+    ipc_server = None
+    if args.ipc_port:
+        ipc_server = IpcServer((args.host, args.ipc_port), server)
+        threading.Thread(target=ipc_server.serve_forever, daemon=True).start()
+        print(f"IPC listening on {args.host}:{args.ipc_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in job_workers:
+            worker.stop()
+        server.server_close()
+        if ipc_server:
+            ipc_server.shutdown()
+            ipc_server.server_close()
+        batcher.close()
+        if jobs:
+            jobs.close()
+        if exporter:
+            exporter.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""Supabase Storage（や署名付きURL）から音声を読むクライアント
+
+urllib.request.urlopen は1ファイルごとに接続を張り直し、一括処理では1件ずつ順に待つことになる。
+ここでは:
+
+- ホストごとに HTTP/1.1 の接続をプールして keep-alive で使い回す（同時に使うのは pool_size 本まで）。
+- 本文はチャンクごとにメモリへ読み込む（start / end でバイト範囲だけ読むこともできる）。
+- 接続の切断・タイムアウト・408 / 429 / 5xx は待ち時間を倍にしながら再試行する（Retry-After があれば従う）。
+  途中で切れたときは、読めたところから Range で続きを取る。
+- prefetch で次の N 件を並行してダウンロードしておき、推論している間に読み終える。
+
+    client = StorageClient()
+    data = client.get(signed_url)
+    for url, data, error in client.prefetch(urls, ahead=8):
+        ...
+
+EMOTION_STORAGE_URL 宛てのリクエストにだけ EMOTION_STORAGE_KEY を付ける（object_url でパスからURLを作る）。
+"""
+import http.client
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+from urllib.parse import quote, urlsplit
+
+from .cancel import NULL_TOKEN
+from .config import (
+    STORAGE_BACKOFF_SEC, STORAGE_KEY, STORAGE_POOL_SIZE, STORAGE_PREFETCH, STORAGE_RETRIES,
+    STORAGE_TIMEOUT_SEC, STORAGE_URL,
+)
+
+# 再試行するステータス
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+# 1回に読む本文の大きさ
+CHUNK_BYTES = 256 * 1024
+# Retry-After に従って待つ上限（秒）
+MAX_RETRY_AFTER_SEC = 30.0
+# 再利用した接続がサーバー側で閉じられていたときに使う例外（再試行の回数に数えない）
+_STALE = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class StorageError(Exception):
+    """ダウンロードに失敗した（status は HTTP のステータス、接続エラーなら None）"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class _Retryable(Exception):
+    def __init__(self, status: int, retry_after: Optional[float]):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class _HostPool:
+    """1つのホストへの keep-alive 接続"""
+
+    def __init__(self, scheme: str, netloc: str, size: int, timeout: float):
+        connection = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        self._new = lambda: connection(netloc, timeout=timeout)
+        self._idle: "queue.LifoQueue[http.client.HTTPConnection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        """空いている接続を借りる。例外が出たら接続は閉じて捨てる"""
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._new()
+            try:
+                yield conn
+            except BaseException:
+                conn.close()
+                raise
+            self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def object_url(path: str, base: Optional[str] = STORAGE_URL) -> str:
+    """バケット内のパス（voice_recordings.file_path）をオブジェクトのURLにする"""
+    if not base:
+        raise ValueError("EMOTION_STORAGE_URL is not set")
+    return f"{base.rstrip('/')}/{quote(path)}"
+
+
+class StorageClient:
+    """接続プール付きの HTTP(S) ダウンローダー（スレッドセーフ）"""
+
+    def __init__(self, base_url: Optional[str] = STORAGE_URL, key: Optional[str] = STORAGE_KEY,
+                 pool_size: int = STORAGE_POOL_SIZE, timeout: float = STORAGE_TIMEOUT_SEC,
+                 retries: int = STORAGE_RETRIES, backoff_sec: float = STORAGE_BACKOFF_SEC):
+        self.base_url = base_url
+        self.key = key
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_sec = backoff_sec
+        self._pools: Dict[Tuple[str, str], _HostPool] = {}
+        self._lock = threading.Lock()
+        self._stats = dict(requests=0, connections=0, retries=0, bytes=0)
+
+    def _pool(self, scheme: str, netloc: str) -> _HostPool:
+        with self._lock:
+            pool = self._pools.get((scheme, netloc))
+            if pool is None:
+                pool = _HostPool(scheme, netloc, self.pool_size, self.timeout)
+                self._pools[(scheme, netloc)] = pool
+            return pool
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += n
+
+    def _is_storage_url(self, url: str) -> bool:
+        """base_url と同じスキーム・ホストで、パスが base_url の下（"/" の区切りまで一致）か"""
+        base, parts = urlsplit(self.base_url), urlsplit(url)
+        if (parts.scheme, parts.netloc) != (base.scheme, base.netloc):
+            return False
+        prefix = base.path.rstrip("/")
+        return parts.path == base.path or parts.path.startswith(prefix + "/")
+
+    def _headers(self, url: str) -> Dict[str, str]:
+        headers = {"Accept-Encoding": "identity"}
+        if self.key and self.base_url and self._is_storage_url(url):
+            headers.update(Authorization=f"Bearer {self.key}", apikey=self.key)
+        return headers
+
+    def get(self, url: str, start: int = 0, end: Optional[int] = None, token=NULL_TOKEN) -> bytes:
+        """url の本文（start / end を指定すれば [start, end) のバイト範囲）を返す
+
+        token（cancel.CancelToken）が取り消されたらチャンクの切れ目で Cancelled を送出する。
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported URL scheme: {parts.scheme}")
+        pool = self._pool(parts.scheme, parts.netloc)
+        target = parts.path + (f"?{parts.query}" if parts.query else "")
+        out = bytearray()
+        attempt = 0
+        while True:
+            token.check()
+            offset = start + len(out)
+            headers = self._headers(url)
+            if offset or end is not None:
+                headers["Range"] = f"bytes={offset}-{'' if end is None else end - 1}"
+            try:
+                with pool.connection() as conn:
+                    reused = conn.sock is not None
+                    self._count("requests")
+                    if not reused:
+                        self._count("connections")
+                    try:
+                        conn.request("GET", target, headers=headers)
+                        response = conn.getresponse()
+                    except _STALE:
+                        if not reused:
+                            raise
+                        # keep-alive の接続がサーバー側で閉じられていた。張り直してすぐ送り直す
+                        conn.close()
+                        self._count("connections")
+                        conn.request("GET", target, headers=headers)
+                        response = conn.getresponse()
+                    self._read_body(response, out, offset, start, end, token)
+                return bytes(out)
+            except (_Retryable, OSError, http.client.HTTPException) as e:
+                attempt += 1
+                if attempt > self.retries:
+                    status = getattr(e, "status", None)
+                    raise StorageError(f"Download failed after {attempt} attempts: {e}", status)
+                self._count("retries")
+                delay = self.backoff_sec * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                retry_after = getattr(e, "retry_after", None)
+                if retry_after is not None:
+                    delay = max(delay, min(retry_after, MAX_RETRY_AFTER_SEC))
+                time.sleep(delay)
+
+    def _read_body(self, response, out: bytearray, offset: int, start: int,
+                   end: Optional[int], token) -> None:
+        """レスポンスの本文を out に追記する（途中で切れたら読めた分は out に残る）"""
+        if response.status in RETRY_STATUSES:
+            response.read()
+            retry_after = response.getheader("Retry-After")
+            raise _Retryable(response.status,
+                             float(retry_after) if retry_after and retry_after.isdigit() else None)
+        if response.status >= 400:
+            body = response.read(512).decode("utf-8", "replace")
+            raise StorageError(f"HTTP {response.status}: {body}", response.status)
+        skip = 0
+        if response.status == 200 and offset:
+            # Range が無視された。先頭から読み直して要らない部分を捨てる
+            del out[:]
+            skip = start
+        remaining = None if end is None else end - start - len(out)
+        truncated = False
+        while remaining is None or remaining > 0:
+            chunk = response.read(CHUNK_BYTES)
+            if not chunk:
+                # Content-Length 分を読み切る前に接続が切れた（read は例外を出さず空を返す）
+                truncated = bool(response.length)
+                break
+            if skip:
+                dropped = min(skip, len(chunk))
+                chunk, skip = chunk[dropped:], skip - dropped
+            if remaining is not None:
+                chunk = chunk[:remaining]
+                remaining -= len(chunk)
+            out += chunk
+            self._count("bytes", len(chunk))
+            token.check()
+        if truncated:
+            raise http.client.IncompleteRead(bytes(), response.length)
+        if not response.isclosed():
+            # 範囲の途中でやめた（サーバーが Range を無視した）ときは残りを読み捨てて接続を返す
+            response.read()
+
+    def prefetch(self, urls: Iterable[str], ahead: int = STORAGE_PREFETCH,
+                 token=NULL_TOKEN) -> Iterator[Tuple[str, Optional[bytes], Optional[str]]]:
+        """urls を ahead 件先まで並行してダウンロードし、urls の順に (url, data, error) を返す"""
+        ahead = max(1, ahead)
+        with ThreadPoolExecutor(ahead, thread_name_prefix="storage-prefetch") as executor:
+            pending = deque()
+            for url in urls:
+                pending.append((url, executor.submit(self.get, url, token=token)))
+                if len(pending) >= ahead:
+                    yield self._result(*pending.popleft())
+            while pending:
+                yield self._result(*pending.popleft())
+
+    @staticmethod
+    def _result(url, future) -> Tuple[str, Optional[bytes], Optional[str]]:
+        try:
+            return url, future.result(), None
+        except Exception as e:
+            return url, None, f"{type(e).__name__}: {e}"
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def close(self) -> None:
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.close()
+
+
+_default: Optional[StorageClient] = None
+_default_lock = threading.Lock()
+
+
+def default_client() -> StorageClient:
+    """プロセスで共有するクライアント（ジョブのダウンロードなど）"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = StorageClient()
+        return _default
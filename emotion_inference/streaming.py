@@ -0,0 +1,223 @@
+"""録音中の音声を少しずつ受け取って分析するストリーミングAPI
+
+録音の途中から PCM（またはWAV）のチャンクを受け取り、固定長の窓が確定するたびに
+推論して区間の結果を返す。停止時には残りの窓だけを推論して集計するので、
+録音後の待ち時間は録音の長さによらず窓1つ分程度になる。
+
+窓の切り方は segments.fixed_windows と同じで、最後まで送り終えた結果は
+同じ音声を analyze_segments(mode="fixed") にかけた結果と一致する。
+（VAD の閾値は音声全体の最大エネルギーで決まるので、途中では確定できない）
+
+    session = StreamSession(engine, sample_rate=44100, trim=True)
+    for chunk in chunks:
+        new_segments = session.feed(chunk)
+    result = session.finish()
+"""
+import threading
+import time
+import uuid
+from math import gcd
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from .audio import (
+    RESAMPLE_MARGIN, WAVE_FORMAT_PCM, WavInfo, parse_wav_header, pcm_to_float32, resample_range,
+    resampled_length,
+)
+from .cancel import NULL_TOKEN
+from .config import SAMPLING_RATE, STREAM_TTL_SEC
+from .engine import EmotionEngine
+from .segments import (
+    HOP_SEC, MIN_WINDOW_SEC, WINDOW_SEC, build_segment, fixed_windows, summarize,
+)
+from .vad import trim_silence
+
+# ブラウザの録音（wavRecorder.ts）の既定
+RECORDING_SR = 44100
+
+
+class StreamSession:
+    """1回の録音分の状態（受け取った音声・確定した区間）を持つ
+
+    チャンクは16bit PCM の生データか、先頭にWAVヘッダーの付いたものを受け付ける。
+    推論が済んだ窓より前の音声は捨てるので、メモリは録音の長さに比例しない。
+    infer_batch は infer_batch(clips, token=...) の形で呼ぶ（server.EmotionServer.infer_batch と同じ）。
+    """
+
+    def __init__(self, engine: EmotionEngine, sample_rate: int = RECORDING_SR,
+                 trim: bool = False, file: Optional[str] = None, owner: Optional[str] = None,
+                 window_sec: float = WINDOW_SEC, hop_sec: float = HOP_SEC,
+                 infer_batch: Optional[Callable[[List[np.ndarray]], np.ndarray]] = None):
+        self.engine = engine
+        self.trim = trim
+        self.file = file
+        self.owner = owner
+        self.window_sec, self.hop_sec = window_sec, hop_sec
+        self.infer_batch = infer_batch or self._infer_direct
+        self.segments: List[Dict[str, Any]] = []
+        self.trimmed_sec = 0.0
+        self.finished = False
+        self.last_active = time.monotonic()
+        self.lock = threading.Lock()
+
+        self._format = WavInfo(WAVE_FORMAT_PCM, 1, sample_rate, 16, 0, 0)
+        self._remainder = b""
+        # 入力のサンプリングレートのまま持つ（_buffer[0] は入力の _offset 番目のサンプル）
+        self._buffer = np.empty(0, dtype=np.float32)
+        self._offset = 0
+        self._received = 0
+        # 次に推論する窓の番号
+        self._next = 0
+
+    def _infer_direct(self, clips: List[np.ndarray], token=NULL_TOKEN) -> np.ndarray:
+        token.check(sum(len(clip) for clip in clips))
+        return self.engine.infer_batch(clips)
+
+    @property
+    def duration(self) -> float:
+        return self._received / self._format.sample_rate
+
+    def _ratio(self):
+        g = gcd(self._format.sample_rate, SAMPLING_RATE)
+        return SAMPLING_RATE // g, self._format.sample_rate // g
+
+    def _append(self, data: bytes) -> None:
+        if data[:4] == b"RIFF":
+            info = parse_wav_header(data)
+            if self._received and info.sample_rate != self._format.sample_rate:
+                raise ValueError("Sample rate changed in the middle of the stream")
+            self._format = info
+            data = data[info.data_offset:info.data_offset + info.data_size]
+        data = self._remainder + data
+        frame_bytes = self._format.bits_per_sample // 8 * self._format.channels
+        usable = len(data) - len(data) % frame_bytes
+        self._remainder = data[usable:]
+        if not usable:
+            return
+        samples = pcm_to_float32(np.frombuffer(data, dtype=np.uint8, count=usable),
+                                 self._format._replace(data_offset=0, data_size=usable))
+        self._buffer = np.concatenate([self._buffer, samples])
+        self._received += len(samples)
+
+    def _available(self, final: bool) -> int:
+        """16kHz に直したときに値が確定しているサンプル数"""
+        if final:
+            return resampled_length(self._received, self._format.sample_rate)
+        up, down = self._ratio()
+        return max(self._received - RESAMPLE_MARGIN, 0) * up // down
+
+    def _audio(self, start: int, end: int) -> np.ndarray:
+        """16kHz での [start, end) を、全体を一度にリサンプリングした場合と同じ値で返す"""
+        return resample_range(lambda a, b: self._buffer[a - self._offset:b - self._offset],
+                              self._received, self._format.sample_rate, start, end)
+
+    def _ready_windows(self, final: bool) -> List[tuple]:
+        sr = SAMPLING_RATE
+        n = self._available(final)
+        if final:
+            return fixed_windows(n, sr, self.window_sec, self.hop_sec)[self._next:]
+        window, hop = int(self.window_sec * sr), int(self.hop_sec * sr)
+        min_window = int(MIN_WINDOW_SEC * sr)
+        windows = []
+        k = self._next
+        # 後ろにさらに窓が続くと分かった窓だけ確定させる（最後の窓は短い余りを含めて伸びるため）
+        while (k + 1) * hop + min_window < n and k * hop + window <= n:
+            windows.append((k * hop, k * hop + window))
+            k += 1
+        return windows
+
+    def _run(self, final: bool, token=NULL_TOKEN) -> List[Dict[str, Any]]:
+        windows = self._ready_windows(final)
+        if not windows:
+            return []
+        clips = [self._audio(start, end) for start, end in windows]
+        if self.trim:
+            trimmed = [trim_silence(clip) for clip in clips]
+            clips = [clip for clip, _ in trimmed]
+            self.trimmed_sec += sum(dropped for _, dropped in trimmed)
+        raws = self.infer_batch(clips, token=token)
+        segments = [build_segment(self.engine, self._next + i + 1, start, end, raw)
+                    for i, ((start, end), raw) in enumerate(zip(windows, raws))]
+        self.segments.extend(segments)
+        self._next += len(windows)
+        self._discard()
+        return segments
+
+    def _discard(self) -> None:
+        """推論が済んだ窓の分の入力を捨てる（次の窓のリサンプリングに要る分は残す）"""
+        up, down = self._ratio()
+        start = self._next * int(self.hop_sec * SAMPLING_RATE)
+        keep_from = max(start * down // up - RESAMPLE_MARGIN, 0) // down * down
+        if keep_from > self._offset:
+            self._buffer = self._buffer[keep_from - self._offset:].copy()
+            self._offset = keep_from
+
+    def feed(self, data: bytes) -> List[Dict[str, Any]]:
+        """チャンクを追加し、新たに確定した区間の結果を返す"""
+        if self.finished:
+            raise ValueError("Stream is already finished")
+        self.last_active = time.monotonic()
+        self._append(data)
+        return self._run(final=False)
+
+    def finish(self, data: bytes = b"", token=NULL_TOKEN) -> Dict[str, Any]:
+        """残りの窓を推論し、analyze_segments と同じ形式の結果を返す
+
+        token（cancel.CancelToken）が取り消されたら Cancelled を送出する。
+        推論前の状態のままなので、もう一度 finish できる。
+        """
+        if self.finished:
+            raise ValueError("Stream is already finished")
+        if data:
+            self._append(data)
+        self._run(final=True, token=token)
+        self.finished = True
+        if not self.segments:
+            raise ValueError("Audio is empty")
+        result = summarize(self.segments, self.file)
+        if self.trim:
+            result["trimmed_sec"] = self.trimmed_sec
+        return result
+
+
+class StreamRegistry:
+    """サーバーで進行中のセッションを ID で管理する（ttl 秒やり取りがなければ捨てる）"""
+
+    def __init__(self, engine: EmotionEngine, ttl_sec: float = STREAM_TTL_SEC,
+                 infer_batch: Optional[Callable[[List[np.ndarray]], np.ndarray]] = None):
+        self.engine = engine
+        self.ttl_sec = ttl_sec
+        self.infer_batch = infer_batch
+        self._sessions: Dict[str, StreamSession] = {}
+        self._lock = threading.Lock()
+
+    def _sweep(self) -> None:
+        deadline = time.monotonic() - self.ttl_sec
+        for session_id, session in list(self._sessions.items()):
+            if session.last_active < deadline:
+                del self._sessions[session_id]
+
+    def create(self, **options) -> str:
+        session = StreamSession(self.engine, infer_batch=self.infer_batch, **options)
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._sweep()
+            self._sessions[session_id] = session
+        return session_id
+
+    def get(self, session_id: str, owner: Optional[str] = None) -> StreamSession:
+        """なければ KeyError、作成者と違えば PermissionError"""
+        with self._lock:
+            self._sweep()
+            session = self._sessions[session_id]
+        if session.owner is not None and session.owner != owner:
+            raise PermissionError("Stream belongs to another user")
+        return session
+
+    def remove(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
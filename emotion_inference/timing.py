@@ -0,0 +1,219 @@
+"""処理段階ごとの計測（経過時間・CPU時間・メモリ増減）と集計
+
+    timings = Timings()
+    with timings.stage("decode"):
+        audio = decode_audio_bytes(data)
+    result["timing"] = timings.as_dict()
+    metrics.observe(timings)
+
+計測しないときは NULL_TIMINGS を渡す（stage() は何もしないコンテキストを返すだけ）。
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List
+
+# ヒストグラムの上限（ミリ秒）
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+
+def current_rss() -> int:
+    """現在の常駐メモリ（バイト）。/proc がなければプロセス全体のピークで代用する"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Timings:
+    """1リクエスト分の段階ごとの計測値
+
+    CPU時間は process_time（プロセス全体）なので、推論スレッドの分も含むが
+    同時に処理している他のリクエストの分も混ざる。
+    同じ段階を複数回通ったとき（窓ごとの推論など）は合計する。
+    """
+    enabled = True
+
+    def __init__(self):
+        self.stages: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        wall, cpu, rss = time.perf_counter(), time.process_time(), current_rss()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.process_time() - cpu,
+                     current_rss() - rss)
+
+    def add(self, name: str, wall: float, cpu: float = 0.0, rss: int = 0) -> None:
+        with self._lock:
+            total = self.stages.setdefault(name, [0.0, 0.0, 0])
+            total[0] += wall
+            total[1] += cpu
+            total[2] += rss
+
+    def merge(self, other: "Timings") -> None:
+        for name, (wall, cpu, rss) in list(other.stages.items()):
+            self.add(name, wall, cpu, rss)
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        """結果に付ける形（ミリ秒・MB、小数2桁）"""
+        return {
+            name: dict(wall_ms=round(wall * 1000, 2), cpu_ms=round(cpu * 1000, 2),
+                       rss_delta_mb=round(rss / 2 ** 20, 2))
+            for name, (wall, cpu, rss) in self.stages.items()
+        }
+
+
+class _NullTimings:
+    """計測しないときの Timings（何も記録しない）"""
+    enabled = False
+    stages: Dict[str, List[float]] = {}
+    # nullcontext は使い回せるので、呼ぶたびにオブジェクトを作らない
+    _context = nullcontext()
+
+    def stage(self, name: str):
+        return self._context
+
+    def add(self, name: str, wall: float, cpu: float = 0.0, rss: int = 0) -> None:
+        pass
+
+    def merge(self, other) -> None:
+        pass
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        return {}
+
+
+NULL_TIMINGS = _NullTimings()
+
+
+class Histogram:
+    """固定バケットの累積ヒストグラム（Prometheus と同じ le 形式）"""
+
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> Dict[str, object]:
+        cumulative, running = {}, 0
+        for upper, n in zip([*self.buckets, "+Inf"], self.counts):
+            running += n
+            cumulative[str(upper)] = running
+        return dict(count=self.count, sum=round(self.sum, 3), buckets=cumulative)
+
+
+class Metrics:
+    """段階ごとの経過時間・CPU時間のヒストグラムを集計する"""
+
+    def __init__(self):
+        self.wall: Dict[str, Histogram] = {}
+        self.cpu: Dict[str, Histogram] = {}
+        self.requests = 0
+        # 取り消し・期限切れ（cancel.py）の理由ごとの件数と、推論せずに済んだ音声の秒数
+        self.cancelled: Dict[str, int] = {}
+        self.reclaimed_sec: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, timings: Timings) -> None:
+        if not timings.enabled:
+            return
+        with self._lock:
+            self.requests += 1
+            for name, (wall, cpu, _) in list(timings.stages.items()):
+                self.wall.setdefault(name, Histogram()).observe(wall * 1000)
+                self.cpu.setdefault(name, Histogram()).observe(cpu * 1000)
+
+    def observe_stage(self, name: str, wall: float, cpu: float = 0.0) -> None:
+        """リクエストに紐づかない段階（モデルのロード、JSONの書き出しなど）を記録する"""
+        with self._lock:
+            self.wall.setdefault(name, Histogram()).observe(wall * 1000)
+            self.cpu.setdefault(name, Histogram()).observe(cpu * 1000)
+
+    def observe_cancel(self, reason: str, reclaimed_sec: float = 0.0) -> None:
+        """取り消されたリクエストを1件数える"""
+        with self._lock:
+            self.cancelled[reason] = self.cancelled.get(reason, 0) + 1
+            self.reclaimed_sec[reason] = self.reclaimed_sec.get(reason, 0.0) + reclaimed_sec
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            return dict(
+                requests=self.requests,
+                wall_ms={name: h.snapshot() for name, h in self.wall.items()},
+                cpu_ms={name: h.snapshot() for name, h in self.cpu.items()},
+                cancelled={reason: dict(count=n,
+                                        reclaimed_audio_sec=round(self.reclaimed_sec[reason], 3))
+                           for reason, n in self.cancelled.items()},
+            )
+
+    def prometheus(self) -> str:
+        """/metrics 用のテキスト形式"""
+        snapshot = self.snapshot()
+        lines = [
+            "# TYPE emotion_requests_total counter",
+            f"emotion_requests_total {snapshot['requests']}",
+        ]
+        for kind in ("wall_ms", "cpu_ms"):
+            metric = f"emotion_stage_{kind}"
+            lines.append(f"# TYPE {metric} histogram")
+            for name, h in sorted(snapshot[kind].items()):
+                for upper, n in h["buckets"].items():
+                    lines.append(f'{metric}_bucket{{stage="{name}",le="{upper}"}} {n}')
+                lines.append(f'{metric}_sum{{stage="{name}"}} {h["sum"]}')
+                lines.append(f'{metric}_count{{stage="{name}"}} {h["count"]}')
+        lines.append("# TYPE emotion_cancelled_total counter")
+        for reason, c in sorted(snapshot["cancelled"].items()):
+            lines.append(f'emotion_cancelled_total{{reason="{reason}"}} {c["count"]}')
+        lines.append("# TYPE emotion_cancel_reclaimed_audio_seconds_total counter")
+        for reason, c in sorted(snapshot["cancelled"].items()):
+            lines.append(f'emotion_cancel_reclaimed_audio_seconds_total{{reason="{reason}"}} '
+                         f'{c["reclaimed_audio_sec"]}')
+        return "\n".join(lines) + "\n"
+
+
+class MetricsFileExporter:
+    """interval 秒ごとに集計をJSONファイルに書き出す（終了時にも書く）"""
+
+    def __init__(self, metrics: Metrics, path, interval: float = 60.0):
+        self.metrics = metrics
+        self.path = str(path)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-exporter", daemon=True)
+        self._thread.start()
+
+    def write(self) -> None:
+        # 読み手が書きかけのファイルを見ないよう一時ファイルから置き換える
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.metrics.snapshot(), f)
+        os.replace(tmp, self.path)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.write()
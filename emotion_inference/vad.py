@@ -0,0 +1,87 @@
+"""エネルギーベースの発話区間検出（NumPyのみ、追加モデルなし）"""
+from typing import List, Tuple
+
+import numpy as np
+
+from .config import SAMPLING_RATE
+
+FRAME_MS = 30
+# 最大フレームエネルギーからこれ以上小さいフレームを無音とみなす
+SILENCE_THRESHOLD_DB = -35.0
+MIN_SPEECH_SEC = 0.3
+MIN_SILENCE_SEC = 0.5
+
+
+def frame_energy_db(audio: np.ndarray, sr: int = SAMPLING_RATE,
+                    frame_ms: int = FRAME_MS) -> np.ndarray:
+    """フレームごとのRMSエネルギー（dB）"""
+    frame = int(sr * frame_ms / 1000)
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return np.empty(0, dtype=np.float32)
+    frames = np.asarray(audio[:n_frames * frame], dtype=np.float32).reshape(n_frames, frame)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def speech_mask(audio: np.ndarray, sr: int = SAMPLING_RATE, frame_ms: int = FRAME_MS,
+                threshold_db: float = SILENCE_THRESHOLD_DB) -> np.ndarray:
+    """発話フレームなら True のマスク"""
+    energy = frame_energy_db(audio, sr, frame_ms)
+    if energy.size == 0:
+        return np.zeros(0, dtype=bool)
+    return energy > energy.max() + threshold_db
+
+
+def speech_regions(audio: np.ndarray, sr: int = SAMPLING_RATE, frame_ms: int = FRAME_MS,
+                   threshold_db: float = SILENCE_THRESHOLD_DB,
+                   min_speech_sec: float = MIN_SPEECH_SEC,
+                   min_silence_sec: float = MIN_SILENCE_SEC) -> List[Tuple[int, int]]:
+    """発話区間を (開始サンプル, 終了サンプル) のリストで返す
+
+    min_silence_sec より短い無音は前後の発話とつなげ、min_speech_sec より短い発話は捨てる。
+    """
+    mask = speech_mask(audio, sr, frame_ms, threshold_db)
+    if not mask.any():
+        return []
+    frame = int(sr * frame_ms / 1000)
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    max_gap = min_silence_sec * 1000 / frame_ms
+    keep = np.concatenate(([True], starts[1:] - ends[:-1] >= max_gap))
+    group = np.cumsum(keep) - 1
+    merged_starts = starts[keep]
+    merged_ends = np.zeros_like(merged_starts)
+    np.maximum.at(merged_ends, group, ends)
+
+    min_frames = min_speech_sec * 1000 / frame_ms
+    long_enough = merged_ends - merged_starts >= min_frames
+    return [(int(s) * frame, min(int(e) * frame, len(audio)))
+            for s, e in zip(merged_starts[long_enough], merged_ends[long_enough])]
+
+
+# 発話区間の前後に残す余白（立ち上がりの小さい子音を削らないため）
+PAD_SEC = 0.1
+# これより長いポーズはこの長さまで詰める
+MAX_PAUSE_SEC = 0.3
+
+
+def trim_silence(audio: np.ndarray, sr: int = SAMPLING_RATE, pad_sec: float = PAD_SEC,
+                 max_pause_sec: float = MAX_PAUSE_SEC) -> Tuple[np.ndarray, float]:
+    """前後の無音を削り、長いポーズを max_pause_sec に詰めた音声と削った秒数を返す
+
+    発話が検出できない場合は元の音声をそのまま返す。
+    """
+    regions = speech_regions(audio, sr, min_silence_sec=max_pause_sec)
+    if not regions:
+        return audio, 0.0
+    pad, pause = int(pad_sec * sr), int(max_pause_sec * sr)
+    starts = np.maximum(np.array([s for s, _ in regions]) - pad, 0)
+    ends = np.array([e for _, e in regions])
+    # 区間の間のポーズは max_pause_sec だけ残し、最後の区間は余白だけ残す
+    ends[:-1] = np.minimum(ends[:-1] + max(pad, pause), starts[1:])
+    ends[-1] = min(ends[-1] + pad, len(audio))
+    trimmed = np.concatenate([audio[s:e] for s, e in zip(starts, ends)])
+    return trimmed, (len(audio) - len(trimmed)) / sr
@@ -0,0 +1,272 @@
+"""重みを共有する推論ワーカープール（複数プロセス）
+
+親プロセスでモデルを一度だけロードしてから fork するので、ワーカーは重み（約1.2GB）を
+コピーオンライトで共有する。重みは読むだけなのでページは複製されず、
+ワーカーを1つ増やして増えるのはワーカー自身の作業用メモリだけになる。
+バッチは親が優先度クラス（scheduler.py）ごとに組み、空いたワーカーに1つずつ渡す。
+ワーカーの手元に先のバッチを溜めないので、後から来た interactive も次のバッチの切れ目で先に流れる。
+
+MicroBatcher と同じ submit(audio, timings) -> Future を持つので、サーバーではそのまま置き換えられる。
+長い録音の塊ごとの推論（chunked.py）も call でワーカーに渡し、親プロセスでは torch を動かさない。
+"""
+import gc
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .chunked import OPS
+from .config import MAX_BATCH_SIZE, MAX_WAIT_MS
+from .engine import EmotionEngine
+from .scheduler import DEFAULT_PRIORITY, BatchScheduler, check_priority
+from .timing import NULL_TIMINGS, Timings
+
+
+def _worker_main(index: int, engine: EmotionEngine, tasks, results, threads: int) -> None:
+    """ワーカープロセスの本体（fork で引き継いだ engine を使う）。None を受け取ったら終わる"""
+    import torch
+
+    # ワーカー数 × スレッド数がコア数を超えないようにする
+    torch.set_num_threads(threads)
+    while True:
+        # 待っている間に他のワーカーと共有するロックを持たない（落ちても他が止まらないように）
+        batch = tasks.get()
+        if batch is None:
+            return
+        ids = [task_id for task_id, _, _, _ in batch]
+        started = time.perf_counter()
+        timings = Timings() if any(timed for _, _, _, timed in batch) else NULL_TIMINGS
+        # 音声はまとめてバッチ推論し、call で渡された (名前, 引数) は1つずつ実行する
+        clips = [i for i, (_, payload, _, _) in enumerate(batch)
+                 if isinstance(payload, np.ndarray)]
+        rows = [None] * len(batch)
+        try:
+            if clips:
+                for i, row in zip(clips, engine.infer_batch([batch[i][1] for i in clips],
+                                                            timings)):
+                    rows[i] = row
+            for i, (_, payload, _, _) in enumerate(batch):
+                if not isinstance(payload, np.ndarray):
+                    name, args = payload
+                    rows[i] = OPS[name](engine, *args)
+        except Exception as e:
+            results.put(("error", index, ids, f"{type(e).__name__}: {e}"))
+            continue
+        waits = [started - submitted for _, _, submitted, _ in batch]
+        results.put(("done", index, ids, rows, waits, timings.stages))
+
+
+def _memory(pid: int) -> Dict[str, float]:
+    """/proc/<pid>/smaps_rollup の RSS・PSS（共有ページを按分した値）・専有分（MB）"""
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if value.strip().endswith("kB"):
+                    fields[key] = int(value.split()[0]) / 1024
+    except OSError:
+        return {}
+    return dict(
+        rss_mb=round(fields.get("Rss", 0.0), 1),
+        pss_mb=round(fields.get("Pss", 0.0), 1),
+        private_mb=round(fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0), 1),
+    )
+
+
+class WorkerPool:
+    """workers 個のプロセスで推論する（threads_per_worker 省略時はコア数をワーカー数で割る）
+
+    親プロセスでは推論しないこと（torch のスレッドプールを作ってから fork すると子が固まることがある）。
+    """
+
+    def __init__(self, engine: EmotionEngine, workers: int, threads_per_worker: int = 0,
+                 max_batch_size: int = MAX_BATCH_SIZE, max_wait_ms: float = MAX_WAIT_MS,
+                 caps=None, metrics=None):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.engine = engine
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.scheduler = BatchScheduler(max_batch_size, self.max_wait, caps=caps, metrics=metrics)
+
+        context = multiprocessing.get_context("fork")
+        self._context = context
+        # ワーカーごとのバッチのキュー（起動し直すときに作り直す）
+        self._tasks: List = [None] * workers
+        self._results = context.Queue()
+        self._ids = itertools.count()
+        self._pending: Dict[int, Tuple[Future, Timings, str]] = {}
+        # 空いているワーカーの番号（渡したバッチが終わるか、ワーカーが落ちたら戻す）
+        self._free: "queue.Queue[int]" = queue.Queue()
+        for index in range(workers):
+            self._free.put(index)
+        # ワーカーごとに渡したタスク（渡す前に親で記録するので、受け取る前に落ちても分かる）
+        self._in_flight: Dict[int, List[int]] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # 親から引き継いだオブジェクトを GC が書き換えて、共有ページが複製されるのを防ぐ
+        gc.collect()
+        gc.freeze()
+        self._processes = [self._spawn(i) for i in range(workers)]
+        self._reader = threading.Thread(target=self._read_results, name="worker-results",
+                                        daemon=True)
+        self._reader.start()
+        self._dispatcher = threading.Thread(target=self._dispatch, name="worker-dispatch",
+                                            daemon=True)
+        self._dispatcher.start()
+
+    def _spawn(self, index: int):
+        # 落ちたワーカーがキューのロックを持ったままかもしれないので、キューは使い回さない
+        self._tasks[index] = self._context.Queue()
+        process = self._context.Process(
+            target=_worker_main, name=f"emotion-worker-{index}", daemon=True,
+            args=(index, self.engine, self._tasks[index], self._results,
+                  self.threads_per_worker),
+        )
+        process.start()
+        return process
+
+    def submit(self, audio: np.ndarray, timings=NULL_TIMINGS,
+               priority: str = DEFAULT_PRIORITY) -> Future:
+        """推論を予約し、生の出力の行を返す Future を得る"""
+        return self._put(audio, timings, priority)
+
+    def call(self, name: str, args: tuple, priority: str = DEFAULT_PRIORITY) -> Future:
+        """chunked.OPS[name](engine, *args) をワーカーで実行し、その戻り値を返す Future を得る
+
+        音声と同じ優先度クラスのキューに並ぶので、上限（caps）や割り込みの順番も同じになる。
+        """
+        if name not in OPS:
+            raise ValueError(f"Unknown operation: {name}")
+        return self._put((name, args), NULL_TIMINGS, priority)
+
+    def _put(self, payload, timings, priority: str) -> Future:
+        if self._closed:
+            raise RuntimeError("WorkerPool is closed")
+        priority = check_priority(priority)
+        future: Future = Future()
+        task_id = next(self._ids)
+        with self._lock:
+            self._pending[task_id] = (future, timings, priority)
+        self.scheduler.put((task_id, payload, time.perf_counter(), timings.enabled), priority)
+        return future
+
+    def infer_batch(self, clips: List[np.ndarray], timings=NULL_TIMINGS,
+                    priority: str = DEFAULT_PRIORITY) -> np.ndarray:
+        futures = [self.submit(clip, timings, priority) for clip in clips]
+        return np.stack([future.result() for future in futures])
+
+    def _dispatch(self) -> None:
+        """ワーカーが空くたびに、その時点で最も優先度の高いバッチを1つ渡す"""
+        while not self._closed:
+            try:
+                index = self._free.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            taken = None
+            while taken is None and not self._closed:
+                taken = self.scheduler.next_batch(timeout=0.5)
+            if taken is None:
+                self._free.put(index)
+                continue
+            # 待っている間に取り消されたタスクはワーカーに渡さない
+            with self._lock:
+                futures = [self._pending[task[0]][0] for task in taken[1]]
+            batch = [task for task, future in zip(taken[1], futures)
+                     if future.set_running_or_notify_cancel()]
+            self._take([task[0] for task, future in zip(taken[1], futures) if future.cancelled()])
+            if not batch:
+                self._free.put(index)
+                continue
+            # 記録とキューの入れ替え（_check_workers）が食い違わないよう、同じロックの中で渡す
+            with self._lock:
+                self._in_flight[index] = [task[0] for task in batch]
+                self._tasks[index].put(batch)
+
+    def _take(self, ids: List[int]) -> List[Tuple[Future, Timings]]:
+        """終わった（失敗した）タスクを取り出し、優先度クラスの枠を返す"""
+        with self._lock:
+            taken = [self._pending.pop(task_id) for task_id in ids if task_id in self._pending]
+        for priority in {p for _, _, p in taken}:
+            self.scheduler.done(priority, sum(1 for _, _, p in taken if p == priority))
+        return [(future, timings) for future, timings, _ in taken]
+
+    def _read_results(self) -> None:
+        while not (self._closed and not self._pending):
+            try:
+                message = self._results.get(timeout=0.5)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            kind, index = message[0], message[1]
+            with self._lock:
+                self._in_flight.pop(index, None)
+            self._free.put(index)
+            if kind == "error":
+                for future, _ in self._take(message[2]):
+                    if not future.cancelled():
+                        future.set_exception(RuntimeError(message[3]))
+                continue
+
+            _, _, ids, rows, waits, stages = message
+            merged = set()
+            for (future, timings), row, wait in zip(self._take(ids), rows, waits):
+                # 同じリクエストの複数の窓が同じバッチに入っても1回だけ足す
+                if timings.enabled and id(timings) not in merged:
+                    merged.add(id(timings))
+                    timings.add("queue", wait)
+                    for name, (wall, cpu, rss) in stages.items():
+                        timings.add(name, wall, cpu, rss)
+                if not future.cancelled():
+                    future.set_result(row)
+
+    def _check_workers(self) -> None:
+        """落ちたワーカーの推論中のタスクを失敗にして、ワーカーを起動し直す"""
+        if self._closed:
+            return
+        for index, process in enumerate(self._processes):
+            if process.is_alive():
+                continue
+            print(f"ワーカー {index} が終了しました (exitcode={process.exitcode})、再起動します")
+            with self._lock:
+                ids = self._in_flight.pop(index, None)
+                self._processes[index] = self._spawn(index)
+            for future, _ in self._take(ids or []):
+                if not future.cancelled():
+                    future.set_exception(RuntimeError(f"Worker {index} died"))
+            # バッチを渡していたなら、起動し直したワーカーを空きに戻す
+            if ids is not None:
+                self._free.put(index)
+
+    def memory(self) -> List[Dict[str, float]]:
+        """親とワーカーのメモリ使用量（PSS の合計が実際に占めている量）"""
+        return [dict(pid=pid, **_memory(pid))
+                for pid in [os.getpid(), *(p.pid for p in self._processes)]]
+
+    def close(self) -> None:
+        self._closed = True
+        with self._lock:
+            for tasks in self._tasks:
+                tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._dispatcher.join()
+        self.scheduler.drain()
+        with self._lock:
+            pending, self._pending = list(self._pending.values()), {}
+        for future, _, _ in pending:
+            if not future.cancelled():
+                future.set_exception(RuntimeError("WorkerPool is closed"))
+        self._reader.join()
@@ -0,0 +1,76 @@
+'use client';
+
+// 結果の問い合わせ間隔と、諦めるまでの時間
+const POLL_INTERVAL_MS = 1000;
+const POLL_TIMEOUT_MS = 5 * 60 * 1000;
+
+const sleep = (ms: number, signal?: AbortSignal) =>
+  new Promise<void>((resolve, reject) => {
+    const timer = setTimeout(resolve, ms);
+    signal?.addEventListener('abort', () => {
+      clearTimeout(timer);
+      reject(signal.reason);
+    }, { once: true });
+  });
+
+/**
+ * 結果が要らなくなったジョブを取り消す（推論サーバーのワーカーを空ける）
+ *
+ * 画面を離れる途中でも届くよう keepalive で送る。
+ */
+function cancelEmotionJob(jobId: string): void {
+  fetch(`/api/analyze-emotion?jobId=${encodeURIComponent(jobId)}`, {
+    method: 'DELETE',
+    credentials: 'include',
+    keepalive: true,
+  }).catch((error) => console.error('Failed to cancel emotion job:', error));
+}
+
+/**
+ * /api/analyze-emotion に分析を依頼し、結果が出るまで待つ
+ *
+ * 推論はジョブキューで非同期に行われるので、202 が返ったらジョブIDで結果を問い合わせる。
+ * signal で中断する（画面を離れたなど）とジョブも取り消し、AbortError で reject する。
+ * 戻り値は最終的なレスポンス（成功なら { success, emotion, savedToDb }）。
+ */
+export async function requestEmotionAnalysis(
+  body: {
+    recordingId: string;
+    filePath: string;
+    streamSessionId?: string | null;
+  },
+  signal?: AbortSignal
+): Promise<Response> {
+  const response = await fetch('/api/analyze-emotion', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    credentials: 'include',
+    body: JSON.stringify(body),
+    signal,
+  });
+  if (response.status !== 202) {
+    return response;
+  }
+
+  const { jobId } = await response.json();
+  const deadline = Date.now() + POLL_TIMEOUT_MS;
+  try {
+    while (Date.now() < deadline) {
+      await sleep(POLL_INTERVAL_MS, signal);
+      const poll = await fetch(`/api/analyze-emotion?jobId=${encodeURIComponent(jobId)}`, {
+        credentials: 'include',
+        signal,
+      });
+      if (poll.status !== 202) {
+        return poll;
+      }
+    }
+  } catch (error) {
+    if (signal?.aborted) {
+      cancelEmotionJob(jobId);
+    }
+    throw error;
+  }
+  cancelEmotionJob(jobId);
+  return new Response(JSON.stringify({ error: 'Emotion analysis timed out' }), { status: 504 });
+}
@@ -10,12 +10,16 @@ import { cn } from '@/lib/utils';
 
 interface VoiceRecorderProps {
   onRecordingComplete?: (blob: Blob, duration: number) => void;
+  onRecordingStart?: () => void;
+  onChunk?: (chunk: Blob) => void;
   maxDuration?: number;
   className?: string;
 }
 
 export function VoiceRecorder({ 
   onRecordingComplete,
+  onRecordingStart,
+  onChunk,
   maxDuration = 60000,
   className 
 }: VoiceRecorderProps) {
@@ -33,6 +37,8 @@ export function VoiceRecorder({
     stopRecording
   } = useVoiceRecorder({
     maxDuration,
+    onRecordingStart,
+    onChunk,
     onRecordingComplete: async (blob) => {
       setIsProcessing(true);
       try {
@@ -0,0 +1,86 @@
+'use client';
+
+import { useCallback, useRef, useState } from 'react';
+
+export interface StreamedEmotionSegment {
+  segment_id: number;
+  start: number;
+  end: number;
+  duration: number;
+  arousal: number;
+  valence: number;
+  dominance: number;
+  emotion: string;
+}
+
+/**
+ * 録音中のチャンクを /api/analyze-emotion/stream に順番に送り、確定した区間を受け取る
+ *
+ * 録音停止後は finish() で送信待ちのチャンクを送り切ってからセッションIDを返すので、
+ * それを /api/analyze-emotion の streamSessionId に渡す。
+ */
+export function useEmotionStream() {
+  const [segments, setSegments] = useState<StreamedEmotionSegment[]>([]);
+  const sessionRef = useRef<Promise<string | null> | null>(null);
+  const queueRef = useRef<Promise<void>>(Promise.resolve());
+  // チャンクを1つでも送り損ねたら、そのセッションの結果は使わない
+  const failedRef = useRef(false);
+
+  const start = useCallback(() => {
+    setSegments([]);
+    queueRef.current = Promise.resolve();
+    failedRef.current = false;
+    sessionRef.current = fetch('/api/analyze-emotion/stream', {
+      method: 'POST',
+      credentials: 'include',
+    })
+      .then(async (response) => (response.ok ? (await response.json()).sessionId : null))
+      .catch((error) => {
+        // ストリーミングできなくても録音後の通常の分析にフォールバックする
+        console.error('Failed to start emotion stream:', error);
+        return null;
+      });
+  }, []);
+
+  const push = useCallback((chunk: Blob) => {
+    const session = sessionRef.current;
+    if (!session) return;
+    // チャンクの順番が入れ替わらないよう前の送信を待ってから送る
+    queueRef.current = queueRef.current.then(async () => {
+      const sessionId = await session;
+      if (!sessionId) return;
+      try {
+        const response = await fetch(
+          `/api/analyze-emotion/stream?sessionId=${encodeURIComponent(sessionId)}`,
+          {
+            method: 'POST',
+            credentials: 'include',
+            headers: { 'Content-Type': 'application/octet-stream' },
+            body: chunk,
+          }
+        );
+        if (!response.ok) {
+          failedRef.current = true;
+          return;
+        }
+        const result = await response.json();
+        if (result.segments?.length) {
+          setSegments((prev) => [...prev, ...result.segments]);
+        }
+      } catch (error) {
+        console.error('Failed to push emotion stream chunk:', error);
+        failedRef.current = true;
+      }
+    });
+  }, []);
+
+  const finish = useCallback(async (): Promise<string | null> => {
+    const session = sessionRef.current;
+    sessionRef.current = null;
+    if (!session) return null;
+    await queueRef.current;
+    return failedRef.current ? null : session;
+  }, []);
+
+  return { segments, start, push, finish };
+}
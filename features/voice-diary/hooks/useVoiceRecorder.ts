@@ -6,6 +6,8 @@ import { WavRecorder, formatDuration } from '@/lib/mediaRecorder/wavRecorder';
 export interface UseVoiceRecorderOptions {
   maxDuration?: number;
   onRecordingComplete?: (blob: Blob) => void;
+  onRecordingStart?: () => void;
+  onChunk?: (chunk: Blob) => void;
 }
 
 export function useVoiceRecorder(options: UseVoiceRecorderOptions = {}) {
@@ -40,6 +42,10 @@ export function useVoiceRecorder(options: UseVoiceRecorderOptions = {}) {
         onStart: () => {
           setIsRecording(true);
           setIsStarting(false);
+          options.onRecordingStart?.();
+        },
+        onChunk: (chunk) => {
+          options.onChunk?.(chunk);
         }
       });
 
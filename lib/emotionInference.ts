@@ -0,0 +1,151 @@
+/**
+ * 常駐型の感情推論サーバー（emotion_inference.server）のクライアント
+ */
+const EMOTION_SERVICE_URL = process.env.EMOTION_SERVICE_URL || 'http://127.0.0.1:8765';
+
+export type EmotionWindowMode = 'vad' | 'fixed';
+
+export interface AnalyzeEmotionOptions {
+  file?: string;
+  windows?: EmotionWindowMode;
+  trim?: boolean;
+  // この時間（ミリ秒）を過ぎたらサーバーは推論をやめる
+  timeoutMs?: number;
+}
+
+export interface EmotionStreamOptions {
+  owner: string;
+  sampleRate?: number;
+  trim?: boolean;
+  file?: string;
+}
+
+async function serviceRequest(path: string, init: RequestInit): Promise<any> {
+  const response = await fetch(`${EMOTION_SERVICE_URL}${path}`, { ...init, cache: 'no-store' });
+  const result = await response.json();
+  if (!response.ok) {
+    throw new Error(`Emotion service error: ${result.error || response.statusText}`);
+  }
+  return result;
+}
+
+/**
+ * 録音中のストリーミング分析を開始してセッションIDを返す
+ */
+export async function startEmotionStream(
+  { owner, sampleRate = 44100, trim = true, file }: EmotionStreamOptions
+): Promise<string> {
+  const params = new URLSearchParams({ owner, sample_rate: String(sampleRate), trim: trim ? '1' : '0' });
+  if (file) {
+    params.set('file', file);
+  }
+  const { session_id } = await serviceRequest(`/stream?${params}`, { method: 'POST' });
+  return session_id;
+}
+
+/**
+ * 録音チャンク（WAV または 16bit PCM）を追加し、新たに確定した区間を返す
+ */
+export async function pushEmotionStream(
+  sessionId: string,
+  owner: string,
+  chunk: ArrayBuffer
+): Promise<{ segments: any[]; duration: number }> {
+  const params = new URLSearchParams({ owner });
+  return serviceRequest(`/stream/${encodeURIComponent(sessionId)}?${params}`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/octet-stream' },
+    body: chunk,
+  });
+}
+
+/**
+ * 残りの窓を推論して /analyze と同じ形式の結果を返す
+ */
+export async function finishEmotionStream(
+  sessionId: string,
+  owner: string,
+  signal?: AbortSignal
+): Promise<any> {
+  const params = new URLSearchParams({ owner });
+  return serviceRequest(`/stream/${encodeURIComponent(sessionId)}/finish?${params}`, {
+    method: 'POST',
+    signal,
+  });
+}
+
+export class EmotionQueueFullError extends Error {
+  constructor(message: string, public retryAfterSec: number) {
+    super(message);
+  }
+}
+
+export interface EmotionJob {
+  job_id: string;
+  status: 'queued' | 'running' | 'done' | 'acked' | 'failed' | 'cancelled';
+  attempts: number;
+  recording_id?: string | null;
+  position?: number;
+  result?: any;
+  error?: string;
+}
+
+export interface EmotionJobOptions extends AnalyzeEmotionOptions {
+  owner: string;
+  url: string;
+  recordingId?: string;
+}
+
+/**
+ * 分析ジョブを投入してすぐ返る（キューが満杯なら EmotionQueueFullError）
+ */
+export async function enqueueEmotionJob(
+  { owner, url, recordingId, file, windows = 'vad', trim = true, timeoutMs }: EmotionJobOptions
+): Promise<EmotionJob> {
+  const response = await fetch(`${EMOTION_SERVICE_URL}/jobs`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({
+      owner, url, recording_id: recordingId, file, windows, trim, timeout_ms: timeoutMs,
+    }),
+    cache: 'no-store',
+  });
+  const result = await response.json();
+  if (response.status === 503) {
+    throw new EmotionQueueFullError(result.error, Number(response.headers.get('Retry-After')) || 5);
+  }
+  if (!response.ok) {
+    throw new Error(`Emotion job error: ${result.error || response.statusText}`);
+  }
+  return result;
+}
+
+/**
+ * ジョブの状態と（終わっていれば）結果を返す
+ */
+export async function getEmotionJob(jobId: string, owner: string): Promise<EmotionJob> {
+  const params = new URLSearchParams({ owner });
+  return serviceRequest(`/jobs/${encodeURIComponent(jobId)}?${params}`, { method: 'GET' });
+}
+
+/**
+ * 結果を保存する権利を取る（最初の1回だけ true。二重保存を防ぐ）
+ */
+export async function ackEmotionJob(jobId: string, owner: string): Promise<boolean> {
+  const params = new URLSearchParams({ owner });
+  const { acked } = await serviceRequest(`/jobs/${encodeURIComponent(jobId)}/ack?${params}`, {
+    method: 'POST',
+  });
+  return acked;
+}
+
+/**
+ * 待ち・処理中のジョブを取り消す（処理中なら次の段階の切れ目で推論をやめる）
+ */
+export async function cancelEmotionJob(jobId: string, owner: string): Promise<boolean> {
+  const params = new URLSearchParams({ owner });
+  const { cancelled } = await serviceRequest(`/jobs/${encodeURIComponent(jobId)}/cancel?${params}`, {
+    method: 'POST',
+  });
+  return cancelled;
+}
@@ -31,6 +31,7 @@ export interface RecordingOptions {
   onStop?: (blob: Blob) => void;
   onStreamReady?: (stream: MediaStream) => void;
   onStart?: () => void; // MediaRecorder が実際に開始したとき
+  onChunk?: (chunk: Blob) => void; // 1秒ごとのチャンク（録音中のストリーミング分析用）
 }
 
 export class WavRecorder {
@@ -113,6 +114,7 @@ export class WavRecorder {
         if (event.data && event.data.size > 0) {
           this.chunks.push(event.data);
           console.log('✅ Data chunk added, total chunks:', this.chunks.length);
+          this.options.onChunk?.(event.data);
         } else {
           console.warn('⚠️ Empty data chunk received');
         }
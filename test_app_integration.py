@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
 """mental-app-testがVADモデルを正しく呼び出せるか確認"""
-import subprocess
-import json
-import sys
+import io
+import wave
+
+import numpy as np
+
+from emotion_inference.config import IPC_PORT, SERVER_HOST
+from emotion_inference.ipc import IpcClient, IpcError
 
 print("=== mental-app-test統合テスト ===\n")
 
@@ -15,81 +19,35 @@ with open('/Users/komodatomo/Desktop/onsei-laboratory/vad_deeplearning/inference
     else:
         print("   ❌ 補正が有効になっています")
 
-# 2. mental-app-testのAPIと同じPythonコードを実行
-print("\n2. mental-app-testのAPIと同じ方法でテスト:")
+# 2. 常駐サーバーにバイナリIPCで問い合わせる（標準出力から JSON 行を探さない）
+print("\n2. 推論サーバー（emotion_inference.server）にIPCで問い合わせ:")
 
-test_script = """
-import sys
-sys.path.append('/Users/komodatomo/Desktop/onsei-laboratory/vad_deeplearning')
-import librosa
-import soundfile as sf
-from inference import inference_core
-import json
-import numpy as np
-
-# テスト音声を作成
+# テスト音声を作成（1秒の440Hz）
 test_audio = np.sin(2 * np.pi * 440 * np.linspace(0, 1, 16000))
-temp_wav = '/tmp/test_integration.wav'
-sf.write(temp_wav, test_audio, 16000)
-
-# 感情分析実行
-result = inference_core(temp_wav)
+buf = io.BytesIO()
+with wave.open(buf, "wb") as f:
+    f.setnchannels(1)
+    f.setsampwidth(2)
+    f.setframerate(16000)
+    f.writeframes((test_audio * 32767 * 0.5).astype("<i2").tobytes())
 
-if result:
+try:
+    with IpcClient(SERVER_HOST, IPC_PORT) as client:
+        r = client.analyze(audio=buf.getvalue())
     # 最高値の感情を確認
-    emotions = {"ang": result["ang"], "hap": result["hap"], "sad": result["sad"]}
+    emotions = {"ang": r["ang"], "hap": r["hap"], "sad": r["sad"]}
     max_emo = max(emotions, key=emotions.get)
-    
-    print(json.dumps({
-        "success": True,
-        "result": result,
-        "max_emotion": max_emo,
-        "matches_emo": max_emo == result["emo"]
-    }))
-else:
-    print(json.dumps({"success": False, "error": "Analysis failed"}))
-"""
-
-# スクリプトを一時ファイルに保存
-with open('/tmp/test_integration_script.py', 'w') as f:
-    f.write(test_script)
-
-# mental-app-testのAPIと同じ方法で実行
-try:
-    result = subprocess.run(
-        ['python3', '/tmp/test_integration_script.py'],
-        capture_output=True,
-        text=True,
-        cwd='/Users/komodatomo/Desktop/onsei-laboratory/vad_deeplearning'
-    )
-    
-    # 出力から警告を除いてJSONを抽出
-    lines = result.stdout.split('\n')
-    json_line = None
-    for line in lines:
-        if line.startswith('{'):
-            json_line = line
-            break
-    
-    if json_line:
-        data = json.loads(json_line)
-        if data["success"]:
-            r = data["result"]
-            print(f"   ang: {r['ang']:.4f}")
-            print(f"   hap: {r['hap']:.4f}")
-            print(f"   sad: {r['sad']:.4f}")
-            print(f"   判定: {r['emo']}")
-            print(f"   最高値: {data['max_emotion']}")
-            print(f"   一致: {'✅' if data['matches_emo'] else '❌'}")
-        else:
-            print(f"   ❌ エラー: {data.get('error', 'Unknown error')}")
-    else:
-        print("   ❌ JSON出力が見つかりません")
-        print(f"   stdout: {result.stdout}")
-        print(f"   stderr: {result.stderr}")
-        
-except Exception as e:
-    print(f"   ❌ 実行エラー: {e}")
+    print(f"   ang: {r['ang']:.4f}")
+    print(f"   hap: {r['hap']:.4f}")
+    print(f"   sad: {r['sad']:.4f}")
+    print(f"   判定: {r['emo']}")
+    print(f"   最高値: {max_emo}")
+    print(f"   一致: {'✅' if max_emo == r['emo'] else '❌'}")
+except IpcError as e:
+    print(f"   ❌ エラー ({e.code}): {e}")
+except OSError as e:
+    print(f"   ❌ サーバーに接続できません: {e}")
+    print("   python3 -m emotion_inference.server を起動してください")
 
 print("\n3. 結論:")
 print("   mental-app-testは補正なしのVADモデルを正しく使用できます")
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""バッチ推論（バケット分け + attention_mask）が1クリップずつの推論と一致するか確認し、
+パディングで無駄になる計算量を比較する"""
+import time
+
+import numpy as np
+
+from emotion_inference.collate import bucket_by_length, padding_waste
+from emotion_inference.config import SAMPLING_RATE
+from emotion_inference.engine import EmotionEngine
+
+TOLERANCE = 1e-3
+
+# 日記の録音を想定した長さ（2秒〜3分）
+durations = [2.0, 2.5, 4.0, 7.5, 12.0, 30.0, 45.0, 95.0, 180.0]
+rng = np.random.default_rng(0)
+t_max = np.arange(int(max(durations) * SAMPLING_RATE)) / SAMPLING_RATE
+clips = [
+    (0.1 * np.sin(2 * np.pi * (180 + 40 * i) * t_max[:int(d * SAMPLING_RATE)])
+     + rng.normal(0, 0.01, int(d * SAMPLING_RATE))).astype(np.float32)
+    for i, d in enumerate(durations)
+]
+lengths = [len(c) for c in clips]
+
+print("=== パディングによる無駄な計算量 ===\n")
+naive = padding_waste(lengths, [list(range(len(clips)))])
+bucketed_indices = bucket_by_length(lengths)
+bucketed = padding_waste(lengths, bucketed_indices)
+print(f"バケット数: {len(bucketed_indices)}")
+print(f"  最長に合わせる場合: conv {naive['conv_waste']:.1%}, attention {naive['attention_waste']:.1%}")
+print(f"  バケット分けの場合: conv {bucketed['conv_waste']:.1%}, attention {bucketed['attention_waste']:.1%}")
+
+print("\n=== 1クリップずつの推論とバッチ推論の比較 ===\n")
+engine = EmotionEngine.load(device="cpu")
+
+started = time.perf_counter()
+single = np.stack([engine.infer(c) for c in clips])
+single_time = time.perf_counter() - started
+
+started = time.perf_counter()
+batched = engine.infer_batch(clips)
+batched_time = time.perf_counter() - started
+
+diff = np.abs(single - batched).max(axis=1)
+for d, row in zip(durations, diff):
+    print(f"  {d:6.1f}秒: 最大差 {row:.6f} {'✅' if row <= TOLERANCE else '❌'}")
+
+print(f"\n1クリップずつ: {single_time:.2f}s / バッチ: {batched_time:.2f}s")
+print("一致しています！" if diff.max() <= TOLERANCE else "バッチ推論の出力がずれています！")
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""長い録音を区切って分析したとき（chunked.py）、ピークメモリが録音の長さによらず一定か確認する
+
+録音の長さごとに別プロセスで分析し、分析中の最大RSS（/proc/self/status の VmHWM）を比べる。
+比較のため、音声全体を1本の系列として通す場合（inference_core と同じ）も短い録音で測る。
+
+    python test_chunked_memory.py          # 小さなランダム初期化モデルで確認（数分）
+    python test_chunked_memory.py --real   # 実際のチェックポイントで確認
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import wave
+
+# 最長と最短のピークの差がこれ以下なら一定とみなす（MB）
+TOLERANCE_MB = 64
+
+CHUNKED_MINUTES = [1, 5, 10, 20]
+# 全体を1本で通すとすぐにメモリが足りなくなるので短いものだけ
+FULL_MINUTES = [0.5, 1, 2]
+
+
+def peak_rss_mb() -> float:
+    """プロセス開始（またはリセット）以降の最大RSS"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError("VmHWM not available")
+
+
+def child(path: str, mode: str, real: bool, budget_mb: float) -> None:
+    """1つの録音を分析して、ピークRSSを JSON で出力する"""
+    from emotion_inference.audio import WavFileReader, load_audio
+    from emotion_inference.benchmark import make_engine, synthetic_audio
+    from emotion_inference.chunked import analyze_chunked
+    from emotion_inference.timing import current_rss
+
+    with tempfile.TemporaryDirectory() as workdir:
+        engine = make_engine("torch", 1, not real, workdir)
+    # 最初の推論でスレッドプールなどが確保される分は基準に含める
+    engine.analyze(synthetic_audio(8, 0))
+    # 最大RSSを現在の値に戻してから測る
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    baseline = current_rss() / 1024 / 1024
+
+    if mode == "chunked":
+        result = analyze_chunked(engine, WavFileReader(path), budget_mb=budget_mb)
+    else:
+        engine.memory_budget_mb = 0
+        result = engine.analyze(load_audio(path))
+    peak = peak_rss_mb()
+    print(json.dumps(dict(baseline_mb=baseline, peak_mb=peak, ang=result["ang"],
+                          chunks=result.get("chunks", {}).get("count", 1))))
+
+
+def measure(path: str, mode: str, real: bool, budget_mb: float) -> dict:
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", path, "--mode", mode, "--budget-mb", str(budget_mb)]
+        + (["--real"] if real else []),
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--real", action="store_true", help="実際のチェックポイントを使う")
+    parser.add_argument("--budget-mb", type=float, default=None)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", default="chunked", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    # 小さなモデルでは既定の予算だと区切られないので、塊が小さくなる予算にする
+    budget_mb = args.budget_mb or (1024 if args.real else 32)
+    if args.child:
+        child(args.child, args.mode, args.real, budget_mb)
+        return
+
+    import numpy as np
+
+    from emotion_inference.benchmark import synthetic_audio
+
+    print("=== 録音の長さとピークメモリ ===\n")
+    with tempfile.TemporaryDirectory() as tmp:
+        def wav(minutes):
+            path = os.path.join(tmp, f"{minutes}min.wav")
+            if not os.path.exists(path):
+                # ブラウザの録音と同じ 44.1kHz（読み込み時のリサンプリングも含めて測る）。
+                # このプロセスが大きくならないよう30秒ずつ書く
+                with wave.open(path, "wb") as f:
+                    f.setnchannels(1)
+                    f.setsampwidth(2)
+                    f.setframerate(44100)
+                    for i in range(int(minutes * 2)):
+                        audio = synthetic_audio(30, seed=i, sr=44100)
+                        f.writeframes((np.clip(audio, -1, 1) * 32767).astype("<i2").tobytes())
+            return path
+
+        print("全体を1本の系列として推論:")
+        for minutes in FULL_MINUTES:
+            r = measure(wav(minutes), "full", args.real, budget_mb)
+            print(f"  {minutes:5.1f}分: ピーク {r['peak_mb']:7.1f}MB "
+                  f"(推論による増加 {r['peak_mb'] - r['baseline_mb']:7.1f}MB)")
+
+        print("\n区切って推論（chunked.py）:")
+        peaks = []
+        for minutes in CHUNKED_MINUTES:
+            r = measure(wav(minutes), "chunked", args.real, budget_mb)
+            peaks.append(r["peak_mb"])
+            print(f"  {minutes:5.1f}分: ピーク {r['peak_mb']:7.1f}MB "
+                  f"(推論による増加 {r['peak_mb'] - r['baseline_mb']:7.1f}MB, 塊 {r['chunks']}個)")
+
+    spread = max(peaks) - min(peaks)
+    print(f"\n{CHUNKED_MINUTES[0]}分と{CHUNKED_MINUTES[-1]}分のピークの差: {spread:.1f}MB "
+          f"(許容 {TOLERANCE_MB}MB)")
+    if spread <= TOLERANCE_MB:
+        print("ピークメモリは録音の長さによらず一定です！")
+    else:
+        print("録音が長いほどピークメモリが増えています！")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
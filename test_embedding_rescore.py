@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""保存した埋め込みの再スコアリング（embeddings.py）が engine.infer_batch と一致するか確認する
+
+- 推論のついでに保存した埋め込み（engine.embedding_store / backfill の --embeddings）を rescore した値が、
+  同じクリップの engine.infer_batch の出力・判定と一致する
+- 追記は断片を足すだけで、同じキーは後から保存した方が残り、compact 後はメモリマップで読める
+- 書きかけの断片（キーの .json がない）は読まれない
+
+    python test_embedding_rescore.py          # 小さなランダム初期化モデルで確認
+    python test_embedding_rescore.py --real   # 実際のチェックポイントで確認
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from emotion_inference.benchmark import encode_wav, make_engine, synthetic_audio
+from emotion_inference.embeddings import (
+    SHARDS_DIR, EmbeddingStore, load_head_weights, rescore, segment_key,
+)
+from emotion_inference.scoring import judge_batch
+
+# 埋め込みは float16 で保存するので、その丸め分の差は許す
+TOLERANCE = 1e-2
+
+DURATIONS = [1.5, 2.0, 3.0, 4.5, 6.0, 8.0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--real", action="store_true")
+    args = parser.parse_args()
+    failures = []
+
+    def check(ok, message):
+        print(("  OK " if ok else "  NG ") + message)
+        if not ok:
+            failures.append(message)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        engine = make_engine("torch", 1, not args.real, workdir)
+        if args.real:
+            weight, bias = load_head_weights()
+        else:
+            weight = engine.model.fc.weight.detach().numpy()
+            bias = engine.model.fc.bias.detach().numpy()
+        clips = [synthetic_audio(d, seed=i) for i, d in enumerate(DURATIONS)]
+        files = [f"user-{i % 2}/rec_{i}.wav" for i in range(len(clips))]
+        expected = engine.infer_batch(clips)
+
+        print("推論のついでに保存した埋め込み:")
+        store = EmbeddingStore(os.path.join(workdir, "store"))
+        engine.embedding_store = store
+        results = [engine.analyze(clip, file=file) for clip, file in zip(clips, files)]
+        engine.embedding_store = None
+        keys, embeddings = store.load()
+        check(sorted(keys) == sorted(files), f"{len(keys)} 件の断片")
+        order = [keys.index(file) for file in files]
+        scores, labels = rescore(embeddings[order], weight, bias)
+        diff = np.abs(scores - expected[:, :3]).max()
+        check(diff <= TOLERANCE, f"infer_batch との最大差 {diff:.5f}（許容 {TOLERANCE}）")
+        check(list(labels) == list(judge_batch(expected[:, :3])),
+              f"判定が infer_batch と一致 {labels.tolist()}")
+        check(list(labels) == [r["emo"] for r in results], "判定が analyze の結果と一致")
+
+        print("窓ごとの埋め込み（backfill --embeddings と同じキー）:")
+        from emotion_inference.backfill import backfill
+
+        root = os.path.join(workdir, "recordings")
+        for file, clip in zip(files, clips):
+            os.makedirs(os.path.dirname(os.path.join(root, file)), exist_ok=True)
+            with open(os.path.join(root, file), "wb") as f:
+                f.write(encode_wav(clip))
+        segment_store = EmbeddingStore(os.path.join(workdir, "segments"))
+        counts = backfill(engine, root, files, os.path.join(workdir, "out.jsonl"), 1,
+                          mode="fixed", embedding_store=segment_store)
+        n = segment_store.compact()
+        keys, embeddings = segment_store.load()
+        check(isinstance(embeddings, np.memmap), f"compact 後は {n} 件をメモリマップで読む")
+        from emotion_inference.segments import window_clips
+
+        windows = [(file, window_clips(engine.load_audio(os.path.join(root, file)), "fixed")[1])
+                   for file in files]
+        window_keys = [segment_key(file, i + 1) for file, ws in windows for i in range(len(ws))]
+        expected = engine.infer_batch([clip for _, ws in windows for clip in ws])
+        scores, _ = rescore(embeddings[[keys.index(k) for k in window_keys]], weight, bias)
+        diff = np.abs(scores - expected[:, :3]).max()
+        check(counts["done"] == len(files) and diff <= TOLERANCE,
+              f"{len(window_keys)} 窓で infer_batch との最大差 {diff:.5f}")
+
+        print("追記と上書き:")
+        store = EmbeddingStore(os.path.join(workdir, "append"))
+        hidden = embeddings.shape[1]
+        store.save(["a", "b"], np.ones((2, hidden)))
+        store.save(["b", "c"], np.full((2, hidden), 2.0))
+        # 書きかけで止まった断片（.npy だけ）
+        np.save(os.path.join(workdir, "append", SHARDS_DIR, "99999999999999999999-0-000001.npy"),
+                np.zeros((1, hidden)))
+        keys, embeddings = store.load()
+        values = dict(zip(keys, embeddings[:, 0].tolist()))
+        check(values == {"a": 1.0, "b": 2.0, "c": 2.0}, f"後から保存した方が残る {values}")
+        store.compact()
+        keys, embeddings = store.load()
+        check(sorted(keys) == ["a", "b", "c"] and float(embeddings[keys.index("b"), 0]) == 2.0,
+              "compact しても内容は同じ")
+
+    if failures:
+        print(f"\n{len(failures)} 件失敗しました！")
+        sys.exit(1)
+    print("\nすべて成功しました！")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""ONNX / TorchScript に書き出したモデルが eager PyTorch と同じ出力になるか確認する
+
+事前に書き出しておくこと:
+    python3 -m emotion_inference.export --format onnx
+    python3 -m emotion_inference.export --format torchscript
+"""
+import time
+
+import numpy as np
+
+from emotion_inference.config import ONNX_MODEL_PATH, SAMPLING_RATE, TORCHSCRIPT_MODEL_PATH
+from emotion_inference.engine import EmotionEngine
+
+TOLERANCE = 1e-3
+
+rng = np.random.default_rng(0)
+clips = []
+for seconds in [1.0, 3.0, 7.5, 20.0, 60.0]:
+    t = np.arange(int(seconds * SAMPLING_RATE)) / SAMPLING_RATE
+    clips.append((0.1 * np.sin(2 * np.pi * 220 * t)
+                  + rng.normal(0, 0.02, len(t))).astype(np.float32))
+
+
+def measure(backend):
+    started = time.perf_counter()
+    engine = EmotionEngine.load(device="cpu", backend=backend)
+    load_time = time.perf_counter() - started
+    started = time.perf_counter()
+    single = np.stack([engine.infer(c) for c in clips])
+    infer_time = time.perf_counter() - started
+    batched = engine.infer_batch(clips)
+    return load_time, infer_time, single, batched
+
+
+print("=== 書き出したモデルと eager の比較 ===\n")
+load_time, infer_time, eager, eager_batched = measure("torch")
+print(f"torch:       ロード {load_time:.2f}s / 推論 {infer_time:.2f}s")
+
+ok = True
+for backend, path in [("onnx", ONNX_MODEL_PATH), ("torchscript", TORCHSCRIPT_MODEL_PATH)]:
+    if not path.exists():
+        print(f"{backend}: {path} がありません（スキップ）")
+        continue
+    load_time, infer_time, single, batched = measure(backend)
+    diff = max(np.abs(single - eager).max(), np.abs(batched - eager_batched).max())
+    ok = ok and diff <= TOLERANCE
+    print(f"{backend:12s} ロード {load_time:.2f}s / 推論 {infer_time:.2f}s / "
+          f"最大差 {diff:.6f} {'✅' if diff <= TOLERANCE else '❌'}")
+
+print("\n出力は一致しています！" if ok else "\n出力がずれています！")
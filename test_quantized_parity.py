@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""int8量子化モデルと fp32 モデルの ang/hap/sad・判定・速度・メモリを比較する
+
+    python3 test_quantized_parity.py [WAVファイル or ディレクトリ ...]
+
+引数がなければ /tmp/audio_*.wav を使い、それもなければ合成音声で比較する。
+"""
+import glob
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+from emotion_inference.config import EMOTIONS, SAMPLING_RATE
+from emotion_inference.engine import EmotionEngine
+
+
+def collect_files(args):
+    files = []
+    for arg in args:
+        if os.path.isdir(arg):
+            files.extend(sorted(glob.glob(os.path.join(arg, "*.wav"))))
+        else:
+            files.append(arg)
+    return files or sorted(glob.glob("/tmp/audio_*.wav"))
+
+
+def synthetic_clips(n=8):
+    rng = np.random.default_rng(0)
+    clips = []
+    for i in range(n):
+        t = np.arange(int((2 + 2 * i) * SAMPLING_RATE)) / SAMPLING_RATE
+        clip = 0.1 * np.sin(2 * np.pi * (150 + 30 * i) * t) + rng.normal(0, 0.02, len(t))
+        clips.append(clip.astype(np.float32))
+    return clips
+
+
+def state_dict_mb(model):
+    buf = io.BytesIO()
+    torch.save(model.state_dict(), buf)
+    return buf.tell() / 1024 / 1024
+
+
+def run(engine, clips):
+    started = time.perf_counter()
+    raws = np.stack([engine.infer(c) for c in clips])
+    return raws, time.perf_counter() - started
+
+
+files = collect_files(sys.argv[1:])
+if files:
+    print(f"フィクスチャ: {len(files)} ファイル")
+else:
+    print("音声ファイルがないため合成音声で比較します")
+
+print("=== int8量子化の精度・速度比較 ===\n")
+fp32 = EmotionEngine.load(device="cpu")
+int8 = EmotionEngine.load(device="cpu", quantize=True)
+clips = [fp32.load_audio(f) for f in files] if files else synthetic_clips()
+
+fp32_raws, fp32_time = run(fp32, clips)
+int8_raws, int8_time = run(int8, clips)
+
+diff = np.abs(fp32_raws - int8_raws)
+print("ang/hap/sad の差（fp32 - int8）:")
+for i, emo in enumerate(EMOTIONS):
+    print(f"  {emo}: 平均 {diff[:, i].mean():.4f}, 最大 {diff[:, i].max():.4f}")
+
+fp32_emos = [fp32.score(r)["emo"] for r in fp32_raws]
+int8_emos = [int8.score(r)["emo"] for r in int8_raws]
+agree = np.mean([a == b for a, b in zip(fp32_emos, int8_emos)])
+print(f"\n判定（judge）の一致率: {agree:.1%}")
+for name, a, b in zip(files or [f"synthetic_{i}" for i in range(len(clips))], fp32_emos, int8_emos):
+    if a != b:
+        print(f"  ⚠️  {os.path.basename(name)}: fp32={a} int8={b}")
+
+print(f"\n推論時間: fp32 {fp32_time:.2f}s / int8 {int8_time:.2f}s "
+      f"(x{fp32_time / int8_time:.2f})")
+print(f"重みのサイズ: fp32 {state_dict_mb(fp32.model):.0f}MB / int8 {state_dict_mb(int8.model):.0f}MB")
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""ストレージクライアント（storage.py）をローカルの Supabase Storage 代わりのサーバーで確認する
+
+- keep-alive: 何件ダウンロードしても接続はプールの本数までしか張らない
+- Range で指定したバイト範囲だけ読める
+- 503 や転送途中の切断は再試行し、途中から続きを取る
+- prefetch は files の順に返し、1件ずつ読むより速い（サーバーの応答が遅い場合）
+- キーはストレージのURL宛てにだけ付ける
+
+    python test_storage_client.py
+"""
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from emotion_inference.storage import StorageClient, StorageError, object_url
+
+KEY = "service-role-key"
+N_FILES = 24
+# 1リクエストごとのサーバー側の遅延（ネットワークの往復の代わり）
+LATENCY_SEC = 0.05
+
+
+def blob(i: int) -> bytes:
+    return bytes((i * 7 + j) % 251 for j in range(64 * 1024 + i))
+
+
+class FakeStorage(BaseHTTPRequestHandler):
+    """/storage/v1/object/voice-recordings/<path> を返す"""
+
+    protocol_version = "HTTP/1.1"
+    objects = {}
+    connections = 0
+    # (path, Authorization, Range)
+    requests = []
+    # パスごとに残っている失敗（"503" か "drop"）
+    faults = {}
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with self.lock:
+            FakeStorage.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(LATENCY_SEC)
+        path = self.path.split("/voice-recordings/", 1)[-1]
+        with self.lock:
+            FakeStorage.requests.append(
+                (path, self.headers.get("Authorization"), self.headers.get("Range")))
+            fault = self.faults.get(path, []).pop(0) if self.faults.get(path) else None
+        data = self.objects.get(path)
+        if data is None:
+            self._send(404, b'{"error":"not_found"}')
+            return
+        if fault == "503":
+            self._send(503, b"busy", {"Retry-After": "0"})
+            return
+        start, end, status = 0, len(data), 200
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2)) + 1 if match.group(2) else len(data)
+            status = 206
+        body = data[start:end]
+        if fault == "drop":
+            # Content-Length より前で接続を切る
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        headers = {"Content-Range": f"bytes {start}-{end - 1}/{len(data)}"} if match else {}
+        self._send(status, body, headers)
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeStorage)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}/storage/v1/object/voice-recordings"
+    paths = [f"user-{i % 3}/2024-10-26_{i}.wav" for i in range(N_FILES)]
+    FakeStorage.objects = {path: blob(i) for i, path in enumerate(paths)}
+    failures = []
+
+    def check(ok, message):
+        print(("  OK " if ok else "  NG ") + message)
+        if not ok:
+            failures.append(message)
+
+    print("keep-alive:")
+    client = StorageClient(base, KEY, pool_size=2, backoff_sec=0.01)
+    for i, path in enumerate(paths[:8]):
+        assert client.get(object_url(path, base)) == blob(i)
+    stats = client.stats()
+    check(FakeStorage.connections == 1, f"8件を {FakeStorage.connections} 本の接続で取得 {stats}")
+
+    print("Range:")
+    data = client.get(object_url(paths[3], base), start=1000, end=5000)
+    check(data == blob(3)[1000:5000], f"[1000, 5000) の {len(data)} バイト")
+    data = client.get(object_url(paths[3], base), start=60000)
+    check(data == blob(3)[60000:], f"60000 バイト目から最後までの {len(data)} バイト")
+
+    print("再試行:")
+    FakeStorage.faults = {paths[5]: ["503", "drop"]}
+    before = client.stats()["retries"]
+    data = client.get(object_url(paths[5], base))
+    check(data == blob(5), f"503 と途中の切断のあと取得（再試行 {client.stats()['retries'] - before} 回）")
+    half = len(blob(5)) // 2
+    ranges = [r for _, _, r in FakeStorage.requests[-3:]]
+    check(ranges == [None, None, f"bytes={half}-"], f"切断後は続きだけ取得 {ranges}")
+    FakeStorage.faults = {paths[6]: ["503"] * 10}
+    try:
+        client.get(object_url(paths[6], base))
+        check(False, "再試行の上限で StorageError")
+    except StorageError as e:
+        check(e.status == 503, f"再試行の上限で StorageError ({e.status})")
+    FakeStorage.faults = {}
+    try:
+        client.get(object_url("missing.wav", base))
+        check(False, "404 は再試行せず StorageError")
+    except StorageError as e:
+        check(e.status == 404, f"404 は再試行せず StorageError ({e.status})")
+
+    print("prefetch:")
+    urls = [object_url(path, base) for path in paths]
+    started = time.perf_counter()
+    for url in urls:
+        client.get(url)
+    sequential = time.perf_counter() - started
+    client = StorageClient(base, KEY, pool_size=8, backoff_sec=0.01)
+    FakeStorage.connections = 0
+    started = time.perf_counter()
+    results = list(client.prefetch(urls, ahead=8))
+    prefetched = time.perf_counter() - started
+    check([url for url, _, _ in results] == urls
+          and all(data == blob(i) for i, (_, data, _) in enumerate(results)), "urls の順に返す")
+    check(prefetched < sequential / 2,
+          f"1件ずつ {sequential:.2f}s → 先読み {prefetched:.2f}s ({sequential / prefetched:.1f}倍)")
+    check(FakeStorage.connections <= 8, f"接続は {FakeStorage.connections} 本（上限 8）")
+    results = list(client.prefetch([urls[0], object_url("missing.wav", base), urls[1]]))
+    check([error is None for _, _, error in results] == [True, False, True],
+          "失敗したファイルは error を返して続ける")
+
+    print("認証ヘッダー:")
+    FakeStorage.requests.clear()
+    client.get(urls[0])
+    other = StorageClient(None, KEY, backoff_sec=0.01)
+    other.get(urls[0])
+    check(FakeStorage.requests[0][1] == f"Bearer {KEY}", "ストレージのURLにはキーを付ける")
+    check(FakeStorage.requests[1][1] is None, "それ以外（署名付きURLなど）には付けない")
+    lookalikes = [f"{base}-public/{paths[0]}",
+                  base.replace("127.0.0.1", "127.0.0.1.evil", 1) + f"/{paths[0]}",
+                  base.replace("http://", "https://", 1) + f"/{paths[0]}"]
+    check(not any("apikey" in client._headers(url) for url in lookalikes),
+          "前方一致するだけの別のバケット・ホスト・スキームには付けない")
+
+    client.close()
+    other.close()
+    server.shutdown()
+    if failures:
+        print(f"\n{len(failures)} 件失敗しました！")
+        sys.exit(1)
+    print("\nすべて成功しました！")
+
+
+if __name__ == "__main__":
+    main()
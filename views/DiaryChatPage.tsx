@@ -1,10 +1,11 @@
 'use client';
 
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useRouter } from 'next/navigation';
 import { ChatInterface, ChatMessage } from '@/features/diary-chat/components';
 import { UserHeader } from '@/features/voice-diary/components/UserHeader';
 import { VoiceRecorder } from '@/features/voice-diary/components/VoiceRecorder';
+import { requestEmotionAnalysis } from '@/features/voice-diary/actions/analyzeEmotion';
 import { Card } from '@/components/ui/Card';
 import { MessageCircle, ArrowLeft, FileText } from 'lucide-react';
 import Link from 'next/link';
@@ -35,6 +36,10 @@ export function DiaryChatPage({ user, recordingLimit }: DiaryChatPageProps) {
     loadTodayDialogue();
   }, []);
 
+  // 画面を離れたら感情分析の結果待ちをやめ、推論サーバーのジョブも取り消す
+  const emotionAbort = useRef<AbortController | null>(null);
+  useEffect(() => () => emotionAbort.current?.abort(), []);
+
   const loadTodayDialogue = async () => {
     const result = await getTodayDialogue();
 
@@ -56,6 +61,8 @@ export function DiaryChatPage({ user, recordingLimit }: DiaryChatPageProps) {
       const uploadResult = await uploadAudio(blob);
 
       // 2. Call Whisper API and Emotion Analysis in parallel
+      emotionAbort.current?.abort();
+      emotionAbort.current = new AbortController();
       const [whisperResponse, emotionResponse] = await Promise.all([
         fetch('/api/whisper', {
           method: 'POST',
@@ -67,15 +74,10 @@ export function DiaryChatPage({ user, recordingLimit }: DiaryChatPageProps) {
             duration: duration,
           }),
         }),
-        fetch('/api/analyze-emotion', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          credentials: 'include',
-          body: JSON.stringify({
-            recordingId: uploadResult.recordingId,
-            filePath: uploadResult.filePath,
-          }),
-        })
+        requestEmotionAnalysis({
+          recordingId: uploadResult.recordingId,
+          filePath: uploadResult.filePath,
+        }, emotionAbort.current.signal)
       ]);
 
       if (!whisperResponse.ok) {
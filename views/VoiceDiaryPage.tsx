@@ -1,7 +1,9 @@
 'use client';
 
-import { useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import { VoiceRecorder } from '@/features/voice-diary/components/VoiceRecorder';
+import { requestEmotionAnalysis } from '@/features/voice-diary/actions/analyzeEmotion';
+import { useEmotionStream } from '@/features/voice-diary/hooks/useEmotionStream';
 import { UserHeader } from '@/features/voice-diary/components/UserHeader';
 import { Card } from '@/components/ui/Card';
 import { Button } from '@/components/ui/Button';
@@ -135,6 +137,13 @@ export function VoiceDiaryPage({ user, recordingLimit }: VoiceDiaryPageProps) {
     };
   } | null>(null);
 
+  // 録音中にチャンクを送って感情分析を進めておく
+  const emotionStream = useEmotionStream();
+
+  // 画面を離れたら感情分析の結果待ちをやめ、推論サーバーのジョブも取り消す
+  const emotionAbort = useRef<AbortController | null>(null);
+  useEffect(() => () => emotionAbort.current?.abort(), []);
+
   const handleRecordingComplete = async (blob: Blob, duration: number) => {
     console.log('=== Recording Complete ===');
     console.log('Blob size:', blob.size, 'bytes');
@@ -149,11 +158,16 @@ export function VoiceDiaryPage({ user, recordingLimit }: VoiceDiaryPageProps) {
       // 1. Upload to Supabase Storage
       console.log('Step 1: Uploading to Supabase Storage...');
       const { uploadAudio } = await import('@/features/voice-diary/actions/uploadAudio');
-      const uploadResult = await uploadAudio(blob);
+      const [uploadResult, streamSessionId] = await Promise.all([
+        uploadAudio(blob),
+        emotionStream.finish(),
+      ]);
       console.log('Upload result:', uploadResult);
       
       // 2. Call Whisper API and Emotion Analysis API in parallel
       console.log('Step 2: Calling Whisper API and Emotion Analysis API in parallel...');
+      emotionAbort.current?.abort();
+      emotionAbort.current = new AbortController();
       const [whisperResponse, emotionResponse] = await Promise.all([
         // Whisper API
         fetch('/api/whisper', {
@@ -166,16 +180,12 @@ export function VoiceDiaryPage({ user, recordingLimit }: VoiceDiaryPageProps) {
             duration: duration,
           }),
         }),
-        // Emotion Analysis API
-        fetch('/api/analyze-emotion', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          credentials: 'include',
-          body: JSON.stringify({
-            recordingId: uploadResult.recordingId,
-            filePath: uploadResult.filePath,
-          }),
-        })
+        // Emotion Analysis API（ジョブキュー経由なので結果が出るまで問い合わせる）
+        requestEmotionAnalysis({
+          recordingId: uploadResult.recordingId,
+          filePath: uploadResult.filePath,
+          streamSessionId,
+        }, emotionAbort.current.signal)
       ]);
       
       if (!whisperResponse.ok) {
@@ -273,6 +283,8 @@ export function VoiceDiaryPage({ user, recordingLimit }: VoiceDiaryPageProps) {
             <div className="mt-6">
               <VoiceRecorder
                 onRecordingComplete={handleRecordingComplete}
+                onRecordingStart={emotionStream.start}
+                onChunk={emotionStream.push}
                 maxDuration={60000}
               />
             </div>